@@ -0,0 +1,177 @@
+"""
+Access-PIN lookups for KathaPe Customer App
+Connecting to a shop starts with its access PIN. Instead of querying the
+businesses collection on every attempt, each worker keeps a PIN -> business
+index that is built in the background at startup, picks up changed
+businesses incrementally (by $updatedAt) and is rebuilt from scratch every
+BUSINESS_PIN_REBUILD_SECONDS so deleted businesses drop out.
+
+A PIN the index doesn't know is checked against Appwrite once (it may belong
+to a business created since the last refresh); if Appwrite doesn't know it
+either, the miss is cached for BUSINESS_PIN_NEGATIVE_TTL seconds. Failed
+attempts are throttled per customer and remote address, counted in the
+worker rather than the session cookie, so a client can't reset them by
+dropping or replaying its cookie.
+
+The businesses a customer is connected to are cached per customer whenever
+their business list is loaded, so re-entering a known shop's PIN needs no
+remote call at all.
+"""
+import os
+import time
+import threading
+
+from appwrite.query import Query
+
+from appwrite_utils import (
+    appwrite_db_instance, get_business_by_access_pin, BUSINESSES_COLLECTION, PROJECTIONS,
+)
+from fragment_cache import MemoryFragmentCache
+
+BUSINESS_PIN_INDEX_ENABLED = os.getenv('BUSINESS_PIN_INDEX', '1') != '0'
+BUSINESS_PIN_REFRESH_SECONDS = int(os.getenv('BUSINESS_PIN_REFRESH_SECONDS', 60))
+BUSINESS_PIN_REBUILD_SECONDS = int(os.getenv('BUSINESS_PIN_REBUILD_SECONDS', 3600))
+# A business created with a PIN someone just mistyped is found after at most this long
+BUSINESS_PIN_NEGATIVE_TTL = int(os.getenv('BUSINESS_PIN_NEGATIVE_TTL', 60))
+BUSINESS_PIN_MAX_FAILURES = int(os.getenv('BUSINESS_PIN_MAX_FAILURES', 5))
+BUSINESS_PIN_FAILURE_WINDOW = int(os.getenv('BUSINESS_PIN_FAILURE_WINDOW', 300))
+CUSTOMER_CONNECTIONS_TTL = int(os.getenv('CUSTOMER_CONNECTIONS_TTL', 600))
+
+# Only what select_business needs from a business
+INDEXED_FIELDS = PROJECTIONS['pin_index']
+
+
+class AccessPinIndex:
+    """In-memory PIN -> business map, refreshed incrementally from Appwrite"""
+
+    def __init__(self):
+        self._by_pin = {}
+        self._pin_by_id = {}
+        self._watermark = ''
+        self._refreshed_at = 0
+        self._rebuilt_at = 0
+        self._refresh_lock = threading.Lock()
+        self.ready = False
+
+    def __len__(self):
+        return len(self._by_pin)
+
+    def add(self, business):
+        """Index (or re-index) one business document"""
+        entry = {field: business.get(field) for field in INDEXED_FIELDS}
+        business_id, pin = entry['$id'], str(entry['access_pin'] or '').strip()
+        old_pin = self._pin_by_id.get(business_id)
+        if old_pin and old_pin != pin and self._by_pin.get(old_pin, {}).get('$id') == business_id:
+            del self._by_pin[old_pin]
+        if pin:
+            self._by_pin[pin] = entry
+            self._pin_by_id[business_id] = pin
+        self._watermark = max(self._watermark, entry['$updatedAt'] or '')
+
+    def rebuild(self):
+        """Reload every business; the new maps replace the old ones in one step"""
+        fresh = AccessPinIndex()
+        for business in appwrite_db_instance.iter_documents(BUSINESSES_COLLECTION, projection='pin_index'):
+            fresh.add(business)
+        self._by_pin, self._pin_by_id, self._watermark = fresh._by_pin, fresh._pin_by_id, fresh._watermark
+        self._refreshed_at = self._rebuilt_at = time.monotonic()
+        self.ready = True
+        print(f"✓ Access PIN index built ({len(self)} businesses)")
+
+    def refresh(self):
+        """Pick up businesses changed since the newest one already indexed"""
+        queries = [Query.order_asc('$updatedAt')]
+        if self._watermark:
+            queries.insert(0, Query.greater_than_equal('$updatedAt', self._watermark))
+        for business in appwrite_db_instance.iter_documents(BUSINESSES_COLLECTION, queries, projection='pin_index'):
+            self.add(business)
+        self._refreshed_at = time.monotonic()
+
+    def _maintain(self):
+        try:
+            if not self.ready or time.monotonic() - self._rebuilt_at >= BUSINESS_PIN_REBUILD_SECONDS:
+                self.rebuild()
+            else:
+                self.refresh()
+        except Exception as e:
+            print(f"Error refreshing access PIN index: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    def maintain_in_background(self):
+        """Start a rebuild or refresh unless one is already running"""
+        if self._refresh_lock.acquire(blocking=False):
+            threading.Thread(target=self._maintain, name='access-pin-index', daemon=True).start()
+
+    def lookup(self, pin):
+        """Indexed business for pin, or None; kicks off a refresh when the index is due one"""
+        if time.monotonic() - self._refreshed_at >= BUSINESS_PIN_REFRESH_SECONDS:
+            self.maintain_in_background()
+        return self._by_pin.get(pin)
+
+
+access_pin_index = AccessPinIndex()
+_unknown_pins = MemoryFragmentCache(max_entries=4096)
+_customer_connections = MemoryFragmentCache(max_entries=4096)
+_pin_failures = MemoryFragmentCache(max_entries=4096)
+_pin_failures_lock = threading.Lock()
+
+
+def warm_access_pin_index():
+    """Build the index in the background so the first PIN entry doesn't wait for it"""
+    if BUSINESS_PIN_INDEX_ENABLED:
+        access_pin_index.maintain_in_background()
+
+
+def find_business_by_pin(access_pin):
+    """Business for an access PIN, or None. Usually answered from memory."""
+    pin = str(access_pin).strip()
+    if _unknown_pins.get(pin):
+        return None
+    business = access_pin_index.lookup(pin) if BUSINESS_PIN_INDEX_ENABLED else None
+    if business:
+        return business
+    # Not indexed yet, or really unknown: Appwrite decides
+    business = get_business_by_access_pin(pin)
+    if business:
+        access_pin_index.add(business)
+        return business
+    _unknown_pins.set(pin, True, BUSINESS_PIN_NEGATIVE_TTL)
+    return None
+
+
+def _recent_pin_failures(customer_id, remote_addr):
+    cutoff = time.time() - BUSINESS_PIN_FAILURE_WINDOW
+    return [at for at in _pin_failures.get((customer_id, remote_addr)) or () if at > cutoff]
+
+
+def pin_attempts_exceeded(customer_id, remote_addr):
+    """True while this customer has too many recent failed PIN attempts from this address"""
+    return len(_recent_pin_failures(customer_id, remote_addr)) >= BUSINESS_PIN_MAX_FAILURES
+
+
+def record_pin_failure(customer_id, remote_addr):
+    with _pin_failures_lock:
+        failures = _recent_pin_failures(customer_id, remote_addr) + [time.time()]
+        _pin_failures.set((customer_id, remote_addr), failures, BUSINESS_PIN_FAILURE_WINDOW)
+
+
+def remember_customer_connections(customer_id, business_ids):
+    """Cache the full set of businesses a customer is connected to"""
+    _customer_connections.set(customer_id, frozenset(business_ids), CUSTOMER_CONNECTIONS_TTL)
+
+
+def add_customer_connection(customer_id, business_id):
+    connected = _customer_connections.get(customer_id)
+    if connected is not None:
+        remember_customer_connections(customer_id, connected | {business_id})
+
+
+def is_known_connection(customer_id, business_id):
+    """
+    True if the cached set says the customer is already connected to the business.
+    False only means "not known here" (the set may be missing or predate a
+    connection made in another worker), so confirm with Appwrite before creating one.
+    """
+    connected = _customer_connections.get(customer_id)
+    return connected is not None and business_id in connected
@@ -0,0 +1,224 @@
+"""
+Admission control for KathaPe Customer App
+Each worker lets at most ADMISSION_MAX_CONCURRENCY requests into the app at
+once; the rest wait for a slot. Requests are sorted into route classes
+(auth, read, write, upload) and priorities:
+
+- critical: /login and transaction POSTs. They may use the last
+  ADMISSION_RESERVED_SLOTS slots and wait up to
+  ADMISSION_CRITICAL_MAX_QUEUE_SECONDS before they are shed, so a worker
+  whose slots are all stuck still answers instead of hanging until the
+  server's own timeout kills it.
+- low: /api/* and statement exports. They never wait: they are shed with
+  503 Retry-After as soon as no unreserved slot is free, or when their route
+  class has recently been slower than ADMISSION_LATENCY_TARGET.
+- normal: everything else. It waits up to ADMISSION_MAX_QUEUE_SECONDS,
+  including time already spent queued upstream (X-Request-Start), then is shed.
+
+A burst of slow exports or sync calls therefore turns into quick 503s that
+clients retry, instead of a queue that holds up logins until the router
+times out. The server must run more threads than ADMISSION_MAX_CONCURRENCY
+(gunicorn --threads) so that waiting requests are visible here.
+"""
+import os
+import math
+import time
+import threading
+from collections import deque
+
+from werkzeug.wsgi import ClosingIterator
+
+ADMISSION_MAX_CONCURRENCY = int(os.getenv('ADMISSION_MAX_CONCURRENCY', 4))
+ADMISSION_RESERVED_SLOTS = int(os.getenv('ADMISSION_RESERVED_SLOTS', 1))
+ADMISSION_MAX_QUEUE_SECONDS = float(os.getenv('ADMISSION_MAX_QUEUE_SECONDS', 5))
+# Critical requests wait much longer, but still less than gunicorn's --timeout
+ADMISSION_CRITICAL_MAX_QUEUE_SECONDS = float(os.getenv('ADMISSION_CRITICAL_MAX_QUEUE_SECONDS', 30))
+# Low-priority work is shed while its class averages slower than this (seconds)
+ADMISSION_LATENCY_TARGET = float(os.getenv('ADMISSION_LATENCY_TARGET', 3))
+ADMISSION_LATENCY_WINDOW = 10
+ADMISSION_MAX_RETRY_AFTER = 30
+
+# Cheap or probe routes that are never queued or shed
+EXEMPT_PREFIXES = ('/static/', '/health', '/favicon.ico', '/sw.js', '/.well-known/')
+AUTH_PATHS = ('/login', '/register', '/logout')
+LOW_PRIORITY_PREFIXES = ('/api/', '/export/')
+# Recording a payment or credit is the one write a customer must never lose to load
+CRITICAL_POST_PREFIXES = ('/transaction/', '/phonepe_qr_payment/', '/complete_phonepe_payment/')
+
+
+def route_class(method, path, content_type=''):
+    """auth, upload, write or read"""
+    if path in AUTH_PATHS:
+        return 'auth'
+    if content_type.startswith('multipart/form-data') or path == '/api/bill_upload':
+        return 'upload'
+    if method in ('POST', 'PUT', 'PATCH', 'DELETE'):
+        return 'write'
+    return 'read'
+
+
+def route_priority(method, path):
+    """critical, normal or low"""
+    if path == '/login' or (method == 'POST' and path.startswith(CRITICAL_POST_PREFIXES)):
+        return 'critical'
+    if path.startswith(LOW_PRIORITY_PREFIXES):
+        return 'low'
+    return 'normal'
+
+
+def upstream_queue_seconds(environ, now=None):
+    """
+    Time the request spent queued before reaching this worker, from an
+    X-Request-Start header (t=<seconds|milliseconds|microseconds>), else 0
+    """
+    value = environ.get('HTTP_X_REQUEST_START', '')
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        started = float(value)
+    except ValueError:
+        return 0.0
+    # Proxies disagree on the unit; pick the one that lands near the current time
+    while started > 1e11:
+        started /= 1000
+    now = time.time() if now is None else now
+    return max(0.0, now - started) if started > 0 else 0.0
+
+
+class LatencyWindow:
+    """Durations of requests finished in the last ADMISSION_LATENCY_WINDOW seconds"""
+
+    def __init__(self, window=ADMISSION_LATENCY_WINDOW, max_samples=200):
+        self.window = window
+        self._samples = deque(maxlen=max_samples)
+
+    def add(self, duration, now):
+        self._samples.append((now, duration))
+
+    def mean(self, now):
+        while self._samples and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+        if not self._samples:
+            return None
+        return sum(duration for _, duration in self._samples) / len(self._samples)
+
+
+class AdmissionController:
+    """Thread-safe slot accounting shared by every request thread of a worker"""
+
+    def __init__(self, max_concurrency=ADMISSION_MAX_CONCURRENCY, reserved_slots=ADMISSION_RESERVED_SLOTS,
+                 max_queue_seconds=ADMISSION_MAX_QUEUE_SECONDS, latency_target=ADMISSION_LATENCY_TARGET,
+                 critical_max_queue_seconds=ADMISSION_CRITICAL_MAX_QUEUE_SECONDS):
+        self.max_concurrency = max(1, max_concurrency)
+        self.reserved_slots = min(max(0, reserved_slots), self.max_concurrency - 1)
+        self.max_queue_seconds = max_queue_seconds
+        self.critical_max_queue_seconds = critical_max_queue_seconds
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.waiting = 0
+        self.in_flight_by_class = {}
+        self.shed = 0
+        self._latency = {}
+        self._condition = threading.Condition()
+
+    def _limit(self, priority):
+        if priority == 'critical':
+            return self.max_concurrency
+        return self.max_concurrency - self.reserved_slots
+
+    def acquire(self, route, priority, queued=0.0):
+        """Take a slot; returns False when the request should be shed"""
+        limit = self._limit(priority)
+        with self._condition:
+            now = time.monotonic()
+            if priority == 'low':
+                latency = self._latency.get(route)
+                slow = latency is not None and (latency.mean(now) or 0) > self.latency_target
+                if self.in_flight >= limit or slow:
+                    self.shed += 1
+                    return False
+            else:
+                max_wait = self.critical_max_queue_seconds if priority == 'critical' else self.max_queue_seconds
+                deadline = now + max_wait - queued
+                self.waiting += 1
+                try:
+                    while self.in_flight >= limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.shed += 1
+                            return False
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.in_flight_by_class[route] = self.in_flight_by_class.get(route, 0) + 1
+            return True
+
+    def release(self, route, duration):
+        with self._condition:
+            self.in_flight -= 1
+            self.in_flight_by_class[route] -= 1
+            self._latency.setdefault(route, LatencyWindow()).add(duration, time.monotonic())
+            # Waiters have different limits, so let each one re-check
+            self._condition.notify_all()
+
+    def retry_after(self, route):
+        """Seconds until the current backlog has likely drained, from recent latency"""
+        with self._condition:
+            latency = self._latency.get(route)
+            mean = latency.mean(time.monotonic()) if latency else None
+            backlog = (self.in_flight + self.waiting) / self.max_concurrency
+        seconds = math.ceil((mean or 1.0) * max(backlog, 1))
+        return max(1, min(ADMISSION_MAX_RETRY_AFTER, seconds))
+
+    def stats(self):
+        with self._condition:
+            now = time.monotonic()
+            return {
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'shed': self.shed,
+                'in_flight_by_class': dict(self.in_flight_by_class),
+                'latency': {route: window.mean(now) for route, window in self._latency.items()},
+            }
+
+
+class AdmissionControlMiddleware:
+    """
+    WSGI middleware that admits, queues or sheds each request. reject(environ,
+    retry_after) must return a WSGI app that answers with the 503.
+    """
+
+    def __init__(self, app, reject, controller=None):
+        self.app = app
+        self.reject = reject
+        self.controller = controller or AdmissionController()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(EXEMPT_PREFIXES):
+            return self.app(environ, start_response)
+
+        method = environ.get('REQUEST_METHOD', 'GET')
+        route = route_class(method, path, environ.get('CONTENT_TYPE', ''))
+        priority = route_priority(method, path)
+        if not self.controller.acquire(route, priority, upstream_queue_seconds(environ)):
+            retry_after = self.controller.retry_after(route)
+            print(f"Admission control: shed {method} {path} ({route}/{priority}), retry after {retry_after}s")
+            return self.reject(environ, retry_after)(environ, start_response)
+
+        started = time.monotonic()
+        released = []
+
+        def release():
+            # Once per request, after the body has been sent (exports stream)
+            if not released:
+                released.append(True)
+                self.controller.release(route, time.monotonic() - started)
+
+        try:
+            app_iter = self.app(environ, start_response)
+        except BaseException:
+            release()
+            raise
+        return ClosingIterator(app_iter, [release])
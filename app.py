@@ -3,12 +3,33 @@ Customer Flask Application - Handles all customer-related operations
 """
 from appwrite_utils import *
 from appwrite_utils import get_ist_isoformat, get_ist_now, upload_bill_image, get_bill_image_url, format_transaction_date
+from ledger_analytics import get_customer_insights
+from statement_export import statement_rows, parse_statement_date, STATEMENT_FORMATS
+from ledger_sync import sync_changes
+from bill_dedup import compute_dhash, find_duplicate_bill, remember_bill_hash
+from access_pins import (
+    warm_access_pin_index, find_business_by_pin, pin_attempts_exceeded, record_pin_failure,
+    remember_customer_connections, add_customer_connection, is_known_connection,
+)
+from appwrite_async import read_many
+from appwrite_resilience import AppwriteUnavailable
+from server_session import configure_server_session, rotate_session
+from health_checks import readiness
+from compression import CompressionMiddleware, install_precompressed_static
+from admission_control import AdmissionControlMiddleware
+from static_assets import install_asset_pipeline
+from fragment_cache import configure_fragment_cache, dont_cache_fragment
+from ledger_snapshots import load_with_snapshot, within_latency_budget
 import os
 import json
 import datetime
 from werkzeug.utils import secure_filename
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, flash, send_from_directory
+from werkzeug.wrappers import Request
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, session, flash, send_from_directory, make_response, g
 import uuid
+import hashlib
+import itertools
+from jinja2 import FileSystemBytecodeCache
 import logging
 
 # Initialize Appwrite client at app startup
@@ -35,6 +56,9 @@ UPLOAD_FOLDER = 'static/uploads/bills'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
 
+# Mixed into ETags so a new deploy (template/payload changes) never matches old validators
+ETAG_SALT = os.getenv('RENDER_GIT_COMMIT', os.getenv('APP_VERSION', ''))
+
 def allowed_file(filename):
     """Check if the uploaded file has an allowed extension"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -44,6 +68,27 @@ app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 customer_app = app
 
+# Compiled templates persist on disk, so worker restarts skip the Jinja compile step
+JINJA_BYTECODE_CACHE_DIR = os.getenv('JINJA_BYTECODE_CACHE_DIR', os.path.join(customer_app.instance_path, 'jinja_cache'))
+os.makedirs(JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+customer_app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_BYTECODE_CACHE_DIR)
+
+# {% cache %} tag for template sections keyed by the customer's ledger version
+configure_fragment_cache(customer_app)
+
+# Keep session data server-side when SESSION_BACKEND is set; the cookie then carries only a token
+configure_server_session(customer_app)
+
+# PIN -> business index for select_business, built in the background
+warm_access_pin_index()
+
+# No nginx in front on Render: compress HTML/JSON in-app and serve build-time precompressed static files
+customer_app.wsgi_app = CompressionMiddleware(customer_app.wsgi_app)
+install_precompressed_static(customer_app)
+
+# Fingerprinted static URLs (css/style.<hash>.css) served with immutable caching
+install_asset_pipeline(customer_app)
+
 def login_required(f):
     """Decorator to require login"""
     from functools import wraps
@@ -66,6 +111,117 @@ def customer_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def current_ledger_version(customer_id):
+    """Ledger version for this request, fetched from Appwrite at most once"""
+    if 'ledger_version' not in g:
+        # A slow or unreachable validator only costs the fragment cache and the ETag, never the page
+        try:
+            g.ledger_version = within_latency_budget(get_ledger_version, customer_id)
+        except AppwriteUnavailable:
+            g.ledger_version = None
+    return g.ledger_version
+
+def serve_snapshot_if_needed(name, parts, loader):
+    """
+    loader() via the ledger snapshot store. When a snapshot is served instead
+    of live data, g.snapshot_as_of holds its time for the page's notice.
+    """
+    data, as_of = load_with_snapshot(name, parts, loader)
+    if as_of is not None:
+        g.snapshot_as_of = as_of
+        # Stale markup must not be cached under the live ledger version
+        dont_cache_fragment()
+    return data
+
+def load_dashboard_businesses(customer_id):
+    """load_customer_businesses, falling back to the last good copy when Appwrite is down or slow"""
+    return serve_snapshot_if_needed('businesses', [customer_id], lambda: load_customer_businesses(customer_id))
+
+def load_customer_businesses(customer_id):
+    """Businesses the customer has credit with, with balances computed from their transactions"""
+    businesses = []
+    try:
+        credits = [credit for credit in get_customer_credits(customer_id, projection='credit_link') if credit.get('business_id')]
+        
+        # Every business and its transactions are independent reads: fetch them all at once
+        reads = []
+        for credit in credits:
+            business_id = credit['business_id']
+            reads.append(('get', BUSINESSES_COLLECTION, business_id))
+            reads.append(('list', TRANSACTIONS_COLLECTION, [
+                Query.equal('customer_id', customer_id),
+                Query.equal('business_id', business_id),
+                select_query('balance')
+            ]))
+        results = read_many(reads)
+        remember_customer_connections(customer_id, [credit['business_id'] for credit in credits])
+        
+        for index, credit in enumerate(credits):
+            business_id = credit['business_id']
+            business, transactions_data = results[2 * index], results[2 * index + 1]
+            business_name = business.get('name', 'Unknown Business') if business else 'Unknown Business'
+            
+            # Calculate actual balance from transactions
+            credit_received = sum([float(tx.get('amount', 0)) for tx in transactions_data if tx.get('transaction_type') == 'credit'])
+            payments_made = sum([float(tx.get('amount', 0)) for tx in transactions_data if tx.get('transaction_type') == 'payment'])
+            
+            businesses.append({
+                'id': business_id,
+                'business_id': business_id,
+                'name': business_name,
+                'business_name': business_name,
+                'location': business.get('location', '') if business else '',
+                'current_balance': credit_received - payments_made,
+                'updated_at': credit.get('updated_at', credit.get('$updatedAt', ''))
+            })
+    except AppwriteUnavailable:
+        # Without the backend there are no real balances to show; never render zeros instead
+        raise
+    except Exception as e:
+        print(f"Appwrite error loading customer businesses: {str(e)}")
+    return businesses
+
+def ledger_conditional(f):
+    """
+    Answer conditional GETs from the customer's ledger version before running the view.
+    The ETag is derived from the latest credit/transaction change, so an unchanged
+    ledger returns 304 Not Modified without any of the view's Appwrite fan-out.
+    """
+    from functools import wraps
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Pages carrying one-off flash messages must always render fresh
+        if request.method != 'GET' or session.get('_flashes'):
+            return f(*args, **kwargs)
+        
+        customer_id = safe_uuid(session.get('customer_id'))
+        version = current_ledger_version(customer_id)
+        if version is None:
+            return f(*args, **kwargs)
+        
+        etag_source = '|'.join([
+            ETAG_SALT,
+            request.path,
+            customer_id,
+            session.get('user_name', ''),
+            session.get('phone_number', ''),
+            version
+        ])
+        etag = hashlib.sha1(etag_source.encode('utf-8')).hexdigest()
+        
+        if request.if_none_match.contains(etag):
+            response = customer_app.response_class(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+        return response
+    return decorated_function
+
 def format_datetime(value, format='%d %b %Y, %I:%M %p'):
     """Format datetime string"""
     if not value:
@@ -89,6 +245,11 @@ def format_date_filter(value):
     """Format datetime with IST timezone to user-friendly format"""
     return format_transaction_date(value)
 
+@customer_app.template_filter('bill_image')
+def bill_image_filter(public_id):
+    """Responsive variant URLs for a bill image public_id (None for legacy URLs)"""
+    return get_bill_image_variants(public_id)
+
 @customer_app.template_filter('currency')
 def currency_filter(value):
     """Format a number as currency with proper decimal places"""
@@ -101,6 +262,40 @@ def currency_filter(value):
     except (ValueError, TypeError):
         return "₹0.00"
 
+def service_unavailable(req, retry_after):
+    """503 with Retry-After: JSON for API clients, the errors/503.html page otherwise"""
+    if req.path.startswith('/api/') or req.accept_mimetypes.best == 'application/json':
+        response = jsonify({'success': False, 'error': 'Service temporarily unavailable, please retry'})
+    else:
+        response = make_response(render_template('errors/503.html', retry_after=retry_after, retry_url=req.full_path))
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@customer_app.errorhandler(AppwriteUnavailable)
+def appwrite_unavailable(error):
+    """Appwrite is down or overloaded: answer 503 quickly instead of showing empty ledgers"""
+    retry_after = max(1, int(error.retry_after or 5))
+    logger.warning(f"Appwrite unavailable for {request.path}: {error}")
+    return service_unavailable(request, retry_after)
+
+def overloaded_response(environ, retry_after):
+    """Answer for requests shed by admission control; runs outside any request"""
+    with customer_app.app_context():
+        return service_unavailable(Request(environ), retry_after)
+
+# Outermost layer: shed low-priority work under load before it touches sessions or Appwrite
+customer_app.wsgi_app = AdmissionControlMiddleware(customer_app.wsgi_app, overloaded_response)
+
+@customer_app.after_request
+def no_store_snapshots(response):
+    """Pages built from a ledger snapshot are never cached or revalidated"""
+    if g.get('snapshot_as_of') is not None:
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers.pop('ETag', None)
+    return response
+
 # Customer routes
 @customer_app.route('/')
 def index():
@@ -147,6 +342,7 @@ def login():
                     session['user_type'] = 'customer'
                     session['phone_number'] = phone
                     session.permanent = True
+                    rotate_session()
                     
                     # Get customer details
                     customer_data = get_customer_by_user_id(user_id)
@@ -179,6 +375,8 @@ def login():
                     flash('Invalid phone number or password', 'error')
                     return render_template('login.html')
                 
+            except AppwriteUnavailable:
+                raise
             except Exception as e:
                 logger.error(f"Appwrite error in customer login: {str(e)}")
                 flash('Login service temporarily unavailable. Please try again.', 'error')
@@ -187,6 +385,8 @@ def login():
         # GET request
         return render_template('login.html')
         
+    except AppwriteUnavailable:
+        raise
     except Exception as e:
         logger.critical(f"Critical error in customer login: {str(e)}")
         flash('Login error. Please try again.', 'error')
@@ -233,6 +433,7 @@ def register():
                 session['phone_number'] = phone
                 session['user_name'] = name
                 session.permanent = True
+                rotate_session()
                 
                 flash('Registration successful! Welcome to KhataPe!', 'success')
                 return redirect(url_for('customer_dashboard'))
@@ -241,6 +442,8 @@ def register():
                 print(f"❌ Unexpected result structure: {result}")
                 flash(error_msg, 'error')
                 
+        except AppwriteUnavailable:
+            raise
         except Exception as e:
             error_msg = f"Registration error: {str(e)}"
             print(f"❌ Exception during registration: {error_msg}")
@@ -254,94 +457,20 @@ def register():
 @customer_app.route('/dashboard')
 @login_required
 @customer_required
+@ledger_conditional
 def customer_dashboard():
     try:
         customer_id = safe_uuid(session.get('customer_id'))
         print(f"DEBUG: Customer dashboard - customer_id from session: {customer_id}")
         
-        # Get customer details from Appwrite
-        customer = appwrite_db_instance.get_document(CUSTOMERS_COLLECTION, customer_id)
-        
-        if not customer:
-            # Create mock customer object from session data
-            customer = {
-                '$id': customer_id,
-                'name': session.get('user_name', 'Your Name'),
-                'phone_number': session.get('phone_number', '0000000000')
-            }
-            print(f"DEBUG: Using mock customer data: {customer['name']}")
-        else:
-            print(f"DEBUG: Found customer in database: {customer.get('name', 'Unknown')}")
-        
-        # Get customer's credit relationships with businesses
-        credit_relationships = []
-        recent_transactions = []
-        total_balance = 0
-        
-        try:
-            # Get credit relationships
-            credits_data = get_customer_credits(customer_id)
-            print(f"DEBUG: Found {len(credits_data)} credit relationships for customer {customer_id}")
-            
-            for credit in credits_data:
-                business_id = credit['business_id']
-                
-                # Get business details
-                business = appwrite_db_instance.get_document(BUSINESSES_COLLECTION, business_id)
-                business_name = business.get('name', 'Unknown Business') if business else 'Unknown Business'
-                
-                # Calculate actual balance from transactions
-                transactions_data = get_customer_transactions(customer_id, business_id)
-                credit_received = sum([float(tx.get('amount', 0)) for tx in transactions_data if tx.get('transaction_type') == 'credit'])
-                payments_made = sum([float(tx.get('amount', 0)) for tx in transactions_data if tx.get('transaction_type') == 'payment'])
-                actual_balance = credit_received - payments_made
-                
-                print(f"DEBUG: Credit relationship - Business: {business_name}, Actual Balance: {actual_balance}")
-                credit_relationships.append({
-                    'id': business_id,  # Template expects 'id' not 'business_id'
-                    'business_id': business_id,
-                    'name': business_name,  # Template expects 'name' not 'business_name'
-                    'business_name': business_name,
-                    'current_balance': actual_balance,
-                    'updated_at': credit.get('updated_at', credit.get('$updatedAt', ''))
-                })
-                total_balance += actual_balance
-            
-            # Get recent transactions (last 10)
-            all_transactions = get_customer_transactions(customer_id)
-            # Sort by created_at, newest first
-            all_transactions.sort(key=lambda x: x.get('created_at', x.get('$createdAt', '')), reverse=True)
-            
-            for tx in all_transactions[:10]:  # Limit to 10 most recent
-                business_id = tx.get('business_id')
-                business = appwrite_db_instance.get_document(BUSINESSES_COLLECTION, business_id) if business_id else None
-                business_name = business.get('name', 'Unknown Business') if business else 'Unknown Business'
-                
-                recent_transactions.append({
-                    'id': tx.get('$id', tx.get('id')),
-                    'amount': float(tx.get('amount', 0)),
-                    'transaction_type': tx.get('transaction_type'),
-                    'notes': tx.get('notes', ''),
-                    'created_at': tx.get('created_at', tx.get('$createdAt', '')),
-                    'business_name': business_name
-                })
-            
-        except Exception as e:
-            print(f"Appwrite error in customer dashboard: {str(e)}")
-            # Use fallback empty data
-        
-        summary = {
-            'total_balance': total_balance,
-            'business_count': len(credit_relationships)
-        }
-        
+        # The business list is only loaded when its cached fragment is missing or stale
         return render_template('customer/dashboard.html',
-                             customer=customer,
-                             summary=summary,
-                             businesses=credit_relationships,  # Pass as 'businesses' for template
-                             credit_relationships=credit_relationships,
-                             recent_transactions=recent_transactions)
+                             customer_id=customer_id,
+                             ledger_version=current_ledger_version(customer_id),
+                             load_businesses=lambda: load_dashboard_businesses(customer_id))
                              
+    except AppwriteUnavailable:
+        raise
     except Exception as e:
         flash(f'Error loading dashboard: {str(e)}', 'error')
         return redirect(url_for('login'))
@@ -349,29 +478,14 @@ def customer_dashboard():
 @customer_app.route('/businesses')
 @login_required
 @customer_required
+@ledger_conditional
 def businesses():
     customer_id = safe_uuid(session.get('customer_id'))
     
-    # Get all businesses where this customer has credit using Appwrite
-    customer_credits = get_customer_credits(customer_id)
-    
-    # Gather business details
-    businesses = []
-    for credit in customer_credits:
-        business_id = credit.get('business_id')
-        if business_id:
-            business = appwrite_db_instance.get_document(BUSINESSES_COLLECTION, business_id)
-            if business:
-                # Calculate actual balance from transactions
-                transactions = get_customer_transactions(customer_id, business_id)
-                credit_received = sum([float(t.get('amount', 0)) for t in transactions if t.get('transaction_type') == 'credit'])
-                payments_made = sum([float(t.get('amount', 0)) for t in transactions if t.get('transaction_type') == 'payment'])
-                actual_balance = credit_received - payments_made
-                
-                business['current_balance'] = actual_balance
-                businesses.append(business)
-    
-    return render_template('customer/businesses.html', businesses=businesses)
+    return render_template('customer/businesses.html',
+                         customer_id=customer_id,
+                         ledger_version=current_ledger_version(customer_id),
+                         load_businesses=lambda: load_dashboard_businesses(customer_id))
 
 @customer_app.route('/business/<business_id>')
 @login_required
@@ -380,27 +494,27 @@ def business_view(business_id):
     customer_id = safe_uuid(session.get('customer_id'))
     business_id = safe_uuid(business_id)
     
-    # Get business details from Appwrite
-    business = appwrite_db_instance.get_document(BUSINESSES_COLLECTION, business_id)
+    # Business details, credit relationship and transaction history, fetched concurrently
+    business, credits, transactions = serve_snapshot_if_needed('business', [customer_id, business_id], lambda: read_many([
+        ('get', BUSINESSES_COLLECTION, business_id),
+        ('list', CUSTOMER_CREDITS_COLLECTION, [
+            Query.equal('business_id', business_id),
+            Query.equal('customer_id', customer_id)
+        ]),
+        ('list', TRANSACTIONS_COLLECTION, [
+            Query.equal('customer_id', customer_id),
+            Query.equal('business_id', business_id)
+        ]),
+    ]))
     if not business:
         flash('Business not found', 'error')
         return redirect(url_for('customer_dashboard'))
     
-    # Get credit relationship
-    credits = appwrite_db_instance.list_documents(
-        CUSTOMER_CREDITS_COLLECTION,
-        [
-            Query.equal('business_id', business_id),
-            Query.equal('customer_id', customer_id)
-        ]
-    )
     credit = credits[0] if credits else {}
     
-    # Get transaction history with this business
-    transactions = get_customer_transactions(customer_id, business_id)
-    
     # Sort transactions by date, newest first
-    transactions.sort(key=lambda x: x.get('created_at', x.get('$createdAt', '')), reverse=True)
+    # sorted() rather than sort(): the list may be shared with the snapshot store
+    transactions = sorted(transactions, key=lambda x: x.get('created_at', x.get('$createdAt', '')), reverse=True)
     
     # Calculate totals
     credit_received = sum([float(t.get('amount', 0)) for t in transactions if t.get('transaction_type') == 'credit'])
@@ -428,16 +542,20 @@ def select_business():
             flash('Please enter the business access PIN', 'error')
             return render_template('customer/select_business.html')
         
+        customer_id = safe_uuid(session.get('customer_id'))
+        if pin_attempts_exceeded(customer_id, request.remote_addr):
+            flash('Too many incorrect PINs. Please wait a few minutes and try again.', 'error')
+            return render_template('customer/select_business.html'), 429
+        
         try:
-            # Find business by access PIN using Appwrite
-            business = get_business_by_access_pin(access_pin)
+            # PIN lookups come from the in-memory index; mistyped PINs are cached as misses
+            business = find_business_by_pin(access_pin)
             
             if business:
                 business_id = business['$id']
-                customer_id = safe_uuid(session.get('customer_id'))
                 
-                # Check if credit relationship already exists
-                existing_credits = appwrite_db_instance.list_documents(
+                # Check if credit relationship already exists: known connections need no query
+                existing_credits = is_known_connection(customer_id, business_id) or appwrite_db_instance.list_documents(
                     CUSTOMER_CREDITS_COLLECTION,
                     [
                         Query.equal('business_id', business_id),
@@ -449,17 +567,22 @@ def select_business():
                     # Create new credit relationship
                     credit_result = create_customer_credit_relationship(customer_id, business_id)
                     if credit_result:
+                        add_customer_connection(customer_id, business_id)
                         flash(f'Successfully connected to {business["name"]}!', 'success')
                     else:
                         flash('Failed to create connection. Please try again.', 'error')
                         return render_template('customer/select_business.html')
                 else:
+                    add_customer_connection(customer_id, business_id)
                     flash(f'You are already connected to {business["name"]}', 'info')
                 
                 return redirect(url_for('business_view', business_id=business_id))
             else:
+                record_pin_failure(customer_id, request.remote_addr)
                 flash('Invalid access PIN. Please check with the business.', 'error')
                 
+        except AppwriteUnavailable:
+            raise
         except Exception as e:
             flash(f'Error connecting to business: {str(e)}', 'error')
     
@@ -524,7 +647,7 @@ def customer_transaction(transaction_type, business_id):
     print(f"DEBUG: Transaction route called with customer_id: {customer_id}, business_id: {business_id}")
     
     # Validate that customer exists using Appwrite
-    customer_check = appwrite_db_instance.get_document(CUSTOMERS_COLLECTION, customer_id)
+    customer_check = appwrite_db_instance.get_document(CUSTOMERS_COLLECTION, customer_id, projection='name')
     if not customer_check:
         print(f"ERROR: Customer {customer_id} not found in database")
         flash('Customer account not found. Please log in again.', 'error')
@@ -550,7 +673,7 @@ def customer_transaction(transaction_type, business_id):
         return redirect(url_for('customer_dashboard'))
     
     # Calculate current balance for pre-filling payment amount
-    transactions = get_customer_transactions(customer_id, business_id)
+    transactions = get_customer_transactions(customer_id, business_id, projection='balance')
     
     # Calculate current balance
     credit_received = sum([float(t.get('amount', 0)) for t in transactions if t.get('transaction_type') == 'credit'])
@@ -561,9 +684,29 @@ def customer_transaction(transaction_type, business_id):
         amount = request.form.get('amount')
         notes = request.form.get('notes', '')
         
-        # Handle file upload for bill photo  
+        # Double submits and offline replays carry the same key, which maps to the same document id
+        idempotency_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+        transaction_id = idempotent_transaction_id(customer_id, idempotency_key) if idempotency_key else None
+        if transaction_id:
+            existing = appwrite_db_instance.get_document(TRANSACTIONS_COLLECTION, transaction_id)
+            if existing and existing.get('customer_id') == customer_id:
+                print(f"DEBUG: Transaction {transaction_id} already recorded, skipping replay")
+                flash('This transaction was already recorded', 'success')
+                return redirect(url_for('business_view', business_id=business_id))
+        
+        # Bill photo uploaded straight to Cloudinary by the browser: only its public_id comes through here
         bill_file_id = None
-        if 'bill_photo' in request.files:
+        bill_dhash = None
+        if request.form.get('bill_public_id'):
+            bill_file_id = verify_bill_upload(customer_id,
+                                              request.form.get('bill_public_id'),
+                                              request.form.get('bill_version'),
+                                              request.form.get('bill_signature'))
+            if not bill_file_id:
+                flash('Could not verify the bill photo, but transaction will continue', 'warning')
+        
+        # Handle file upload for bill photo (no JavaScript, or the direct upload failed)
+        if not bill_file_id and 'bill_photo' in request.files:
             file = request.files['bill_photo']
             if file and file.filename != '':
                 if allowed_file(file.filename):
@@ -580,11 +723,17 @@ def customer_transaction(transaction_type, business_id):
                                                  transaction_type=transaction_type,
                                                  current_balance=current_balance)
                         
+                        # A retry with the same receipt reuses the photo already on Cloudinary
+                        bill_dhash = compute_dhash(file_data)
+                        bill_file_id = find_duplicate_bill(customer_id, business_id, bill_dhash)
+                        if bill_file_id:
+                            print(f"DEBUG: Reusing bill image {bill_file_id} for a near-duplicate photo")
+                        
                         # Quick image optimization (only if file is large)
                         filename = secure_filename(file.filename)
                         
                         # Only compress if file is over 1MB
-                        if len(file_data) > 1 * 1024 * 1024:
+                        if not bill_file_id and len(file_data) > 1 * 1024 * 1024:
                             try:
                                 from PIL import Image
                                 import io
@@ -595,14 +744,14 @@ def customer_transaction(transaction_type, business_id):
                                 if original_image.mode in ('RGBA', 'LA', 'P'):
                                     original_image = original_image.convert('RGB')
                                 
-                                # Only resize if very large (max 800px for faster processing)
-                                max_size = 800
+                                # Only resize beyond the stored master size; smaller variants come from Cloudinary
+                                max_size = BILL_MASTER_MAX_WIDTH
                                 if original_image.width > max_size or original_image.height > max_size:
                                     original_image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
                                 
-                                # Quick compression
+                                # Keep the master high quality, it is re-encoded once per delivered variant
                                 output = io.BytesIO()
-                                original_image.save(output, format='JPEG', quality=75, optimize=False)
+                                original_image.save(output, format='JPEG', quality=90, optimize=False)
                                 file_data = output.getvalue()
                                 
                                 if not filename.lower().endswith('.jpg'):
@@ -612,11 +761,12 @@ def customer_transaction(transaction_type, business_id):
                                 # If compression fails, use original file
                                 pass
                         
-                        # Generate a temporary transaction ID for the upload
-                        temp_transaction_id = str(uuid.uuid4())
+                        # Tag the upload with the transaction it belongs to (a temporary ID without a key)
+                        temp_transaction_id = transaction_id or str(uuid.uuid4())
                         
                         # Upload to Cloudinary
-                        bill_file_id = upload_bill_image(file_data, filename, temp_transaction_id)
+                        if not bill_file_id:
+                            bill_file_id = upload_bill_image(file_data, filename, temp_transaction_id)
                         
                         if bill_file_id:
                             flash('Bill photo uploaded successfully!', 'success')
@@ -662,13 +812,22 @@ def customer_transaction(transaction_type, business_id):
             print(f"DEBUG: Transaction data: {transaction_data}")
             
             # Insert transaction using Appwrite
-            result = create_transaction(transaction_data)
+            result = create_transaction(transaction_data, transaction_id=transaction_id)
+            if not result and transaction_id:
+                # A concurrent replay of the same submit may have created it first
+                existing = appwrite_db_instance.get_document(TRANSACTIONS_COLLECTION, transaction_id)
+                if existing and existing.get('customer_id') == customer_id:
+                    result = existing
             
             print(f"DEBUG: Insert result: {result}")
             
             if result:
+                # The photo is now referenced by a transaction, so later retries may reuse it
+                if bill_dhash and bill_file_id:
+                    remember_bill_hash(customer_id, business_id, bill_dhash, bill_file_id)
+                
                 # Calculate new balance
-                transactions = get_customer_transactions(customer_id, business_id)
+                transactions = get_customer_transactions(customer_id, business_id, projection='balance')
                 credit_received = sum([float(tx.get('amount', 0)) for tx in transactions if tx.get('transaction_type') == 'credit'])
                 payments_made = sum([float(tx.get('amount', 0)) for tx in transactions if tx.get('transaction_type') == 'payment'])
                 new_balance = credit_received - payments_made
@@ -686,6 +845,8 @@ def customer_transaction(transaction_type, business_id):
                 
         except ValueError:
             flash('Please enter a valid amount', 'error')
+        except AppwriteUnavailable:
+            raise
         except Exception as e:
             flash(f'Error processing transaction: {str(e)}', 'error')
     
@@ -694,6 +855,21 @@ def customer_transaction(transaction_type, business_id):
                          transaction_type=transaction_type,
                          current_balance=current_balance)
 
+@customer_app.route('/api/bill_upload', methods=['POST'])
+@login_required
+@customer_required
+def bill_upload_params():
+    """Short-lived signed parameters for uploading a bill photo directly to Cloudinary"""
+    customer_id = safe_uuid(session.get('customer_id'))
+    
+    try:
+        params = create_bill_upload_params(customer_id)
+        response = jsonify({'success': True, **params})
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @customer_app.route('/phonepe_qr_payment/<business_id>', methods=['POST'])
 @login_required
 @customer_required
@@ -707,60 +883,46 @@ def phonepe_qr_payment(business_id):
             return jsonify({'success': False, 'error': 'Please enter a valid amount'}), 400
         
         # Get business details
-        business_response = query_table('businesses', filters=[('id', 'eq', business_id)])
-        business = business_response.data[0] if business_response and business_response.data else {}
+        business_id = safe_uuid(business_id)
+        business = appwrite_db_instance.get_document(BUSINESSES_COLLECTION, business_id)
         
         if not business:
             return jsonify({'success': False, 'error': 'Business not found'}), 400
         
         # Get customer details
         customer_id = safe_uuid(session.get('customer_id'))
-        customer_response = query_table('customers', filters=[('id', 'eq', customer_id)])
-        customer = customer_response.data[0] if customer_response and customer_response.data else {}
+        customer = appwrite_db_instance.get_document(CUSTOMERS_COLLECTION, customer_id) or {}
+        business_name = business.get('name', 'Business')
         
-        # Create pending transaction record immediately
-        transaction_id = str(uuid.uuid4())
-        pending_transaction_data = {
-            'id': transaction_id,
-            'business_id': business_id,
-            'customer_id': customer_id,
-            'transaction_type': 'payment',
-            'amount': amount,
-            'notes': notes,
-            'status': 'pending_business_approval',
-            'created_at': get_ist_isoformat()
-        }
+        # Persist the pending payment server-side so it survives across devices and the business can see it
+        pending_payment = create_pending_payment(
+            customer_id,
+            business_id,
+            amount,
+            notes=notes,
+            business_name=business_name,
+            customer_name=customer.get('name', session.get('user_name', 'Customer'))
+        )
         
-        # Insert into pending_transactions table (we'll need to create this table)
-        try:
-            # For now, store in session and we'll create proper pending transactions handling
-            session[f'pending_payment_{transaction_id}'] = {
-                'transaction_id': transaction_id,
-                'business_id': business_id,
-                'business_name': business.get('name', 'Business'),
-                'customer_id': customer_id,
-                'customer_name': customer.get('name', session.get('user_name', 'Customer')),
-                'amount': amount,
-                'notes': notes,
-                'created_at': get_ist_isoformat(),
-                'status': 'pending_business_approval'
-            }
-        except Exception as e:
-            print(f"Error storing pending transaction: {e}")
+        if not pending_payment:
+            return jsonify({'success': False, 'error': 'Could not create payment request. Please try again.'}), 500
         
         # Create PhonePe QR scanner deep link
-        phonepe_url = f"phonepe://scan?amount={amount}&merchantName={business.get('name', 'Business')}"
+        phonepe_url = f"phonepe://scan?amount={amount}&merchantName={business_name}"
         
         return jsonify({
             'success': True,
             'phonepe_url': phonepe_url,
-            'transaction_id': transaction_id,
+            'transaction_id': pending_payment['$id'],
             'amount': amount,
-            'business_name': business.get('name', 'Business'),
-            'message': f"Payment request sent! Waiting for {business.get('name', 'Business')} to confirm your ₹{amount} payment.",
-            'status': 'pending_business_approval'
+            'business_name': business_name,
+            'message': f"Payment request sent! Waiting for {business_name} to confirm your ₹{amount} payment.",
+            'status': pending_payment['status'],
+            'expires_at': pending_payment['expires_at']
         })
         
+    except AppwriteUnavailable:
+        raise
     except Exception as e:
         print(f"Error initiating PhonePe QR payment: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -771,31 +933,37 @@ def phonepe_qr_payment(business_id):
 def complete_phonepe_payment(transaction_id):
     """Complete PhonePe payment and directly add to transactions"""
     try:
-        # Get pending payment from session
-        pending_payment = session.get(f'pending_payment_{transaction_id}')
+        customer_id = safe_uuid(session.get('customer_id'))
+        pending_payment = get_pending_payment(transaction_id, customer_id)
         
         if not pending_payment:
             return jsonify({'success': False, 'error': 'Invalid transaction'}), 400
         
-        # Directly add payment to transactions table
-        transaction_data = {
-            'id': str(uuid.uuid4()),
-            'customer_id': pending_payment['customer_id'],
-            'business_id': pending_payment['business_id'],
-            'transaction_type': 'payment',
-            'amount': pending_payment['amount'],
-            'notes': pending_payment.get('notes', 'PhonePe QR Payment'),
-            'created_at': get_ist_isoformat()
-        }
-        
-        # Insert transaction into database
-        insert_result = query_table('transactions', query_type='insert', data=transaction_data)
+        # One ledger entry per pending payment: a double POST or client retry maps to the same document
+        ledger_transaction_id = idempotent_transaction_id(customer_id, f"phonepe:{transaction_id}")
         
-        if not insert_result:
-            return jsonify({'success': False, 'error': 'Failed to add transaction'}), 500
-        
-        # Remove pending payment from session
-        del session[f'pending_payment_{transaction_id}']
+        if pending_payment.get('status') != PENDING_STATUS:
+            existing = appwrite_db_instance.get_document(TRANSACTIONS_COLLECTION, ledger_transaction_id)
+            if pending_payment.get('status') != 'confirmed' or not existing:
+                return jsonify({'success': False, 'error': 'Invalid transaction'}), 400
+        else:
+            # Directly add payment to transactions collection
+            transaction_data = {
+                'customer_id': pending_payment['customer_id'],
+                'business_id': pending_payment['business_id'],
+                'transaction_type': 'payment',
+                'amount': pending_payment['amount'],
+                'notes': pending_payment.get('notes') or 'PhonePe QR Payment'
+            }
+            
+            insert_result = create_transaction(transaction_data, transaction_id=ledger_transaction_id)
+            if not insert_result:
+                # A concurrent submit of the same payment may have created it first (409)
+                existing = appwrite_db_instance.get_document(TRANSACTIONS_COLLECTION, ledger_transaction_id)
+                if not existing or existing.get('customer_id') != customer_id:
+                    return jsonify({'success': False, 'error': 'Failed to add transaction'}), 500
+            
+            update_pending_payment_status(transaction_id, 'confirmed', payment=pending_payment)
         
         return jsonify({
             'success': True,
@@ -804,6 +972,8 @@ def complete_phonepe_payment(transaction_id):
             'redirect_url': url_for('customer_dashboard')
         })
             
+    except AppwriteUnavailable:
+        raise
     except Exception as e:
         print(f"Error completing PhonePe payment: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -815,18 +985,85 @@ def pending_payments():
     """Show customer's pending payments"""
     customer_id = safe_uuid(session.get('customer_id'))
     
-    # Get all pending payments for this customer from session
-    pending_payments = []
-    for key, value in session.items():
-        if key.startswith('pending_payment_') and isinstance(value, dict):
-            if value.get('customer_id') == customer_id:
-                pending_payments.append(value)
+    # Marking stale requests expired is global housekeeping: it runs off the request
+    sweep_expired_pending_payments_in_background()
     
-    # Sort by creation date, newest first
-    pending_payments.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+    # Newest first, filtered to unexpired pending entries whether or not the sweep has run
+    pending_payments = get_customer_pending_payments(customer_id)
     
     return render_template('customer/pending_payments.html', pending_payments=pending_payments)
 
+@customer_app.route('/api/pending_payments/<payment_id>')
+@login_required
+@customer_required
+def api_pending_payment_status(payment_id):
+    customer_id = safe_uuid(session.get('customer_id'))
+    
+    payment = get_pending_payment(payment_id, customer_id)
+    if not payment:
+        return jsonify({'success': False, 'error': 'Payment not found'}), 404
+    
+    return jsonify({
+        'success': True,
+        'id': payment['$id'],
+        'status': payment.get('status'),
+        'amount': payment.get('amount'),
+        'business_id': payment.get('business_id'),
+        'created_at': payment.get('created_at'),
+        'expires_at': payment.get('expires_at'),
+        'completed_at': payment.get('completed_at')
+    })
+
+@customer_app.route('/insights')
+@login_required
+@customer_required
+def insights():
+    """Spending insights computed from the customer's full ledger"""
+    customer_id = safe_uuid(session.get('customer_id'))
+    
+    try:
+        customer_insights = get_customer_insights(customer_id, current_ledger_version(customer_id))
+    except AppwriteUnavailable:
+        raise
+    except Exception as e:
+        logger.error(f"Error computing insights: {str(e)}")
+        flash('Could not load insights right now. Please try again.', 'error')
+        return redirect(url_for('customer_dashboard'))
+    
+    return render_template('customer/insights.html', insights=customer_insights)
+
+@customer_app.route('/export/statement')
+@login_required
+@customer_required
+def export_statement():
+    """Stream the customer's khata as CSV or XLSX, optionally filtered by business and date range"""
+    customer_id = safe_uuid(session.get('customer_id'))
+    business_id = request.args.get('business_id')
+    if business_id:
+        business_id = safe_uuid(business_id)
+    start_date = parse_statement_date(request.args.get('from'))
+    end_date = parse_statement_date(request.args.get('to'))
+    export_format = request.args.get('format', 'csv').lower()
+    
+    if export_format not in STATEMENT_FORMATS:
+        return jsonify({'success': False, 'error': 'Unsupported export format'}), 400
+    if start_date and end_date and start_date > end_date:
+        return jsonify({'success': False, 'error': 'Start date must be before end date'}), 400
+    
+    encoder, mimetype, extension = STATEMENT_FORMATS[export_format]
+    filename = f"khatape_statement_{get_ist_now().strftime('%Y%m%d')}.{extension}"
+    rows = statement_rows(customer_id, business_id, start_date, end_date)
+    # Read the first page before any headers go out, so an outage there is a 503, not a truncated file
+    first_row = next(rows, None)
+    if first_row is not None:
+        rows = itertools.chain([first_row], rows)
+    
+    return Response(encoder(rows), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+
 @customer_app.route('/transaction_history')
 @login_required
 @customer_required
@@ -861,6 +1098,13 @@ def logout():
 def favicon():
     return send_from_directory('static', 'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
+@customer_app.route('/sw.js')
+def service_worker():
+    """Serve the service worker from the site root so its scope covers pages and /api/*"""
+    response = send_from_directory(customer_app.static_folder, 'sw.js', mimetype='application/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @customer_app.route('/.well-known/assetlinks.json')
 def asset_links():
     """Digital Asset Links for Android TWA - Required for Play Store app"""
@@ -889,8 +1133,9 @@ def terms_of_service():
     return render_template('terms.html')
 
 @customer_app.route('/health')
+@customer_app.route('/health/live')
 def health_check():
-    """Health check endpoint for monitoring and load balancers"""
+    """Liveness: the worker is up and serving. Touches no dependency."""
     try:
         # Simple health check - you can add database connectivity check here
         return jsonify({
@@ -905,6 +1150,15 @@ def health_check():
             'timestamp': get_ist_isoformat()
         }), 500
 
+@customer_app.route('/health/ready')
+def readiness_check():
+    """Readiness: 503 while Appwrite or the session store is down, so the load balancer routes around this worker"""
+    report, age = readiness(customer_app)
+    response = jsonify(dict(report, service='KathaPe Customer App', age_seconds=age))
+    response.status_code = 503 if report['status'] == 'unavailable' else 200
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @customer_app.route('/uploads/bills/<filename>')
 @login_required
 @customer_required
@@ -969,23 +1223,22 @@ def debug_cloudinary():
 @customer_app.route('/api/businesses')
 @login_required
 @customer_required
+@ledger_conditional
 def api_businesses():
     customer_id = safe_uuid(session.get('customer_id'))
     
     try:
         # Get businesses with credit relationships
-        credits_response = query_table('customer_credits', filters=[('customer_id', 'eq', customer_id)])
-        customer_credits = credits_response.data if credits_response and credits_response.data else []
+        customer_credits = get_customer_credits(customer_id, projection='credit_link')
         
         businesses = []
         for credit in customer_credits:
             business_id = credit.get('business_id')
             if business_id:
-                business_detail = query_table('businesses', filters=[('id', 'eq', business_id)])
-                if business_detail and business_detail.data:
-                    business = business_detail.data[0]
+                business = appwrite_db_instance.get_document(BUSINESSES_COLLECTION, business_id)
+                if business:
                     businesses.append({
-                        'id': business['id'],
+                        'id': business['$id'],
                         'name': business['name'],
                         'description': business.get('description', ''),
                         'current_balance': float(credit.get('current_balance', 0))
@@ -993,35 +1246,70 @@ def api_businesses():
         
         return jsonify({'success': True, 'businesses': businesses})
         
+    except AppwriteUnavailable:
+        raise
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @customer_app.route('/api/transactions/<business_id>')
 @login_required
 @customer_required
+@ledger_conditional
 def api_transactions(business_id):
     customer_id = safe_uuid(session.get('customer_id'))
     business_id = safe_uuid(business_id)
     
     try:
-        transactions_response = query_table('transactions',
-                                          filters=[('business_id', 'eq', business_id),
-                                                  ('customer_id', 'eq', customer_id)])
-        transactions = transactions_response.data if transactions_response and transactions_response.data else []
+        transactions = get_customer_transactions(customer_id, business_id)
         
         # Format transactions for API response
         api_transactions = []
         for tx in transactions:
             api_transactions.append({
-                'id': tx['id'],
-                'amount': float(tx['amount']) if tx['amount'] else 0,
-                'type': tx['transaction_type'],
+                'id': tx['$id'],
+                'amount': float(tx['amount']) if tx.get('amount') else 0,
+                'type': tx.get('transaction_type'),
                 'notes': tx.get('notes', ''),
-                'date': tx['created_at']
+                'date': tx.get('created_at', tx.get('$createdAt'))
             })
         
         return jsonify({'success': True, 'transactions': api_transactions})
         
+    except AppwriteUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@customer_app.route('/api/sync')
+@login_required
+@customer_required
+def api_sync():
+    """Transactions, credit rows and deletions changed since ?since=<cursor> (everything without one)"""
+    customer_id = safe_uuid(session.get('customer_id'))
+    
+    try:
+        changes = sync_changes(customer_id, request.args.get('since') or None)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except AppwriteUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    response = jsonify({'success': True, **changes})
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
+
+@customer_app.route('/api/insights')
+@login_required
+@customer_required
+def api_insights():
+    customer_id = safe_uuid(session.get('customer_id'))
+    
+    try:
+        return jsonify({'success': True, 'insights': get_customer_insights(customer_id, current_ledger_version(customer_id))})
+    except AppwriteUnavailable:
+        raise
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -1082,27 +1370,30 @@ def view_bill(transaction_id):
             flash('Unauthorized access', 'error')
             return redirect(url_for('customer_dashboard'))
             
-        # Get business details
+        # Get business and customer details together
         business_id = transaction.get('business_id')
-        business = db.get_document(BUSINESSES_COLLECTION, business_id)
+        business, customer = read_many([
+            ('get', BUSINESSES_COLLECTION, business_id),
+            ('get', CUSTOMERS_COLLECTION, customer_id),
+        ])
         
         if not business:
             flash('Business not found', 'error')
             return redirect(url_for('customer_dashboard'))
         
-        # Get customer details
-        customer = db.get_document(CUSTOMERS_COLLECTION, customer_id)
-        
-        # Generate bill image URL if available
+        # Responsive bill image variants if available
+        bill_image = None
         bill_image_url = None
         public_id = transaction.get('receipt_image_url')
         if public_id:
-            bill_image_url = get_bill_image_url(public_id)
+            bill_image = get_bill_image_variants(public_id)
+            bill_image_url = bill_image['full'] if bill_image else get_bill_image_url(public_id)
         
         return render_template('customer/view_bill.html',
                              transaction=transaction,
                              business=business,
                              customer=customer,
+                             bill_image=bill_image,
                              bill_image_url=bill_image_url)
         
     except Exception as e:
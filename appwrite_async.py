@@ -0,0 +1,227 @@
+"""
+Async Appwrite data layer for KathaPe Customer App
+Talks to Appwrite's REST API with an asyncio HTTP client, so a view that
+needs many independent documents (a business and its transactions for every
+credit relationship) can fetch them all concurrently instead of one after
+another. Synchronous views call read_many(), which runs the reads on one
+background event loop per process through one long-lived HTTP client, so
+connections to Appwrite are kept alive across requests; async code can await
+AsyncAppwriteDB.read_many() directly.
+
+httpx is optional; without it ASYNC_APPWRITE_ENABLED is False and callers
+use the synchronous AppwriteDB.
+"""
+import os
+import random
+import asyncio
+import logging
+import threading
+
+from appwrite_utils import (
+    appwrite_db_instance, APPWRITE_ENDPOINT, APPWRITE_PROJECT_ID, APPWRITE_API_KEY, APPWRITE_DATABASE_ID,
+)
+from identity_map import current_identity_map
+from appwrite_resilience import (
+    appwrite_breaker, read_flights, read_key, AppwriteUnavailable, AppwriteTimeout, TRANSIENT_STATUS_CODES,
+    APPWRITE_READ_TIMEOUT, APPWRITE_CONNECT_TIMEOUT, APPWRITE_READ_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+)
+
+try:
+    import httpx
+    # httpx logs every request at INFO; the app log level would print them all
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+except ImportError:
+    httpx = None
+
+# Connections one client may hold open to Appwrite at the same time (read_many shares one per process)
+APPWRITE_ASYNC_CONCURRENCY = int(os.getenv('APPWRITE_ASYNC_CONCURRENCY', 20))
+ASYNC_APPWRITE_ENABLED = httpx is not None and os.getenv('APPWRITE_ASYNC', '1') != '0'
+
+
+class AsyncAppwriteDB:
+    """
+    Async counterpart of AppwriteDB for reads. Use as an async context manager
+    to keep the HTTP client (and its connection pool) for one block:
+
+        async with AsyncAppwriteDB() as db:
+            business, customer = await asyncio.gather(db.get_document(...), db.get_document(...))
+    """
+
+    def __init__(self, concurrency=APPWRITE_ASYNC_CONCURRENCY, timeout=APPWRITE_READ_TIMEOUT):
+        if httpx is None:
+            raise RuntimeError('httpx is required for AsyncAppwriteDB')
+        self.database_id = APPWRITE_DATABASE_ID
+        self._client = httpx.AsyncClient(
+            base_url=f"{APPWRITE_ENDPOINT.rstrip('/')}/databases/{APPWRITE_DATABASE_ID}",
+            headers={
+                'X-Appwrite-Project': APPWRITE_PROJECT_ID,
+                'X-Appwrite-Key': APPWRITE_API_KEY,
+                'Content-Type': 'application/json',
+            },
+            timeout=httpx.Timeout(timeout, connect=APPWRITE_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self._client.aclose()
+
+    async def _get(self, path, params=None):
+        """
+        GET under the same policy as appwrite_resilience.call: shared circuit
+        breaker, retries with decorrelated jitter, AppwriteUnavailable on outages
+        """
+        delay = RETRY_BASE_DELAY
+        for attempt in range(1, APPWRITE_READ_ATTEMPTS + 1):
+            trial = appwrite_breaker.before_call()
+            try:
+                try:
+                    response = await self._client.get(path, params=params)
+                    if response.status_code not in TRANSIENT_STATUS_CODES:
+                        appwrite_breaker.record_success()
+                        return response
+                    error = AppwriteUnavailable(f"Appwrite unavailable: HTTP {response.status_code}")
+                except httpx.TimeoutException as e:
+                    error = AppwriteTimeout(f"Appwrite timed out: {e!r}")
+                except httpx.TransportError as e:
+                    error = AppwriteUnavailable(f"Appwrite unavailable: {e!r}")
+                except Exception:
+                    appwrite_breaker.record_failure()
+                    raise
+                appwrite_breaker.record_failure()
+            finally:
+                if trial:
+                    # However the trial ended (even cancelled), let the next caller probe
+                    appwrite_breaker.end_trial()
+            if attempt == APPWRITE_READ_ATTEMPTS:
+                raise error
+            delay = min(RETRY_MAX_DELAY, random.uniform(RETRY_BASE_DELAY, delay * 3))
+            await asyncio.sleep(delay)
+
+    async def list_documents(self, collection_id, queries=None):
+        """List documents from a collection"""
+        response = await self._get(
+            f"/collections/{collection_id}/documents",
+            params=[('queries[]', query) for query in (queries or [])]
+        )
+        try:
+            response.raise_for_status()
+            return response.json()['documents']
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            print(f"Appwrite error listing documents (async): {e}")
+            return []
+
+    async def get_document(self, collection_id, document_id):
+        """Get a single document by ID"""
+        response = await self._get(f"/collections/{collection_id}/documents/{document_id}")
+        if response.status_code == 404:
+            return None
+        try:
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Appwrite error getting document (async): {e}")
+            return None
+
+    async def read(self, kind, collection_id, argument):
+        """('get', collection, document_id) or ('list', collection, queries)"""
+        if kind == 'get':
+            return await self.get_document(collection_id, argument)
+        return await self.list_documents(collection_id, argument)
+
+    async def read_many(self, reads):
+        """Run every read concurrently; results come back in the order of reads"""
+        return await asyncio.gather(*(self.read(*read) for read in reads))
+
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+_async_db = None
+
+
+def _background_loop():
+    """The event loop every read_many() in this process runs on, started on first use"""
+    global _loop, _loop_pid, _async_db
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            # A forked worker inherits the parent's loop object but not the thread running it
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _async_db = None
+            threading.Thread(target=_loop.run_forever, name='appwrite-async', daemon=True).start()
+        return _loop
+
+
+def run_async(coroutine):
+    """Run a coroutine to completion on the background loop from synchronous code such as a Flask view"""
+    return asyncio.run_coroutine_threadsafe(coroutine, _background_loop()).result()
+
+
+async def _read_many_shared(reads):
+    # Only ever runs on the background loop's thread, so creating the client here needs no lock
+    global _async_db
+    if _async_db is None:
+        _async_db = AsyncAppwriteDB()
+    return await _async_db.read_many(reads)
+
+
+def _read_sync(kind, collection_id, argument):
+    # Callers of this function already lead the read in read_flights
+    if kind == 'get':
+        return appwrite_db_instance.get_document(collection_id, argument, coalesce=False)
+    return appwrite_db_instance.list_documents(collection_id, argument, coalesce=False)
+
+
+def _read_uncoalesced(reads):
+    if ASYNC_APPWRITE_ENABLED and len(reads) > 1:
+        try:
+            return run_async(_read_many_shared(reads))
+        except AppwriteUnavailable:
+            raise
+        except Exception as e:
+            print(f"Async Appwrite reads failed, reading sequentially: {e}")
+    return [_read_sync(*read) for read in reads]
+
+
+def read_many(reads):
+    """
+    Fetch independent documents and lists at the same time from synchronous code.
+    Each read is ('get', collection_id, document_id) or ('list', collection_id, queries);
+    results come back in the same order. Falls back to one read after another
+    when httpx is missing or the event loop cannot be used.
+
+    Reads identical to one another thread already has in flight are not sent
+    again: this call waits for that thread's result after making its own reads.
+    Inside a request, anything already read in that request comes from its identity map.
+    """
+    reads = list(reads)
+    keys = [read_key(*read) for read in reads]
+    identity = current_identity_map()
+    known = {key: identity.get(key) for key in keys if identity is not None and key in identity}
+    unique = {key: read for key, read in zip(keys, reads) if key not in known}
+    flights = {key: read_flights.join(key) for key in unique}
+    leading = [key for key, (flight, leader) in flights.items() if leader]
+    try:
+        values = _read_uncoalesced([unique[key] for key in leading])
+    except BaseException as e:
+        for key in leading:
+            read_flights.finish(key, flights[key][0], error=e)
+        raise
+    results = dict(zip(leading, values))
+    for key, value in results.items():
+        read_flights.finish(key, flights[key][0], result=value)
+    # Only wait on other threads once this thread's own reads are done, so two calls never wait on each other
+    for key, (flight, leader) in flights.items():
+        if not leader:
+            results[key] = flight.wait()
+    if identity is not None:
+        for key, value in results.items():
+            identity.remember(key, value)
+    results.update(known)
+    return [results[key] for key in keys]
@@ -0,0 +1,325 @@
+"""
+Resilience policy for Appwrite calls in KathaPe Customer App
+Every AppwriteDB call goes through call(), which adds:
+
+- a per-operation timeout (the SDK itself never times out),
+- bounded retries with decorrelated jitter, for idempotent reads only,
+- a process-wide circuit breaker that fails fast once too many recent
+  calls failed, then lets a single trial call through after a cool-down.
+
+Identical reads already in flight in another thread are coalesced through
+read_flights: one backend call, with every waiting caller getting its own
+copy of the result (or the same error).
+
+Transient failures (no response, timeouts, 408/429/5xx) raise
+AppwriteUnavailable instead of looking like an empty result, so a view can
+show "try again" rather than a zero balance. Ordinary 4xx answers (not
+found, conflict, invalid query) are re-raised as the SDK's AppwriteException
+and keep their existing handling.
+"""
+import os
+import copy
+import time
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+import appwrite.client
+from appwrite.exception import AppwriteException
+
+APPWRITE_READ_TIMEOUT = float(os.getenv('APPWRITE_READ_TIMEOUT', 5))
+APPWRITE_WRITE_TIMEOUT = float(os.getenv('APPWRITE_WRITE_TIMEOUT', 10))
+APPWRITE_CONNECT_TIMEOUT = float(os.getenv('APPWRITE_CONNECT_TIMEOUT', 3))
+# Total attempts for a read, including the first
+APPWRITE_READ_ATTEMPTS = int(os.getenv('APPWRITE_READ_ATTEMPTS', 3))
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 1.0
+
+# Open the breaker when at least half of the last 20 calls (and no fewer than 10) failed
+BREAKER_WINDOW = int(os.getenv('APPWRITE_BREAKER_WINDOW', 20))
+BREAKER_MIN_CALLS = int(os.getenv('APPWRITE_BREAKER_MIN_CALLS', 10))
+BREAKER_FAILURE_RATIO = float(os.getenv('APPWRITE_BREAKER_FAILURE_RATIO', 0.5))
+BREAKER_OPEN_SECONDS = float(os.getenv('APPWRITE_BREAKER_OPEN_SECONDS', 30))
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Longest a caller waits on an identical read another thread is making: its full retry budget
+APPWRITE_COALESCE_TIMEOUT = float(os.getenv(
+    'APPWRITE_COALESCE_TIMEOUT', APPWRITE_READ_ATTEMPTS * (APPWRITE_READ_TIMEOUT + RETRY_MAX_DELAY)
+))
+
+
+class AppwriteUnavailable(Exception):
+    """Appwrite could not answer: outage, overload or timeout. Safe to retry later."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AppwriteTimeout(AppwriteUnavailable):
+    """Appwrite did not answer within the operation's timeout"""
+
+
+class CircuitOpenError(AppwriteUnavailable):
+    """The breaker is open; the call was not attempted"""
+
+
+class CircuitBreaker:
+    """Thread-safe closed/open/half-open breaker over a sliding window of call outcomes"""
+
+    def __init__(self, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_ratio=BREAKER_FAILURE_RATIO, open_seconds=BREAKER_OPEN_SECONDS):
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.open_seconds = open_seconds
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                return 'open'
+            return 'half-open'
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless a call may go ahead now. Returns True when
+        the call is the half-open trial; the caller must then end_trial() however it ends.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+            if remaining <= 0 and not self._trial_in_flight:
+                # Half-open: exactly one caller probes Appwrite
+                self._trial_in_flight = True
+                return True
+        raise CircuitOpenError('Appwrite circuit breaker is open', retry_after=max(1, round(remaining)))
+
+    def end_trial(self):
+        """Let the next caller probe if the trial ended without recording an outcome"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._outcomes.append(True)
+            if self._opened_at is not None:
+                print("✓ Appwrite circuit breaker closed")
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._outcomes.append(False)
+            if self._opened_at is not None:
+                # Failed trial (or a straggler): stay open for another period
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+                return
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_ratio:
+                print(f"WARNING: Appwrite circuit breaker opened ({failures}/{len(self._outcomes)} recent calls failed)")
+                self._opened_at = time.monotonic()
+                self._outcomes.clear()
+
+    def reset(self):
+        with self._lock:
+            self._outcomes.clear()
+            self._opened_at = None
+            self._trial_in_flight = False
+
+
+# One breaker per worker process, shared by every thread
+appwrite_breaker = CircuitBreaker()
+
+_local = threading.local()
+
+
+class _TimedRequests:
+    """
+    Stands in for the requests module inside appwrite.client: the SDK calls
+    requests.request() with no timeout, so this adds the current operation's
+    timeout and reuses pooled keep-alive connections.
+    """
+
+    def __init__(self):
+        self._sessions = threading.local()
+
+    def request(self, method, url, **kwargs):
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = self._sessions.session = requests.Session()
+        kwargs.setdefault('timeout', (APPWRITE_CONNECT_TIMEOUT, getattr(_local, 'timeout', APPWRITE_WRITE_TIMEOUT)))
+        return session.request(method, url, **kwargs)
+
+
+appwrite.client.requests = _TimedRequests()
+
+
+@contextmanager
+def _operation_timeout(seconds):
+    previous = getattr(_local, 'timeout', None)
+    _local.timeout = seconds
+    try:
+        yield
+    finally:
+        _local.timeout = previous
+
+
+def _is_transient(error):
+    # The SDK raises AppwriteException(e) with code 0 when no response arrived
+    return not error.code or error.code in TRANSIENT_STATUS_CODES
+
+
+def _unavailable(error):
+    if isinstance(error.__context__, requests.Timeout):
+        return AppwriteTimeout(f"Appwrite timed out: {error}")
+    return AppwriteUnavailable(f"Appwrite unavailable: {error}")
+
+
+def call(function, *args, idempotent=False, attempts=None, breaker=appwrite_breaker, **kwargs):
+    """
+    Run one SDK call under the policy. Reads (idempotent=True) get the read
+    timeout and up to APPWRITE_READ_ATTEMPTS attempts (or attempts); writes get one attempt.
+    Raises AppwriteUnavailable for transient failures, AppwriteException for the rest.
+    """
+    timeout = APPWRITE_READ_TIMEOUT if idempotent else APPWRITE_WRITE_TIMEOUT
+    attempts = attempts or (APPWRITE_READ_ATTEMPTS if idempotent else 1)
+    delay = RETRY_BASE_DELAY
+    for attempt in range(1, attempts + 1):
+        trial = breaker.before_call()
+        try:
+            with _operation_timeout(timeout):
+                result = function(*args, **kwargs)
+        except AppwriteException as e:
+            if not _is_transient(e):
+                # Appwrite answered; the request itself was refused
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            error, cause = _unavailable(e), e
+        except (requests.RequestException, KeyError, ValueError) as e:
+            # No usable answer, e.g. the SDK failing on an error page without a Content-Type
+            breaker.record_failure()
+            error, cause = AppwriteUnavailable(f"Appwrite unavailable: {e!r}"), e
+        except Exception:
+            breaker.record_failure()
+            raise
+        else:
+            breaker.record_success()
+            return result
+        finally:
+            if trial:
+                breaker.end_trial()
+        if attempt == attempts:
+            raise error from cause
+        # Decorrelated jitter: spread retries out so callers don't stampede a recovering server
+        delay = min(RETRY_MAX_DELAY, random.uniform(RETRY_BASE_DELAY, delay * 3))
+        time.sleep(delay)
+
+
+class _Flight:
+    """One backend read that other threads may be waiting on"""
+
+    def __init__(self, key=None):
+        self.key = key
+        self.followers = 0
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=APPWRITE_COALESCE_TIMEOUT):
+        if not self._done.wait(timeout):
+            raise AppwriteTimeout(f"Timed out after {timeout}s waiting for an identical Appwrite read")
+        if self.error is not None:
+            raise self.error
+        # Every follower gets its own copy; callers are free to mutate what they read
+        return copy.deepcopy(self.result)
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent reads. The first caller for a key (the
+    leader) makes the call; callers arriving while it runs wait for its result.
+    Lower level: join() a key, and if leading, finish() it with a result or error.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _flight_key(self, key):
+        # Called with the lock held
+        return key
+
+    def join(self, key):
+        """(flight, is_leader) for key"""
+        with self._lock:
+            key = self._flight_key(key)
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+            flight = self._flights[key] = _Flight(key)
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        # No follower can join any more; copy once so the leader may mutate its own result
+        if flight.followers and error is None:
+            result = copy.deepcopy(result)
+        flight.result, flight.error = result, error
+        flight._done.set()
+
+    def do(self, key, function, *args, wait_timeout=APPWRITE_COALESCE_TIMEOUT, **kwargs):
+        """function(*args, **kwargs), shared with every concurrent caller using the same key"""
+        flight, leader = self.join(key)
+        if not leader:
+            return flight.wait(wait_timeout)
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return result
+
+
+def read_key(kind, collection_id, argument):
+    """Coalescing key for ('get', collection, id) or ('list', collection, queries)"""
+    return (kind, collection_id, argument if kind == 'get' else tuple(argument or ()))
+
+
+class ReadFlights(SingleFlight):
+    """
+    SingleFlight for Appwrite reads that never lets a read join one started
+    before a write to the same collection finished: a read that follows a
+    write (e.g. the balance recompute after recording a transaction) must see it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._generations = {}
+
+    def _flight_key(self, key):
+        return key + (self._generations.get(key[1], 0),)
+
+    def wrote(self, collection_id):
+        """Call once a write to collection_id has finished, whatever its outcome"""
+        with self._lock:
+            self._generations[collection_id] = self._generations.get(collection_id, 0) + 1
+
+
+# Shared by AppwriteDB and appwrite_async so sync and async reads coalesce with each other
+read_flights = ReadFlights()
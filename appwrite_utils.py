@@ -8,11 +8,19 @@ from appwrite.services.databases import Databases
 from appwrite.services.account import Account
 from appwrite.query import Query
 from appwrite.exception import AppwriteException
+from appwrite_resilience import call as resilient_call, AppwriteUnavailable, read_flights, read_key
+from identity_map import current_identity_map
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
+import cloudinary.utils
 import uuid
-from datetime import datetime
+import hmac
+import hashlib
+import time
+import threading
+import functools
+from datetime import datetime, timedelta
 import pytz
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -46,6 +54,74 @@ BUSINESSES_COLLECTION = os.getenv('BUSINESSES_COLLECTION_ID', 'businesses')
 CUSTOMERS_COLLECTION = os.getenv('CUSTOMERS_COLLECTION_ID', 'customers')
 CUSTOMER_CREDITS_COLLECTION = os.getenv('CUSTOMER_CREDITS_COLLECTION_ID', 'customer_credits')
 TRANSACTIONS_COLLECTION = os.getenv('TRANSACTIONS_COLLECTION_ID', 'transactions')
+PENDING_PAYMENTS_COLLECTION = os.getenv('PENDING_PAYMENTS_COLLECTION_ID', 'pending_payments')
+DELETED_DOCUMENTS_COLLECTION = os.getenv('DELETED_DOCUMENTS_COLLECTION_ID', 'deleted_documents')
+BILL_IMAGE_HASHES_COLLECTION = os.getenv('BILL_IMAGE_HASHES_COLLECTION_ID', 'bill_image_hashes')
+
+# Deletion tombstones are kept this long; sync cursors older than this need a full resync
+TOMBSTONE_RETENTION_DAYS = int(os.getenv('TOMBSTONE_RETENTION_DAYS', 30))
+TOMBSTONE_PURGE_INTERVAL = int(os.getenv('TOMBSTONE_PURGE_INTERVAL', 3600))  # seconds
+
+# Pending payment lifecycle
+PENDING_PAYMENT_TTL_HOURS = int(os.getenv('PENDING_PAYMENT_TTL_HOURS', 24))
+PENDING_PAYMENT_SWEEP_INTERVAL = int(os.getenv('PENDING_PAYMENT_SWEEP_INTERVAL', 300))  # seconds
+PENDING_STATUS = 'pending_business_approval'
+PENDING_PAYMENT_TRANSITIONS = {
+    PENDING_STATUS: {'confirmed', 'rejected', 'cancelled', 'expired'},
+    'confirmed': set(),
+    'rejected': set(),
+    'cancelled': set(),
+    'expired': set(),
+}
+
+# Bill images are stored once as a high-quality master; every size and format
+# shown to users is derived from it on Cloudinary's CDN
+BILL_MASTER_MAX_WIDTH = 2000
+BILL_MASTER_QUALITY = 'auto:best'
+# Widths offered in srcset, small enough for list thumbnails up to full-screen on tablets
+BILL_IMAGE_WIDTHS = (160, 320, 480, 800, 1200, 1600)
+# Modern encodings offered through <picture>, best first; JPEG is the <img> fallback
+BILL_IMAGE_FORMATS = (('avif', 'image/avif'), ('webp', 'image/webp'))
+BILL_IMAGE_FALLBACK_FORMAT = 'jpg'
+BILL_IMAGE_DEFAULT_WIDTH = 800
+BILL_IMAGE_VARIANT_CACHE_SIZE = int(os.getenv('BILL_IMAGE_VARIANT_CACHE_SIZE', 2048))
+
+# Direct browser-to-Cloudinary bill uploads
+BILL_UPLOAD_FOLDER = 'bill_receipts'
+# How long an issued upload slot may be used (seconds); Cloudinary itself rejects signatures older than an hour
+BILL_UPLOAD_TTL = int(os.getenv('BILL_UPLOAD_TTL', 900))
+# Incoming transformation applied by Cloudinary, matching what upload_bill_image asks for
+BILL_UPLOAD_TRANSFORMATION = f'c_limit,w_{BILL_MASTER_MAX_WIDTH},q_{BILL_MASTER_QUALITY}'
+BILL_UPLOAD_FORMATS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic'}
+BILL_UPLOAD_MAX_BYTES = 16 * 1024 * 1024
+
+# Attribute projections (Query.select) by use case: Appwrite sends, and we
+# decode, only these attributes. Projected documents carry no system
+# attributes unless they are listed here.
+PROJECTIONS = {
+    # Balance sums over a customer's transactions
+    'balance': ('amount', 'transaction_type'),
+    # Existence checks and name lookups
+    'name': ('$id', 'name'),
+    # Linking a customer's credit relationships to businesses
+    'credit_link': ('business_id', 'current_balance', 'updated_at', '$updatedAt'),
+    # Ledger version validators
+    'version': ('$id', '$updatedAt'),
+    # Spending insights (ledger_analytics)
+    'ledger_columns': ('business_id', 'amount', 'transaction_type', 'created_at', '$createdAt'),
+    # Statement exports
+    'statement': ('business_id', 'amount', 'transaction_type', 'notes', 'created_at', '$createdAt'),
+    # Near-duplicate bill photo lookups
+    'bill_hash': ('dhash', 'public_id'),
+    # The access-PIN index
+    'pin_index': ('$id', '$updatedAt', 'name', 'access_pin'),
+}
+
+def select_query(projection, required=()):
+    """Query.select for a PROJECTIONS profile, plus any attributes the caller relies on"""
+    attributes = list(PROJECTIONS[projection])
+    attributes.extend(attribute for attribute in required if attribute not in attributes)
+    return Query.select(attributes)
 
 # Cloudinary Configuration
 cloudinary.config(
@@ -102,38 +178,125 @@ class AppwriteDB:
         self.db = appwrite_db
         self.database_id = APPWRITE_DATABASE_ID
     
-    def list_documents(self, collection_id, queries=None):
-        """List documents from a collection"""
+    # Every call runs under appwrite_resilience: timeouts, retried reads and the
+    # circuit breaker. Outages raise AppwriteUnavailable; refused requests
+    # (not found, conflicts) still return None / [] below.
+    
+    def _read(self, key, coalesce, function, **kwargs):
+        """
+        A read under the resilience policy. Concurrent identical reads share one
+        request to Appwrite; coalesce=False is for callers already leading this read.
+        """
+        if coalesce:
+            return read_flights.do(key, resilient_call, function, idempotent=True, **kwargs)
+        return resilient_call(function, idempotent=True, **kwargs)
+    
+    def list_documents(self, collection_id, queries=None, coalesce=True, projection=None):
+        """List documents from a collection, only the attributes of a PROJECTIONS profile if given"""
+        queries = list(queries or [])
+        if projection:
+            queries.append(select_query(projection))
+        key = read_key('list', collection_id, queries)
+        identity = current_identity_map()
+        if identity is not None and key in identity:
+            return identity.get(key)
         try:
-            if queries is None:
-                queries = []
-            result = self.db.list_documents(
+            result = self._read(
+                key, coalesce,
+                self.db.list_documents,
                 database_id=self.database_id,
                 collection_id=collection_id,
                 queries=queries
             )
-            return result['documents']
         except AppwriteException as e:
             print(f"Appwrite error listing documents: {e}")
             return []
-    
-    def get_document(self, collection_id, document_id):
-        """Get a single document by ID"""
+        if identity is not None:
+            identity.remember(key, result['documents'])
+        return result['documents']
+
+    def iter_documents(self, collection_id, queries=None, page_size=100, projection=None, strict=False):
+        """
+        Yield every matching document, fetching one page at a time
+        using Appwrite cursor pagination so large result sets never sit in memory.
+        A refused page ends the iteration early, or raises with strict=True: callers
+        that must see every document (running balances, the bill GC) pass strict.
+        """
+        base_queries = list(queries or [])
+        if projection:
+            # The cursor needs each page's last $id
+            base_queries.append(select_query(projection, required=('$id',)))
+        cursor = None
+        while True:
+            page_queries = base_queries + [Query.limit(page_size)]
+            if cursor:
+                page_queries.append(Query.cursor_after(cursor))
+            try:
+                result = resilient_call(
+                    self.db.list_documents, idempotent=True,
+                    database_id=self.database_id,
+                    collection_id=collection_id,
+                    queries=page_queries
+                )
+            except AppwriteException as e:
+                print(f"Appwrite error paging documents: {e}")
+                if strict:
+                    raise
+                return
+            documents = result['documents']
+            for document in documents:
+                yield document
+            if len(documents) < page_size:
+                return
+            cursor = documents[-1]['$id']
+
+    def get_document(self, collection_id, document_id, coalesce=True, projection=None):
+        """Get a single document by ID, only the attributes of a PROJECTIONS profile if given"""
+        key = read_key('get', collection_id, document_id)
+        identity = current_identity_map()
+        # A full document already read in this request also answers a projected get
+        if identity is not None and key in identity:
+            return identity.get(key)
+        kwargs = {}
+        if projection:
+            kwargs['queries'] = [select_query(projection)]
+            key = read_key('get', collection_id, (document_id, projection))
         try:
-            result = self.db.get_document(
+            result = self._read(
+                key, coalesce,
+                self.db.get_document,
                 database_id=self.database_id,
                 collection_id=collection_id,
-                document_id=document_id
+                document_id=document_id,
+                **kwargs
             )
-            return result
         except AppwriteException as e:
             print(f"Appwrite error getting document: {e}")
+            if identity is not None and e.code == 404:
+                identity.remember(read_key('get', collection_id, document_id), None)
             return None
+        # Partial documents would answer later full gets, so only full ones are remembered
+        if identity is not None and not projection:
+            identity.remember(key, result)
+        return result
+    
+    def _written(self, collection_id, document_id, result, deleted=False):
+        """Keep coalesced reads and this request's identity map in step with a write"""
+        read_flights.wrote(collection_id)
+        identity = current_identity_map()
+        if identity is None:
+            return
+        if result is None:
+            identity.forget(collection_id, document_id)
+        else:
+            identity.written(collection_id, document_id, None if deleted else result)
     
     def create_document(self, collection_id, document_id, data):
         """Create a new document"""
+        result = None
         try:
-            result = self.db.create_document(
+            result = resilient_call(
+                self.db.create_document,
                 database_id=self.database_id,
                 collection_id=collection_id,
                 document_id=document_id,
@@ -143,11 +306,15 @@ class AppwriteDB:
         except AppwriteException as e:
             print(f"Appwrite error creating document: {e}")
             return None
+        finally:
+            self._written(collection_id, document_id, result)
     
     def update_document(self, collection_id, document_id, data):
         """Update an existing document"""
+        result = None
         try:
-            result = self.db.update_document(
+            result = resilient_call(
+                self.db.update_document,
                 database_id=self.database_id,
                 collection_id=collection_id,
                 document_id=document_id,
@@ -157,11 +324,15 @@ class AppwriteDB:
         except AppwriteException as e:
             print(f"Appwrite error updating document: {e}")
             return None
+        finally:
+            self._written(collection_id, document_id, result)
     
     def delete_document(self, collection_id, document_id):
         """Delete a document"""
+        result = None
         try:
-            result = self.db.delete_document(
+            result = resilient_call(
+                self.db.delete_document,
                 database_id=self.database_id,
                 collection_id=collection_id,
                 document_id=document_id
@@ -170,6 +341,8 @@ class AppwriteDB:
         except AppwriteException as e:
             print(f"Appwrite error deleting document: {e}")
             return None
+        finally:
+            self._written(collection_id, document_id, result, deleted=True)
 
 # Global database instance
 appwrite_db_instance = AppwriteDB()
@@ -206,6 +379,8 @@ def login_user(phone_number, password):
                 return user
         
         return None
+    except AppwriteUnavailable:
+        raise
     except Exception as e:
         print(f"Login error: {e}")
         return None
@@ -269,6 +444,8 @@ def register_user(name, phone_number, password):
         print(f"❌ User creation failed")
         return {'error': 'Failed to create user'}
         
+    except AppwriteUnavailable:
+        raise
     except Exception as e:
         error_msg = f"Registration error: {e}"
         print(f"❌ Exception in register_user: {error_msg}")
@@ -286,6 +463,9 @@ def get_customer_by_user_id(user_id):
             [Query.equal('user_id', user_id)]
         )
         return customers[0] if customers else None
+    except AppwriteUnavailable:
+        # An outage must not look like "no such record"
+        raise
     except Exception as e:
         print(f"Error getting customer: {e}")
         return None
@@ -295,27 +475,35 @@ def get_business_by_access_pin(access_pin):
     try:
         businesses = appwrite_db_instance.list_documents(
             BUSINESSES_COLLECTION,
-            [Query.equal('access_pin', access_pin)]
+            [Query.equal('access_pin', access_pin)],
+            projection='pin_index'
         )
         return businesses[0] if businesses else None
+    except AppwriteUnavailable:
+        # An outage must not look like "no such record"
+        raise
     except Exception as e:
         print(f"Error getting business: {e}")
         return None
 
-def get_customer_credits(customer_id):
-    """Get all credit relationships for a customer"""
+def get_customer_credits(customer_id, projection=None):
+    """Get all credit relationships for a customer, optionally only a PROJECTIONS profile"""
     try:
         credits = appwrite_db_instance.list_documents(
             CUSTOMER_CREDITS_COLLECTION,
-            [Query.equal('customer_id', customer_id)]
+            [Query.equal('customer_id', customer_id)],
+            projection=projection
         )
         return credits
+    except AppwriteUnavailable:
+        # An outage must not look like "no such record"
+        raise
     except Exception as e:
         print(f"Error getting customer credits: {e}")
         return []
 
-def get_customer_transactions(customer_id, business_id=None):
-    """Get transactions for a customer, optionally filtered by business"""
+def get_customer_transactions(customer_id, business_id=None, projection=None):
+    """Get transactions for a customer, optionally filtered by business and projected to a PROJECTIONS profile"""
     try:
         queries = [Query.equal('customer_id', customer_id)]
         if business_id:
@@ -323,17 +511,75 @@ def get_customer_transactions(customer_id, business_id=None):
         
         transactions = appwrite_db_instance.list_documents(
             TRANSACTIONS_COLLECTION,
-            queries
+            queries,
+            projection=projection
         )
         return transactions
+    except AppwriteUnavailable:
+        # An outage must not look like "no such record"
+        raise
     except Exception as e:
         print(f"Error getting transactions: {e}")
         return []
 
-def create_transaction(transaction_data):
-    """Create a new transaction"""
+def get_ledger_version(customer_id):
+    """
+    Cheap validator for a customer's ledger: the most recently changed credit
+    relationship and transaction. Two single-document queries, no aggregation.
+    """
     try:
-        transaction_id = str(uuid.uuid4())
+        latest_credit = appwrite_db_instance.list_documents(
+            CUSTOMER_CREDITS_COLLECTION,
+            [
+                Query.equal('customer_id', customer_id),
+                Query.order_desc('$updatedAt'),
+                Query.limit(1)
+            ],
+            projection='version'
+        )
+        latest_transaction = appwrite_db_instance.list_documents(
+            TRANSACTIONS_COLLECTION,
+            [
+                Query.equal('customer_id', customer_id),
+                Query.order_desc('$updatedAt'),
+                Query.limit(1)
+            ],
+            projection='version'
+        )
+        parts = []
+        for docs in (latest_credit, latest_transaction):
+            doc = docs[0] if docs else {}
+            parts.append(f"{doc.get('$id', '')}@{doc.get('$updatedAt', '')}")
+        return '|'.join(parts)
+    except AppwriteUnavailable:
+        raise
+    except Exception as e:
+        print(f"Error getting ledger version: {e}")
+        return None
+
+def iter_customer_transactions(customer_id, business_id=None, extra_queries=None, page_size=100, projection=None,
+                               strict=False):
+    """Yield every transaction for a customer page by page, oldest first (see AppwriteDB.iter_documents)"""
+    queries = [Query.equal('customer_id', customer_id)]
+    if business_id:
+        queries.append(Query.equal('business_id', business_id))
+    if extra_queries:
+        queries.extend(extra_queries)
+    queries.append(Query.order_asc('$createdAt'))
+    return appwrite_db_instance.iter_documents(TRANSACTIONS_COLLECTION, queries, page_size=page_size,
+                                               projection=projection, strict=strict)
+
+# Namespace for transaction ids derived from client idempotency keys
+TRANSACTION_IDEMPOTENCY_NAMESPACE = uuid.UUID('6f1c2a9e-4b7d-5c3e-9a8f-2d1e0b7c6a54')
+
+def idempotent_transaction_id(customer_id, idempotency_key):
+    """Deterministic transaction id for a client-supplied key, so a replayed submit maps to the same document"""
+    return str(uuid.uuid5(TRANSACTION_IDEMPOTENCY_NAMESPACE, f"{customer_id}:{idempotency_key}"))
+
+def create_transaction(transaction_data, transaction_id=None):
+    """Create a new transaction (with a caller-chosen id when given)"""
+    try:
+        transaction_id = transaction_id or str(uuid.uuid4())
         transaction_data['created_at'] = get_ist_isoformat()
         
         result = appwrite_db_instance.create_document(
@@ -342,6 +588,8 @@ def create_transaction(transaction_data):
             transaction_data
         )
         return result
+    except AppwriteUnavailable:
+        raise
     except Exception as e:
         print(f"Error creating transaction: {e}")
         return None
@@ -386,6 +634,8 @@ def update_customer_credit(customer_id, business_id, new_balance):
                 credit_data
             )
             return result
+    except AppwriteUnavailable:
+        raise
     except Exception as e:
         print(f"Error updating customer credit: {e}")
         return None
@@ -421,30 +671,218 @@ def create_customer_credit_relationship(customer_id, business_id):
             credit_data
         )
         return result
+    except AppwriteUnavailable:
+        raise
     except Exception as e:
         print(f"Error creating credit relationship: {e}")
         return None
 
+# Pending payment functions
+def create_pending_payment(customer_id, business_id, amount, notes='', business_name='', customer_name='', payment_method='phonepe'):
+    """Persist a payment that is waiting for the business to confirm it"""
+    try:
+        now = get_ist_now()
+        payment_id = str(uuid.uuid4())
+        payment_data = {
+            'customer_id': customer_id,
+            'business_id': business_id,
+            'business_name': business_name,
+            'customer_name': customer_name,
+            'amount': amount,
+            'notes': notes,
+            'payment_method': payment_method,
+            'status': PENDING_STATUS,
+            'created_at': now.isoformat(),
+            'expires_at': (now + timedelta(hours=PENDING_PAYMENT_TTL_HOURS)).isoformat()
+        }
+        return appwrite_db_instance.create_document(PENDING_PAYMENTS_COLLECTION, payment_id, payment_data)
+    except AppwriteUnavailable:
+        raise
+    except Exception as e:
+        print(f"Error creating pending payment: {e}")
+        return None
+
+def get_pending_payment(payment_id, customer_id=None):
+    """Get a pending payment, optionally checking it belongs to the given customer"""
+    payment = appwrite_db_instance.get_document(PENDING_PAYMENTS_COLLECTION, payment_id)
+    if payment and customer_id and payment.get('customer_id') != customer_id:
+        return None
+    return payment
+
+def get_customer_pending_payments(customer_id, status=PENDING_STATUS):
+    """Get a customer's unexpired pending payments, newest first"""
+    try:
+        queries = [
+            Query.equal('customer_id', customer_id),
+            Query.order_desc('created_at')
+        ]
+        if status:
+            queries.append(Query.equal('status', status))
+        if status == PENDING_STATUS:
+            queries.append(Query.greater_than('expires_at', get_ist_isoformat()))
+        return list(appwrite_db_instance.iter_documents(PENDING_PAYMENTS_COLLECTION, queries))
+    except AppwriteUnavailable:
+        raise
+    except Exception as e:
+        print(f"Error getting pending payments: {e}")
+        return []
+
+def update_pending_payment_status(payment_id, new_status, payment=None):
+    """Move a pending payment to a new status if the transition is allowed"""
+    try:
+        if payment is None:
+            payment = appwrite_db_instance.get_document(PENDING_PAYMENTS_COLLECTION, payment_id)
+        if not payment:
+            return None
+        current_status = payment.get('status', PENDING_STATUS)
+        if new_status not in PENDING_PAYMENT_TRANSITIONS.get(current_status, set()):
+            print(f"Invalid pending payment transition {current_status} -> {new_status}")
+            return None
+        update_data = {'status': new_status}
+        if not PENDING_PAYMENT_TRANSITIONS.get(new_status):
+            update_data['completed_at'] = get_ist_isoformat()
+        return appwrite_db_instance.update_document(PENDING_PAYMENTS_COLLECTION, payment_id, update_data)
+    except AppwriteUnavailable:
+        raise
+    except Exception as e:
+        print(f"Error updating pending payment: {e}")
+        return None
+
+_last_pending_sweep = 0.0
+_pending_sweep_lock = threading.Lock()
+
+def sweep_expired_pending_payments(force=False):
+    """
+    Mark pending payments past expires_at as expired.
+    Throttled to once per PENDING_PAYMENT_SWEEP_INTERVAL per worker unless forced.
+    Returns the number of payments expired.
+    """
+    global _last_pending_sweep
+    now = time.monotonic()
+    with _pending_sweep_lock:
+        if not force and now - _last_pending_sweep < PENDING_PAYMENT_SWEEP_INTERVAL:
+            return 0
+        _last_pending_sweep = now
+
+    expired_count = 0
+    try:
+        queries = [
+            Query.equal('status', PENDING_STATUS),
+            Query.less_than_equal('expires_at', get_ist_isoformat())
+        ]
+        # Collect ids first: expiring documents while paging would shift the cursor window
+        expired_ids = [doc['$id'] for doc in appwrite_db_instance.iter_documents(PENDING_PAYMENTS_COLLECTION, queries)]
+        for payment_id in expired_ids:
+            if appwrite_db_instance.update_document(PENDING_PAYMENTS_COLLECTION, payment_id, {
+                'status': 'expired',
+                'completed_at': get_ist_isoformat()
+            }):
+                expired_count += 1
+    except Exception as e:
+        print(f"Error sweeping expired pending payments: {e}")
+    return expired_count
+
+def sweep_expired_pending_payments_in_background():
+    """Start sweep_expired_pending_payments on a daemon thread when one is due, so no request waits on it"""
+    global _last_pending_sweep
+    now = time.monotonic()
+    with _pending_sweep_lock:
+        if now - _last_pending_sweep < PENDING_PAYMENT_SWEEP_INTERVAL:
+            return False
+        _last_pending_sweep = now
+    threading.Thread(target=sweep_expired_pending_payments, kwargs={'force': True},
+                     name='pending-payment-sweep', daemon=True).start()
+    return True
+
+# Deletion tombstones
+def record_tombstone(collection_id, document):
+    """Remember that a ledger document was deleted so /api/sync can tell offline clients"""
+    try:
+        return appwrite_db_instance.create_document(DELETED_DOCUMENTS_COLLECTION, str(uuid.uuid4()), {
+            'collection_id': collection_id,
+            'document_id': document['$id'],
+            'customer_id': document.get('customer_id', ''),
+            'business_id': document.get('business_id', ''),
+            'deleted_at': get_ist_isoformat()
+        })
+    except Exception as e:
+        print(f"Error recording tombstone: {e}")
+        return None
+
+def delete_ledger_document(collection_id, document_id):
+    """Delete a transaction or credit relationship, leaving a tombstone behind"""
+    try:
+        document = appwrite_db_instance.get_document(collection_id, document_id)
+        if not document:
+            return None
+        result = appwrite_db_instance.delete_document(collection_id, document_id)
+        if result is None:
+            return None
+        record_tombstone(collection_id, document)
+        return result
+    except Exception as e:
+        print(f"Error deleting ledger document: {e}")
+        return None
+
+_last_tombstone_purge = 0.0
+_tombstone_purge_lock = threading.Lock()
+
+def purge_expired_tombstones(force=False):
+    """
+    Delete tombstones older than TOMBSTONE_RETENTION_DAYS.
+    Throttled to once per TOMBSTONE_PURGE_INTERVAL per worker unless forced.
+    """
+    global _last_tombstone_purge
+    now = time.monotonic()
+    with _tombstone_purge_lock:
+        if not force and now - _last_tombstone_purge < TOMBSTONE_PURGE_INTERVAL:
+            return 0
+        _last_tombstone_purge = now
+
+    purged = 0
+    try:
+        cutoff = (get_ist_now() - timedelta(days=TOMBSTONE_RETENTION_DAYS)).isoformat()
+        # Collect ids first: deleting while paging would shift the cursor window
+        expired_ids = [doc['$id'] for doc in appwrite_db_instance.iter_documents(
+            DELETED_DOCUMENTS_COLLECTION, [Query.less_than('deleted_at', cutoff)]
+        )]
+        for tombstone_id in expired_ids:
+            if appwrite_db_instance.delete_document(DELETED_DOCUMENTS_COLLECTION, tombstone_id) is not None:
+                purged += 1
+    except Exception as e:
+        print(f"Error purging tombstones: {e}")
+    return purged
+
+def purge_expired_tombstones_in_background():
+    """Start purge_expired_tombstones on a daemon thread when one is due, so no request waits on the deletes"""
+    global _last_tombstone_purge
+    now = time.monotonic()
+    with _tombstone_purge_lock:
+        if now - _last_tombstone_purge < TOMBSTONE_PURGE_INTERVAL:
+            return False
+        _last_tombstone_purge = now
+    threading.Thread(target=purge_expired_tombstones, kwargs={'force': True},
+                     name='tombstone-purge', daemon=True).start()
+    return True
+
 def upload_bill_image(file_data, filename, transaction_id):
     """
-    Upload a bill image to Cloudinary with fast auto-optimization
+    Upload a bill image to Cloudinary as a high-quality master
     Returns the public_id if successful, None if failed
     """
     try:
         # Create a unique public ID
         public_id = f"bill_receipts/bill_{transaction_id}_{uuid.uuid4().hex[:8]}"
         
-        # Upload to Cloudinary with fast auto-optimization
+        # Upload to Cloudinary, keeping a high-quality master; delivery variants are derived from it
         result = cloudinary.uploader.upload(
             file_data,
             public_id=public_id,
             resource_type="image",
-            # Let Cloudinary handle optimization automatically
-            quality="auto:good",  # Auto quality for faster uploads
-            fetch_format="auto",  # Auto format selection
-            # Simple transformations for faster processing
-            width=1000,
-            crop="limit",  # Only resize if larger than 1000px
+            quality=BILL_MASTER_QUALITY,
+            # Only resize if larger than the master width
+            width=BILL_MASTER_MAX_WIDTH,
+            crop="limit",
             # Add tags for organization
             tags=["bill_receipt", f"transaction_{transaction_id}"],
             # Disable backup for faster uploads (can enable later if needed)
@@ -457,33 +895,120 @@ def upload_bill_image(file_data, filename, transaction_id):
         print(f"ERROR: Cloudinary error uploading bill image: {e}")
         return None
 
-def get_bill_image_url(public_id):
+def _bill_upload_mac(customer_id, issued_at, nonce):
+    """Binds an upload slot to the customer it was issued to"""
+    secret = (cloudinary.config().api_secret or '').encode('utf-8')
+    message = f"{customer_id}:{issued_at}:{nonce}".encode('utf-8')
+    return hmac.new(secret, message, hashlib.sha256).hexdigest()[:16]
+
+def create_bill_upload_params(customer_id):
     """
-    Get the optimized URL for a bill image from Cloudinary
+    Signed parameters for uploading one bill photo straight from the browser to Cloudinary.
+    The public_id is fixed by the server and carries the issue time and an HMAC for the
+    customer, so verify_bill_upload can check scope and age without storing anything.
+    """
+    config = cloudinary.config()
+    issued_at = int(time.time())
+    nonce = uuid.uuid4().hex[:12]
+    public_id = f"{BILL_UPLOAD_FOLDER}/bill_{issued_at}_{nonce}_{_bill_upload_mac(customer_id, issued_at, nonce)}"
+    params = {
+        'public_id': public_id,
+        'timestamp': issued_at,
+        'tags': 'bill_receipt,direct_upload',
+        'transformation': BILL_UPLOAD_TRANSFORMATION,
+    }
+    params['signature'] = cloudinary.utils.api_sign_request(params, config.api_secret)
+    params['api_key'] = config.api_key
+    params['upload_url'] = cloudinary.utils.cloudinary_api_url('upload', resource_type='image')
+    params['expires_at'] = issued_at + BILL_UPLOAD_TTL
+    return params
+
+def verify_bill_upload(customer_id, public_id, version, signature):
+    """
+    Check a public_id submitted after a direct upload: it must be a slot issued to this
+    customer within BILL_UPLOAD_TTL, Cloudinary's response signature must match, and the
+    asset must exist as an image of an accepted format and size.
+    Returns the public_id if everything checks out, None otherwise.
     """
     try:
-        # First check if we have a valid public_id
-        if not public_id:
+        prefix = f"{BILL_UPLOAD_FOLDER}/bill_"
+        if not public_id or not public_id.startswith(prefix):
+            return None
+        issued_at, nonce, mac = public_id[len(prefix):].split('_')
+        if not hmac.compare_digest(mac, _bill_upload_mac(customer_id, issued_at, nonce)):
+            print(f"WARNING: Bill upload {public_id} was not issued to customer {customer_id}")
+            return None
+        if time.time() - int(issued_at) > BILL_UPLOAD_TTL:
+            print(f"WARNING: Bill upload slot {public_id} has expired")
+            return None
+        if not version or not signature or not cloudinary.utils.verify_api_response_signature(public_id, version, signature):
+            print(f"WARNING: Bill upload {public_id} has an invalid Cloudinary signature")
             return None
         
-        # Generate optimized URL with transformations
-        url, options = cloudinary.utils.cloudinary_url(
-            public_id,
-            # Automatic optimizations
-            quality="85",
-            fetch_format="auto",
-            # Responsive sizing 
-            width=800,
-            crop="limit",
-            # Security
-            secure=True
-        )
-        
-        return url
+        asset = cloudinary.api.resource(public_id, resource_type='image')
+        if str(asset.get('version')) != str(version):
+            return None
+        if (asset.get('format') or '').lower() not in BILL_UPLOAD_FORMATS or asset.get('bytes', 0) > BILL_UPLOAD_MAX_BYTES:
+            print(f"WARNING: Bill upload {public_id} is not an accepted image")
+            return None
+        return public_id
     except Exception as e:
-        print(f"ERROR: Error generating Cloudinary URL: {e}")
+        print(f"ERROR: Could not verify bill upload {public_id}: {e}")
         return None
 
+def _bill_image_url(public_id, width=None, image_format=None, quality='auto'):
+    options = {'quality': quality, 'secure': True}
+    if width:
+        options.update(width=width, crop='limit')
+    if image_format:
+        options['format'] = image_format
+    else:
+        options['fetch_format'] = 'auto'
+    url, _ = cloudinary.utils.cloudinary_url(public_id, **options)
+    return url
+
+def _srcset(public_id, image_format):
+    return ', '.join(f"{_bill_image_url(public_id, width, image_format)} {width}w" for width in BILL_IMAGE_WIDTHS)
+
+@functools.lru_cache(maxsize=BILL_IMAGE_VARIANT_CACHE_SIZE)
+def _bill_image_variants(public_id):
+    return {
+        # Content-negotiated single URL for redirects and links
+        'url': _bill_image_url(public_id, BILL_IMAGE_DEFAULT_WIDTH),
+        'sources': [{'type': mimetype, 'srcset': _srcset(public_id, image_format)}
+                    for image_format, mimetype in BILL_IMAGE_FORMATS],
+        'src': _bill_image_url(public_id, BILL_IMAGE_DEFAULT_WIDTH, BILL_IMAGE_FALLBACK_FORMAT),
+        'srcset': _srcset(public_id, BILL_IMAGE_FALLBACK_FORMAT),
+        # Full-resolution JPEG of the master for "open" and "download"
+        'full': _bill_image_url(public_id, image_format=BILL_IMAGE_FALLBACK_FORMAT, quality=BILL_MASTER_QUALITY),
+    }
+
+def get_bill_image_variants(public_id):
+    """
+    Responsive delivery URLs for a bill image: AVIF/WebP srcsets for <picture>
+    sources, a JPEG srcset and src for the <img> fallback, plus url and full.
+    URLs are derived from the public_id alone, so they are computed once per
+    public_id and cached. Returns None for legacy full URLs or a missing id.
+    Treat the result as read-only, it is shared between requests.
+    """
+    if not public_id or '://' in public_id:
+        return None
+    try:
+        return _bill_image_variants(public_id)
+    except Exception as e:
+        print(f"ERROR: Error generating Cloudinary URLs: {e}")
+        return None
+
+def get_bill_image_url(public_id):
+    """
+    Get the optimized URL for a bill image from Cloudinary
+    """
+    if public_id and '://' in public_id:
+        # Older transactions stored the full image URL
+        return public_id
+    variants = get_bill_image_variants(public_id)
+    return variants['url'] if variants else None
+
 def delete_bill_image(public_id):
     """
     Delete a bill image from Cloudinary
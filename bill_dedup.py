@@ -0,0 +1,109 @@
+"""
+Bill photo de-duplication for KathaPe Customer App
+When a transaction POST fails, customers tend to pick the same receipt again
+and retry. Each incoming photo gets a 64-bit difference hash (dHash), which
+survives re-encoding, resizing and small exposure changes. A photo within
+BILL_DEDUP_MAX_DISTANCE bits of one this customer already attached for the
+same business reuses that Cloudinary public_id instead of uploading again.
+
+Hashes live in the bill_image_hashes collection and are only recorded once a
+transaction actually references the asset, so the index never points at an
+orphaned upload.
+"""
+import io
+import os
+import uuid
+
+from appwrite.query import Query
+
+from appwrite_utils import appwrite_db_instance, get_ist_isoformat, BILL_IMAGE_HASHES_COLLECTION
+
+# Pillow is optional; without it every photo is simply uploaded
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Hamming distance (out of 64 bits) at which two photos count as the same receipt
+BILL_DEDUP_MAX_DISTANCE = int(os.getenv('BILL_DEDUP_MAX_DISTANCE', 6))
+# Retries happen within minutes, so only the most recent photos are compared
+BILL_DEDUP_LOOKBACK = int(os.getenv('BILL_DEDUP_LOOKBACK', 50))
+
+DHASH_SIZE = 8
+
+# Index entry ids are derived from the public_id so recording twice is harmless
+BILL_HASH_NAMESPACE = uuid.UUID('6f1c2d44-8a3e-4b8f-9d55-2b7e0c9a41f3')
+
+
+def compute_dhash(file_data):
+    """64-bit difference hash of an image as 16 hex characters, or None if it can't be read"""
+    if Image is None:
+        return None
+    try:
+        image = Image.open(io.BytesIO(file_data))
+        # Phones store rotation in EXIF; hash what the user actually sees
+        image = ImageOps.exif_transpose(image).convert('L')
+        image = image.resize((DHASH_SIZE + 1, DHASH_SIZE), Image.Resampling.LANCZOS)
+        pixels = list(image.getdata())
+    except Exception as e:
+        print(f"Error hashing bill image: {e}")
+        return None
+
+    bits = 0
+    for row in range(DHASH_SIZE):
+        offset = row * (DHASH_SIZE + 1)
+        for col in range(DHASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:016x}"
+
+
+def hamming_distance(first, second):
+    """Number of differing bits between two hex hashes"""
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+
+def find_duplicate_bill(customer_id, business_id, dhash, max_distance=BILL_DEDUP_MAX_DISTANCE):
+    """public_id of a near-identical photo this customer already attached for business_id, or None"""
+    if not dhash:
+        return None
+    try:
+        entries = appwrite_db_instance.list_documents(BILL_IMAGE_HASHES_COLLECTION, [
+            Query.equal('customer_id', customer_id),
+            Query.equal('business_id', business_id),
+            Query.order_desc('$createdAt'),
+            Query.limit(BILL_DEDUP_LOOKBACK),
+        ], projection='bill_hash')
+        best = None
+        for entry in entries:
+            distance = hamming_distance(dhash, entry['dhash'])
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, entry['public_id'])
+        return best[1] if best else None
+    except Exception as e:
+        print(f"Error looking up duplicate bill image: {e}")
+        return None
+
+
+def bill_hash_document_id(public_id):
+    """Index entry id for an image, so it can be found again without a query"""
+    return str(uuid.uuid5(BILL_HASH_NAMESPACE, public_id))
+
+
+def remember_bill_hash(customer_id, business_id, dhash, public_id):
+    """Add an attached photo to the index; call after its transaction was created"""
+    if not dhash or not public_id:
+        return None
+    document_id = bill_hash_document_id(public_id)
+    try:
+        if appwrite_db_instance.get_document(BILL_IMAGE_HASHES_COLLECTION, document_id):
+            return None
+        return appwrite_db_instance.create_document(BILL_IMAGE_HASHES_COLLECTION, document_id, {
+            'customer_id': customer_id,
+            'business_id': business_id,
+            'public_id': public_id,
+            'dhash': dhash,
+            'created_at': get_ist_isoformat()
+        })
+    except Exception as e:
+        print(f"Error recording bill image hash: {e}")
+        return None
@@ -0,0 +1,223 @@
+"""
+Orphaned bill image cleanup for KathaPe Customer App
+Bill photos are uploaded to Cloudinary before their transaction is created,
+so a failed or abandoned transaction leaves an asset nothing points to. This
+job collects every bill_receipts/ public_id still referenced by a
+transaction, then pages through the bill_receipts/ folder and deletes the
+rest in batches of 100 through the Admin API.
+
+    python bill_gc.py                 # dry run: report orphans only
+    python bill_gc.py --delete        # delete them
+    python bill_gc.py --delete --bloom --max-api-calls 200
+
+Assets younger than BILL_GC_MIN_AGE_HOURS are never touched, which covers
+uploads whose transaction is still being submitted. With --bloom the
+referenced ids are kept in a Bloom filter instead of a set; a false positive
+only keeps an orphan until the next run, never deletes a referenced image.
+"""
+import os
+import re
+import math
+import time
+import hashlib
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import cloudinary.api
+from appwrite.query import Query
+
+from appwrite_utils import (
+    appwrite_db_instance, TRANSACTIONS_COLLECTION, BILL_IMAGE_HASHES_COLLECTION, BILL_UPLOAD_FOLDER,
+)
+from bill_dedup import bill_hash_document_id
+
+# Admin API delete_resources accepts at most 100 public_ids per call
+BILL_GC_BATCH_SIZE = 100
+BILL_GC_LIST_PAGE_SIZE = 500
+BILL_GC_MIN_AGE_HOURS = int(os.getenv('BILL_GC_MIN_AGE_HOURS', 24))
+# Cloudinary's Admin API is rate limited per hour (500 calls on the free plan); stay well under it
+BILL_GC_MAX_API_CALLS = int(os.getenv('BILL_GC_MAX_API_CALLS', 100))
+BILL_GC_CALL_INTERVAL = float(os.getenv('BILL_GC_CALL_INTERVAL', 0.5))
+# Bloom filter sizing: about 1.8MB for a million references at 0.1% false positives
+BILL_GC_BLOOM_CAPACITY = int(os.getenv('BILL_GC_BLOOM_CAPACITY', 1000000))
+BILL_GC_BLOOM_ERROR_RATE = 0.001
+
+# A bill public_id anywhere in a stored value: bare ids, delivery URLs and old "📷 Bill Photo:" notes
+BILL_PUBLIC_ID_PATTERN = re.compile(rf"({re.escape(BILL_UPLOAD_FOLDER)}/[A-Za-z0-9_\-]+)")
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings; false positives at roughly error_rate"""
+
+    def __init__(self, capacity=BILL_GC_BLOOM_CAPACITY, error_rate=BILL_GC_BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.sha256(value.encode('utf-8')).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(value))
+
+
+class AdminApiBudget:
+    """Spaces out Admin API calls and stops the run once max_calls is spent"""
+
+    def __init__(self, max_calls=BILL_GC_MAX_API_CALLS, interval=BILL_GC_CALL_INTERVAL):
+        self.max_calls = max_calls
+        self.interval = interval
+        self.calls = 0
+        self._last_call = 0.0
+
+    @property
+    def exhausted(self):
+        return self.calls >= self.max_calls
+
+    def call(self, function, *args, **kwargs):
+        wait = self._last_call + self.interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.calls += 1
+        self._last_call = time.monotonic()
+        return function(*args, **kwargs)
+
+
+def iter_referenced_public_ids():
+    """
+    Stream every bill public_id mentioned by a transaction. Raises if any page
+    can't be read: a partial reference set would make referenced images look orphaned.
+    """
+    # Only the fields that can hold an image reference, plus $id for paging
+    queries = [Query.select(['$id', 'receipt_image_url', 'notes'])]
+    for transaction in appwrite_db_instance.iter_documents(TRANSACTIONS_COLLECTION, queries, strict=True):
+        for field in ('receipt_image_url', 'notes'):
+            value = transaction.get(field)
+            if value:
+                yield from BILL_PUBLIC_ID_PATTERN.findall(value)
+
+
+def collect_referenced_public_ids(use_bloom=False):
+    """Set (or Bloom filter) of referenced ids, plus how many references were read"""
+    if not use_bloom:
+        referenced = set(iter_referenced_public_ids())
+        return referenced, len(referenced)
+    referenced = BloomFilter()
+    count = 0
+    for public_id in iter_referenced_public_ids():
+        referenced.add(public_id)
+        count += 1
+    return referenced, count
+
+
+def list_bill_assets(budget, next_cursor=None, page_size=BILL_GC_LIST_PAGE_SIZE):
+    """One page of images under bill_receipts/; returns (resources, next_cursor)"""
+    options = {'type': 'upload', 'resource_type': 'image', 'prefix': f"{BILL_UPLOAD_FOLDER}/",
+               'max_results': page_size}
+    if next_cursor:
+        options['next_cursor'] = next_cursor
+    result = budget.call(cloudinary.api.resources, **options)
+    return result.get('resources', []), result.get('next_cursor')
+
+
+def _created_before(asset, cutoff):
+    try:
+        created_at = datetime.fromisoformat(asset['created_at'].replace('Z', '+00:00'))
+    except (KeyError, ValueError, AttributeError):
+        # Unknown age: treat as fresh and keep it
+        return False
+    return created_at < cutoff
+
+
+def _forget_hashes(public_ids):
+    """Drop de-duplication entries for deleted images so they are never reused"""
+    for public_id in public_ids:
+        document_id = bill_hash_document_id(public_id)
+        if appwrite_db_instance.get_document(BILL_IMAGE_HASHES_COLLECTION, document_id):
+            appwrite_db_instance.delete_document(BILL_IMAGE_HASHES_COLLECTION, document_id)
+
+
+def collect_orphaned_bill_images(dry_run=True, use_bloom=False, min_age_hours=BILL_GC_MIN_AGE_HOURS,
+                                 max_api_calls=BILL_GC_MAX_API_CALLS, batch_size=BILL_GC_BATCH_SIZE):
+    """
+    Find bill images no transaction references and, unless dry_run, delete them.
+    Returns a summary dict with scanned/orphaned/deleted counts and the API calls used.
+    """
+    # Read references before listing assets: anything referenced later is younger than the cutoff
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=min_age_hours)
+    budget = AdminApiBudget(max_api_calls)
+    summary = {'referenced': 0, 'scanned': 0, 'orphaned': 0, 'deleted': 0,
+               'dry_run': dry_run, 'complete': False, 'api_calls': 0}
+    try:
+        referenced, summary['referenced'] = collect_referenced_public_ids(use_bloom)
+    except Exception as e:
+        # Never delete against an incomplete reference set
+        print(f"Error reading bill references, nothing deleted: {e}")
+        return summary
+    print(f"Collected {summary['referenced']} referenced bill images")
+    batch = []
+
+    def flush():
+        """Report or delete the current batch (at most batch_size ids)"""
+        if dry_run:
+            for public_id in batch:
+                print(f"  would delete {public_id}")
+        else:
+            result = budget.call(cloudinary.api.delete_resources, list(batch), resource_type='image')
+            deleted = [public_id for public_id, status in result.get('deleted', {}).items() if status == 'deleted']
+            summary['deleted'] += len(deleted)
+            _forget_hashes(deleted)
+            print(f"  deleted {len(deleted)} of {len(batch)}")
+        batch.clear()
+
+    try:
+        next_cursor = None
+        while not budget.exhausted:
+            assets, next_cursor = list_bill_assets(budget, next_cursor)
+            for asset in assets:
+                summary['scanned'] += 1
+                public_id = asset.get('public_id')
+                if not public_id or public_id in referenced or not _created_before(asset, cutoff):
+                    continue
+                summary['orphaned'] += 1
+                batch.append(public_id)
+            # Deleting needs a call of its own, so stop listing rather than leave a batch behind
+            while len(batch) >= batch_size and (dry_run or not budget.exhausted):
+                pending, batch[:] = batch[batch_size:], batch[:batch_size]
+                flush()
+                batch.extend(pending)
+            if not next_cursor:
+                break
+        if batch and (dry_run or not budget.exhausted):
+            flush()
+        summary['complete'] = not next_cursor and not batch
+    except Exception as e:
+        print(f"Error collecting orphaned bill images: {e}")
+
+    summary['api_calls'] = budget.calls
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Delete bill images no transaction references')
+    parser.add_argument('--delete', action='store_true', help='actually delete (default is a dry run)')
+    parser.add_argument('--bloom', action='store_true', help='hold references in a Bloom filter instead of a set')
+    parser.add_argument('--min-age-hours', type=int, default=BILL_GC_MIN_AGE_HOURS)
+    parser.add_argument('--max-api-calls', type=int, default=BILL_GC_MAX_API_CALLS)
+    args = parser.parse_args()
+
+    print(f"{'Deleting' if args.delete else 'Dry run: listing'} orphaned images in {BILL_UPLOAD_FOLDER}/...")
+    result = collect_orphaned_bill_images(dry_run=not args.delete, use_bloom=args.bloom,
+                                          min_age_hours=args.min_age_hours, max_api_calls=args.max_api_calls)
+    print(f"✓ Scanned {result['scanned']} images, {result['orphaned']} orphaned, "
+          f"{result['deleted']} deleted, {result['api_calls']} Admin API calls")
+    if not result['complete']:
+        print("Stopped before the end of the folder (API budget or error); run again to continue")
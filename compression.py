@@ -0,0 +1,327 @@
+"""
+Response compression for KathaPe Customer App
+On Render there is no nginx in front of gunicorn, so HTML and JSON are
+compressed in-app. Static files are precompressed once at build time
+(python compression.py) and served directly, costing no CPU per request.
+"""
+import os
+import sys
+import gzip
+import zlib
+import mimetypes
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+# Brotli is optional; gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are sent as-is (bytes)
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 500))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript', 'text/xml',
+    'application/javascript', 'application/json', 'application/xml',
+    'application/manifest+json', 'image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon',
+}
+
+# File extensions the static build step precompresses
+PRECOMPRESS_EXTENSIONS = {'.css', '.js', '.json', '.svg', '.html', '.txt', '.xml', '.ico', '.webmanifest'}
+
+# Precompressed sibling suffix per encoding, in order of preference
+ENCODING_SUFFIXES = [('br', '.br'), ('gzip', '.gz')]
+
+
+def available_encodings():
+    """Encodings this process can produce, best first"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate_encoding(accept_encoding, offered=None):
+    """Pick the best content-coding from an Accept-Encoding header, or None"""
+    if not accept_encoding:
+        return None
+    offered = offered if offered is not None else available_encodings()
+    weights = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[token] = quality
+    for encoding in offered:
+        quality = weights.get(encoding, weights.get('*', 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+def _header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _strip_encoding_etags(value, encoding):
+    """Turn "abc-gzip" validators sent back by clients into the plain "abc" the app issued"""
+    return value.replace(f'-{encoding}"', '"')
+
+
+class _StreamCompressor:
+    """Incremental gzip or brotli encoder"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Emit everything buffered so far without ending the stream"""
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """
+    WSGI middleware that gzip/brotli-encodes compressible responses.
+    Sized bodies below COMPRESS_MIN_SIZE pass through untouched; streamed
+    bodies (no Content-Length) are compressed chunk by chunk and flushed, so
+    the first byte still leaves as soon as the app yields it.
+    """
+
+    def __init__(self, app, min_size=COMPRESS_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if not encoding or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.app(environ, start_response)
+        # Only validators of the representation this request would get are stripped,
+        # so a cached gzip body is never confirmed to a client now asking for br
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            environ['HTTP_IF_NONE_MATCH'] = _strip_encoding_etags(if_none_match, encoding)
+
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            captured['exc_info'] = exc_info
+            return lambda data: captured.setdefault('written', []).append(data)
+
+        app_iter = self.app(environ, capture_start_response)
+        status = captured.get('status')
+        headers = list(captured.get('headers') or [])
+
+        if status is not None and status.startswith('304') and if_none_match:
+            start_response(status, self._not_modified_headers(headers, encoding, if_none_match),
+                           captured.get('exc_info'))
+            return self._prepend_written(captured, app_iter)
+
+        if status is None or not self._should_compress(status, headers):
+            if status is not None:
+                start_response(status, headers, captured.get('exc_info'))
+            return self._prepend_written(captured, app_iter)
+
+        headers = self._encoded_headers(headers, encoding)
+        content_length = _header(captured['headers'], 'Content-Length')
+        compressor = _StreamCompressor(encoding)
+
+        if content_length is not None:
+            # Sized body: encode in one pass for the best ratio and a real Content-Length
+            try:
+                body = b''.join(captured.get('written', [])) + b''.join(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            compressed = compressor.compress(body) + compressor.finish()
+            headers.append(('Content-Length', str(len(compressed))))
+            start_response(status, headers, captured.get('exc_info'))
+            return [compressed]
+
+        start_response(status, headers, captured.get('exc_info'))
+        return self._stream(compressor, captured, app_iter)
+
+    def _should_compress(self, status, headers):
+        if not status.startswith('200'):
+            return False
+        if _header(headers, 'Content-Encoding') or _header(headers, 'Content-Range'):
+            return False
+        content_type = (_header(headers, 'Content-Type') or '').split(';')[0].strip().lower()
+        if content_type not in COMPRESSIBLE_TYPES:
+            return False
+        if 'no-transform' in (_header(headers, 'Cache-Control') or ''):
+            return False
+        content_length = _header(headers, 'Content-Length')
+        if content_length is not None and int(content_length) < self.min_size:
+            return False
+        return True
+
+    def _encoded_headers(self, headers, encoding):
+        encoded = []
+        vary = None
+        for key, value in headers:
+            lower = key.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'etag':
+                # A compressed body is a different representation, so it gets its own validator
+                if value.endswith('"'):
+                    value = f'{value[:-1]}-{encoding}"'
+            if lower == 'vary':
+                vary = value
+                continue
+            encoded.append((key, value))
+        if vary and vary.strip() != '*':
+            vary = vary if 'accept-encoding' in vary.lower() else f'{vary}, Accept-Encoding'
+        encoded.append(('Vary', vary or 'Accept-Encoding'))
+        encoded.append(('Content-Encoding', encoding))
+        return encoded
+
+    @staticmethod
+    def _not_modified_headers(headers, encoding, if_none_match):
+        """Give a 304 the validator of the compressed body the client revalidated, as the 200 had"""
+        suffixed = []
+        for key, value in headers:
+            if key.lower() == 'etag' and value.endswith('"'):
+                encoded = f'{value[:-1]}-{encoding}"'
+                if encoded in if_none_match:
+                    value = encoded
+            if key.lower() == 'vary' and value.strip() != '*' and 'accept-encoding' not in value.lower():
+                value = f'{value}, Accept-Encoding'
+            suffixed.append((key, value))
+        if _header(suffixed, 'Vary') is None:
+            suffixed.append(('Vary', 'Accept-Encoding'))
+        return suffixed
+
+    @staticmethod
+    def _prepend_written(captured, app_iter):
+        written = captured.get('written')
+        if not written:
+            return app_iter
+
+        def chained():
+            try:
+                yield from written
+                yield from app_iter
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+        return chained()
+
+    @staticmethod
+    def _stream(compressor, captured, app_iter):
+        try:
+            for chunk in captured.get('written', []):
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            for chunk in app_iter:
+                if not chunk:
+                    continue
+                data = compressor.compress(chunk) + compressor.flush()
+                if data:
+                    yield data
+            yield compressor.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+def install_precompressed_static(app):
+    """Serve foo.css.br / foo.css.gz in place of foo.css when the client accepts them"""
+    original_static = app.view_functions['static']
+
+    def static(filename):
+        source = safe_join(app.static_folder, filename)
+        offered = [encoding for encoding, suffix in ENCODING_SUFFIXES
+                   if source and _fresh_sibling(source, suffix)]
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''), offered)
+        if encoding:
+            suffix = dict(ENCODING_SUFFIXES)[encoding]
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = original_static(filename=filename)
+        if offered:
+            response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = static
+    return static
+
+
+def _fresh_sibling(source, suffix):
+    """True if a precompressed sibling exists and is at least as new as its source"""
+    sibling = source + suffix
+    try:
+        return os.path.getmtime(sibling) >= os.path.getmtime(source)
+    except OSError:
+        return False
+
+
+def precompress_static(static_folder, min_size=COMPRESS_MIN_SIZE):
+    """
+    Build step: write .gz (and .br when brotli is installed) siblings for
+    compressible files under static_folder. Siblings that would not be
+    smaller than the source are skipped. Returns the number of files written.
+    """
+    written = 0
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1].lower() not in PRECOMPRESS_EXTENSIONS:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            if len(data) < min_size:
+                continue
+
+            outputs = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                outputs['.br'] = brotli.compress(data, quality=11)
+            for suffix, compressed in outputs.items():
+                if len(compressed) >= len(data):
+                    continue
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+                print(f"  {os.path.relpath(path + suffix, static_folder)}: {len(data)} -> {len(compressed)} bytes")
+    return written
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    print(f"Precompressing static files in {folder}...")
+    count = precompress_static(folder)
+    print(f"✓ Wrote {count} precompressed files")
@@ -46,4 +46,40 @@ CREATE TABLE transactions (
     type VARCHAR(20) NOT NULL,
     description TEXT,
     created_at DATETIME NOT NULL
-);
\ No newline at end of file
+);
+
+-- Pending Payments Collection
+-- Indexed on customer_id, business_id, status and expires_at (see database_setup.py)
+CREATE TABLE pending_payments (
+    customer_id VARCHAR(255) NOT NULL,
+    business_id VARCHAR(255) NOT NULL,
+    business_name VARCHAR(255),
+    customer_name VARCHAR(255),
+    amount DECIMAL(10, 2) NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    payment_method VARCHAR(20),
+    notes TEXT,
+    created_at DATETIME NOT NULL,
+    completed_at DATETIME,
+    expires_at DATETIME NOT NULL
+);
+
+-- Deleted Documents Collection
+-- Tombstones for deleted transactions/credit rows, read by /api/sync
+CREATE TABLE deleted_documents (
+    collection_id VARCHAR(255) NOT NULL,
+    document_id VARCHAR(255) NOT NULL,
+    customer_id VARCHAR(255) NOT NULL,
+    business_id VARCHAR(255),
+    deleted_at DATETIME NOT NULL
+);
+
+-- Bill Image Hashes Collection
+-- Perceptual hashes of attached bill photos, used to reuse re-uploaded receipts
+CREATE TABLE bill_image_hashes (
+    customer_id VARCHAR(255) NOT NULL,
+    business_id VARCHAR(255) NOT NULL,
+    public_id VARCHAR(255) NOT NULL,
+    dhash VARCHAR(16) NOT NULL,
+    created_at DATETIME NOT NULL
+);
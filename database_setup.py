@@ -4,6 +4,7 @@ import re
 from appwrite.client import Client
 from appwrite.services.databases import Databases
 from appwrite.exception import AppwriteException
+from appwrite.enums.index_type import IndexType
 
 # Appwrite Configuration
 APPWRITE_ENDPOINT = os.getenv('APPWRITE_ENDPOINT')
@@ -20,6 +21,31 @@ appwrite_client.set_key(APPWRITE_API_KEY)
 # Initialize Services
 appwrite_db = Databases(appwrite_client)
 
+# Indexes the app's queries rely on: collection -> [(index key, attributes)]
+COLLECTION_INDEXES = {
+    'pending_payments': [
+        ('idx_customer_status', ['customer_id', 'status']),
+        ('idx_business_status', ['business_id', 'status']),
+        ('idx_status_expires', ['status', 'expires_at']),
+        ('idx_created_at', ['created_at']),
+    ],
+    # /api/sync reads each customer's rows in $updatedAt order
+    'transactions': [
+        ('idx_customer_updated', ['customer_id', '$updatedAt']),
+    ],
+    'customer_credits': [
+        ('idx_customer_updated', ['customer_id', '$updatedAt']),
+    ],
+    'deleted_documents': [
+        ('idx_customer_updated', ['customer_id', '$updatedAt']),
+        ('idx_deleted_at', ['deleted_at']),
+    ],
+    # Recent photos per customer and business, compared by bill_dedup
+    'bill_image_hashes': [
+        ('idx_customer_business_created', ['customer_id', 'business_id', '$createdAt']),
+    ],
+}
+
 def parse_schema(sql_file):
     with open(sql_file, 'r') as f:
         content = f.read()
@@ -77,6 +103,18 @@ def setup_database(schema_file):
                 else:
                     raise e
 
+        for index_key, index_attributes in COLLECTION_INDEXES.get(collection_name, []):
+            try:
+                appwrite_db.get_index(APPWRITE_DATABASE_ID, collection_name, index_key)
+                print(f'Index "{index_key}" in "{collection_name}" already exists.')
+            except AppwriteException as e:
+                if e.code == 404:
+                    print(f'Creating index "{index_key}" in "{collection_name}"...')
+                    appwrite_db.create_index(APPWRITE_DATABASE_ID, collection_name, index_key, IndexType.KEY, index_attributes)
+                    print(f'Index "{index_key}" created.')
+                else:
+                    raise e
+
 if __name__ == '__main__':
     schema_file = os.path.join(os.path.dirname(__file__), 'database_schema.sql')
     setup_database(schema_file)
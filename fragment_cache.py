@@ -0,0 +1,241 @@
+"""
+Template fragment caching for KathaPe Customer App
+Wrap a slow section of a template in
+
+    {% cache 'business-list', customer_id, ledger_version %} ... {% endcache %}
+
+and its rendered markup is reused until one of the key parts changes. Keys
+that include the ledger version go stale on their own when the ledger
+changes, so nothing has to be invalidated explicitly. If any key part is None
+the fragment is rendered uncached.
+
+Fragments live in a bounded in-process LRU. Set FRAGMENT_CACHE_BACKEND=file
+to also share them between workers through FRAGMENT_CACHE_DIR.
+"""
+import os
+import time
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+FRAGMENT_CACHE_BACKEND = os.getenv('FRAGMENT_CACHE_BACKEND', 'memory').lower()
+FRAGMENT_CACHE_DIR = os.getenv('FRAGMENT_CACHE_DIR', 'instance/fragment_cache')
+FRAGMENT_CACHE_MAX_ENTRIES = int(os.getenv('FRAGMENT_CACHE_MAX_ENTRIES', 512))
+# Upper bound for data the key doesn't cover (e.g. a business renaming itself)
+FRAGMENT_CACHE_TTL = int(os.getenv('FRAGMENT_CACHE_TTL', 3600))
+# Mixed into every key so a deploy with changed templates never serves old markup from the file backend
+FRAGMENT_CACHE_SALT = os.getenv('RENDER_GIT_COMMIT', os.getenv('APP_VERSION', ''))
+
+
+class MemoryFragmentCache:
+    """Thread-safe LRU of rendered fragments, bounded by entry count"""
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=FRAGMENT_CACHE_TTL):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileFragmentCache:
+    """
+    Fragments stored one file per key, shared by every worker on the host.
+    Reads touch the file, so pruning by mtime drops the least recently used.
+    """
+
+    def __init__(self, directory=FRAGMENT_CACHE_DIR, max_entries=FRAGMENT_CACHE_MAX_ENTRIES, suffix='.html'):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.suffix = suffix
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get_entry(self, key):
+        """(value, expires_at) for a live entry, else None"""
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                expires_at = float(f.readline())
+                value = f.read()
+        except (OSError, ValueError):
+            return None
+        if expires_at <= time.time():
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value, expires_at
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key, value, ttl=FRAGMENT_CACHE_TTL):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(f"{time.time() + ttl}\n")
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing fragment cache: {e}")
+            self._remove(tmp_path)
+            return
+        with self._lock:
+            self._writes += 1
+            # Pruning lists the directory, so only do it every few writes
+            should_prune = self._writes % 32 == 0
+        if should_prune:
+            self.prune()
+
+    def prune(self):
+        """Delete the least recently used fragments beyond max_entries"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(self.suffix)]
+        except OSError:
+            return 0
+        if len(entries) <= self.max_entries:
+            return 0
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        stale = entries[:len(entries) - self.max_entries]
+        for entry in stale:
+            self._remove(entry.path)
+        return len(stale)
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.suffix):
+                self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class FragmentCache:
+    """In-process LRU in front of an optional shared backend"""
+
+    def __init__(self, memory=None, shared=None):
+        self.memory = memory or MemoryFragmentCache()
+        self.shared = shared
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.shared is not None:
+            entry = self.shared.get_entry(key)
+            if entry is not None:
+                value, expires_at = entry
+                # Promote with the shared entry's remaining lifetime, not the default TTL
+                self.memory.set(key, value, expires_at - time.time())
+        return value
+
+    def set(self, key, value, ttl=FRAGMENT_CACHE_TTL):
+        self.memory.set(key, value, ttl)
+        if self.shared is not None:
+            self.shared.set(key, value, ttl)
+
+    def clear(self):
+        self.memory.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+
+# Set while a fragment renders from data that must not be reused (e.g. a fallback snapshot)
+_skip_store = contextvars.ContextVar('fragment_cache_skip_store', default=False)
+
+
+def dont_cache_fragment():
+    """Keep the fragment currently being rendered out of the cache"""
+    _skip_store.set(True)
+
+
+def fragment_key(parts):
+    """Stable file-safe key for a fragment name plus its key parts"""
+    raw = '\x1f'.join([FRAGMENT_CACHE_SALT] + [str(part) for part in parts])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class FragmentCacheExtension(Extension):
+    """Adds {% cache name, key... %}...{% endcache %} backed by environment.fragment_cache"""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.List(parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None or any(part is None for part in parts):
+            return caller()
+
+        key = fragment_key(parts)
+        value = cache.get(key)
+        if value is None:
+            token = _skip_store.set(False)
+            try:
+                value = caller()
+                skip = _skip_store.get()
+            finally:
+                _skip_store.reset(token)
+            if not skip:
+                cache.set(key, str(value))
+            return value
+        # Cached markup was already escaped when it was first rendered
+        return Markup(value)
+
+
+def configure_fragment_cache(app, backend=None):
+    """Register the {% cache %} tag on app's Jinja environment"""
+    backend = (backend or FRAGMENT_CACHE_BACKEND).lower()
+    shared = FileFragmentCache() if backend == 'file' else None
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = FragmentCache(shared=shared)
+    return app.jinja_env.fragment_cache
@@ -0,0 +1,99 @@
+"""
+Readiness probes for KathaPe Customer App
+/health/ready measures the dependencies a request actually needs:
+
+- appwrite: latency of a one-document list (a single attempt, through the
+  circuit breaker, so an open breaker reports down without a network call),
+- cloudinary: that upload parameters and delivery URLs can be signed,
+- sessions: latency of a server-side session store lookup, when one is configured.
+
+Results are cached per worker for HEALTH_CACHE_SECONDS and only one thread
+probes at a time, so however often the load balancer polls, Appwrite sees at
+most one probe per worker per interval.
+"""
+import os
+import time
+import threading
+
+import cloudinary
+import cloudinary.utils
+from appwrite.query import Query
+
+from appwrite_utils import appwrite_db_instance, get_ist_isoformat, APPWRITE_DATABASE_ID, CUSTOMERS_COLLECTION
+from appwrite_resilience import call as resilient_call, appwrite_breaker
+from server_session import ServerSessionInterface
+
+HEALTH_CACHE_SECONDS = float(os.getenv('HEALTH_CACHE_SECONDS', 5))
+# Above these latencies (milliseconds) a dependency is reported degraded rather than ok
+HEALTH_APPWRITE_DEGRADED_MS = float(os.getenv('HEALTH_APPWRITE_DEGRADED_MS', 1000))
+# Cloudinary signing and session lookups are local work; anything slow means the worker is starved
+HEALTH_LOCAL_DEGRADED_MS = float(os.getenv('HEALTH_LOCAL_DEGRADED_MS', 100))
+
+# A worker is only taken out of rotation when one of these is down
+CRITICAL_CHECKS = ('appwrite', 'sessions')
+
+_cache = {}
+_probe_lock = threading.Lock()
+
+
+def _timed(probe, degraded_ms):
+    """Run probe() and describe the outcome as {'status', 'latency_ms'[, 'error']}"""
+    started = time.monotonic()
+    try:
+        probe()
+    except Exception as e:
+        return {'status': 'down', 'latency_ms': round((time.monotonic() - started) * 1000, 1),
+                'error': f"{type(e).__name__}: {e}"}
+    latency_ms = round((time.monotonic() - started) * 1000, 1)
+    return {'status': 'degraded' if latency_ms > degraded_ms else 'ok', 'latency_ms': latency_ms}
+
+
+def probe_appwrite():
+    resilient_call(appwrite_db_instance.db.list_documents, APPWRITE_DATABASE_ID, CUSTOMERS_COLLECTION,
+                   [Query.limit(1)], idempotent=True, attempts=1)
+
+
+def probe_cloudinary():
+    config = cloudinary.config()
+    if not (config.cloud_name and config.api_key and config.api_secret):
+        raise RuntimeError('Cloudinary credentials are not configured')
+    cloudinary.utils.api_sign_request({'timestamp': int(time.time()), 'public_id': 'health'}, config.api_secret)
+    cloudinary.utils.cloudinary_url('health', sign_url=True)
+
+
+def run_readiness_checks(app):
+    """Probe every dependency now; returns the readiness report"""
+    checks = {
+        'appwrite': _timed(probe_appwrite, HEALTH_APPWRITE_DEGRADED_MS),
+        'cloudinary': _timed(probe_cloudinary, HEALTH_LOCAL_DEGRADED_MS),
+    }
+    checks['appwrite']['breaker'] = appwrite_breaker.state
+    if isinstance(app.session_interface, ServerSessionInterface):
+        store = app.session_interface.store
+        checks['sessions'] = _timed(lambda: store.load('health-probe'), HEALTH_LOCAL_DEGRADED_MS)
+
+    if any(checks[name]['status'] == 'down' for name in CRITICAL_CHECKS if name in checks):
+        status = 'unavailable'
+    elif any(check['status'] != 'ok' for check in checks.values()):
+        status = 'degraded'
+    else:
+        status = 'ready'
+    return {'status': status, 'checks': checks, 'checked_at': get_ist_isoformat()}
+
+
+def readiness(app):
+    """
+    Cached readiness report plus its age in seconds. While one thread probes,
+    others get the previous report instead of probing again.
+    """
+    report, checked = _cache.get('entry', (None, 0))
+    if report is None or time.monotonic() - checked >= HEALTH_CACHE_SECONDS:
+        if _probe_lock.acquire(blocking=report is None):
+            try:
+                # Another thread may have refreshed the report while this one waited
+                report, checked = _cache.get('entry', (None, 0))
+                if report is None or time.monotonic() - checked >= HEALTH_CACHE_SECONDS:
+                    report, checked = _cache['entry'] = (run_readiness_checks(app), time.monotonic())
+            finally:
+                _probe_lock.release()
+    return report, round(time.monotonic() - checked, 1)
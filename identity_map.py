@@ -0,0 +1,94 @@
+"""
+Request-scoped identity map for KathaPe Customer App
+Within one request, AppwriteDB answers a document or query it has already
+read from memory instead of asking Appwrite again. Writes made in the same
+request update the map: the written document replaces the cached one, and
+cached lists filtered only by equality (customer_id/business_id, the common
+case) gain, update or lose it; any other cached list for that collection is
+dropped. A failed write forgets what it touched, since another request may
+have changed it.
+
+The map lives on flask.g, so nothing outlives the request. Code running
+without an app context (background threads, scripts) is not affected.
+"""
+import json
+
+from flask import g, has_app_context
+
+
+def _copy(value):
+    """Documents are flat dicts; copying one level keeps callers' edits out of the map"""
+    if isinstance(value, list):
+        return [dict(document) for document in value]
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+def _equality_filters(queries):
+    """{attribute: values} if every query is Query.equal (or a Query.select projection), else None"""
+    filters = {}
+    for query in queries:
+        try:
+            parsed = json.loads(query)
+        except (TypeError, ValueError):
+            return None
+        if parsed.get('method') == 'select':
+            # Projections don't change which documents match
+            continue
+        if parsed.get('method') != 'equal':
+            return None
+        filters[parsed.get('attribute')] = parsed.get('values', [])
+    return filters
+
+
+def _matches(document, filters):
+    return all(document.get(attribute) in values for attribute, values in filters.items())
+
+
+class IdentityMap:
+    """Read results keyed like appwrite_resilience.read_key: ('get'|'list', collection, id|queries)"""
+
+    def __init__(self):
+        self._entries = {}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        return _copy(self._entries[key])
+
+    def remember(self, key, value):
+        self._entries[key] = _copy(value)
+
+    def _lists(self, collection_id):
+        return [key for key in self._entries if key[0] == 'list' and key[1] == collection_id]
+
+    def written(self, collection_id, document_id, document=None):
+        """Record a successful write; document is the stored version, or None once deleted"""
+        self._entries[('get', collection_id, document_id)] = _copy(document)
+        for key in self._lists(collection_id):
+            filters = _equality_filters(key[2])
+            if filters is None:
+                # Ordered, limited or paged: can't tell where the document belongs
+                del self._entries[key]
+                continue
+            documents = [cached for cached in self._entries[key] if cached.get('$id') != document_id]
+            if document is not None and _matches(document, filters):
+                documents.append(dict(document))
+            self._entries[key] = documents
+
+    def forget(self, collection_id, document_id):
+        """Drop everything a failed write may have touched"""
+        self._entries.pop(('get', collection_id, document_id), None)
+        for key in self._lists(collection_id):
+            del self._entries[key]
+
+
+def current_identity_map():
+    """This request's identity map, or None outside a request"""
+    if not has_app_context():
+        return None
+    if 'identity_map' not in g:
+        g.identity_map = IdentityMap()
+    return g.identity_map
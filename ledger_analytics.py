@@ -0,0 +1,270 @@
+"""
+Ledger analytics for KathaPe Customer App
+Loads a customer's transactions into NumPy column arrays and computes
+spending insights with vectorized operations
+"""
+import os
+from array import array
+
+import numpy as np
+
+from appwrite_utils import iter_customer_transactions, BUSINESSES_COLLECTION
+from appwrite_async import read_many
+from fragment_cache import MemoryFragmentCache
+
+# Transaction type codes stored in the type column
+TYPE_CREDIT = 1
+TYPE_PAYMENT = 2
+TRANSACTION_TYPE_CODES = {'credit': TYPE_CREDIT, 'payment': TYPE_PAYMENT}
+
+# How long computed insights are reused for an unchanged ledger version (seconds)
+INSIGHTS_CACHE_TTL = int(os.getenv('INSIGHTS_CACHE_TTL', 300))
+# Computed insights each worker keeps (least recently used are dropped)
+INSIGHTS_CACHE_MAX_ENTRIES = int(os.getenv('INSIGHTS_CACHE_MAX_ENTRIES', 1024))
+
+
+class LedgerColumns:
+    """Column-oriented view of a customer's transactions, sorted by day"""
+
+    __slots__ = ('amount_paise', 'type_code', 'business_index', 'epoch_day', 'business_ids')
+
+    def __init__(self, amount_paise, type_code, business_index, epoch_day, business_ids):
+        self.amount_paise = amount_paise
+        self.type_code = type_code
+        self.business_index = business_index
+        self.epoch_day = epoch_day
+        self.business_ids = business_ids
+
+    def __len__(self):
+        return len(self.amount_paise)
+
+
+def load_ledger_columns(transactions):
+    """Pack an iterable of transaction documents into NumPy column arrays"""
+    amounts = array('d')
+    type_codes = array('b')
+    business_indexes = array('l')
+    dates = []
+    business_ids = []
+    business_lookup = {}
+
+    for tx in transactions:
+        type_code = TRANSACTION_TYPE_CODES.get(tx.get('transaction_type'))
+        if type_code is None:
+            continue
+        business_id = tx.get('business_id')
+        if business_id not in business_lookup:
+            business_lookup[business_id] = len(business_ids)
+            business_ids.append(business_id)
+        try:
+            amounts.append(float(tx.get('amount') or 0))
+        except (TypeError, ValueError):
+            amounts.append(0.0)
+        type_codes.append(type_code)
+        business_indexes.append(business_lookup[business_id])
+        # created_at is stored as an IST ISO string, so its first 10 chars are the local date
+        dates.append(str(tx.get('created_at') or tx.get('$createdAt') or '')[:10])
+
+    amount_paise = np.rint(np.frombuffer(amounts, dtype=np.float64) * 100).astype(np.int64)
+    type_code = np.frombuffer(type_codes, dtype=np.int8)
+    business_index = np.asarray(business_indexes, dtype=np.int64)
+    try:
+        day = np.array(dates, dtype='datetime64[D]')
+    except ValueError:
+        day = np.array([_parse_day(value) for value in dates], dtype='datetime64[D]')
+
+    # Drop rows without a usable date, then order everything chronologically
+    valid = ~np.isnat(day)
+    epoch_day = day[valid].astype(np.int64)
+    order = np.argsort(epoch_day, kind='stable')
+
+    return LedgerColumns(
+        amount_paise=amount_paise[valid][order],
+        type_code=type_code[valid][order],
+        business_index=business_index[valid][order],
+        epoch_day=epoch_day[order],
+        business_ids=business_ids
+    )
+
+
+def _parse_day(value):
+    """Parse a YYYY-MM-DD prefix, returning NaT for anything malformed"""
+    try:
+        return np.datetime64(value, 'D')
+    except ValueError:
+        return np.datetime64('NaT')
+
+
+def _signed_amounts(columns):
+    """Credits as positive paise, payments as negative paise"""
+    return np.where(columns.type_code == TYPE_CREDIT, columns.amount_paise, -columns.amount_paise)
+
+
+def _epoch_months(columns):
+    """Months since 1970-01 for every row"""
+    return columns.epoch_day.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+def _month_labels(first_month, span):
+    """YYYY-MM labels for a contiguous run of months"""
+    return (np.arange(span) + first_month).astype('datetime64[M]').astype(str).tolist()
+
+
+def monthly_business_totals(columns, business_names=None):
+    """Credit and payment totals for every (business, month) pair with activity"""
+    if not len(columns):
+        return []
+    business_names = business_names or {}
+
+    months = _epoch_months(columns)
+    first_month = int(months.min())
+    span = int(months.max()) - first_month + 1
+    business_count = len(columns.business_ids)
+
+    # Flatten (business, month) into a single bucket index and sum per bucket
+    bucket = columns.business_index * span + (months - first_month)
+    is_credit = columns.type_code == TYPE_CREDIT
+    size = business_count * span
+    credits = np.bincount(bucket, weights=np.where(is_credit, columns.amount_paise, 0), minlength=size)
+    payments = np.bincount(bucket, weights=np.where(is_credit, 0, columns.amount_paise), minlength=size)
+    credits = np.rint(credits).astype(np.int64).reshape(business_count, span)
+    payments = np.rint(payments).astype(np.int64).reshape(business_count, span)
+
+    labels = _month_labels(first_month, span)
+    rows = []
+    # Transposed so rows come out month by month
+    for month_idx, business_idx in zip(*np.nonzero((credits | payments).T)):
+        business_id = columns.business_ids[business_idx]
+        rows.append({
+            'business_id': business_id,
+            'business_name': business_names.get(business_id, 'Unknown Business'),
+            'month': labels[month_idx],
+            'credit': int(credits[business_idx, month_idx]) / 100,
+            'payment': int(payments[business_idx, month_idx]) / 100
+        })
+    return rows
+
+
+def repayment_days(columns):
+    """
+    Amount-weighted average days between taking credit and paying it back.
+    Payments settle the oldest credit first, so a credit counts as repaid on the
+    day cumulative payments reach its cumulative credit total.
+    """
+    per_business = {}
+    all_days = []
+    all_weights = []
+    if not len(columns):
+        return {'overall': None, 'by_business': per_business}
+
+    # Group rows by business while keeping each group in day order
+    order = np.lexsort((columns.epoch_day, columns.business_index))
+    business_index = columns.business_index[order]
+    amount = columns.amount_paise[order]
+    is_credit = columns.type_code[order] == TYPE_CREDIT
+    day = columns.epoch_day[order]
+    bounds = np.searchsorted(business_index, np.arange(len(columns.business_ids) + 1))
+
+    for business_idx, business_id in enumerate(columns.business_ids):
+        group = slice(bounds[business_idx], bounds[business_idx + 1])
+        group_credit = is_credit[group]
+        credit_amount = amount[group][group_credit]
+        credit_day = day[group][group_credit]
+        payment_cumsum = np.cumsum(amount[group][~group_credit])
+        payment_day = day[group][~group_credit]
+        if not credit_amount.size or not payment_cumsum.size:
+            continue
+
+        settled_by = np.searchsorted(payment_cumsum, np.cumsum(credit_amount), side='left')
+        repaid = settled_by < payment_cumsum.size
+        if not repaid.any():
+            continue
+
+        days = np.maximum(payment_day[settled_by[repaid]] - credit_day[repaid], 0)
+        weights = credit_amount[repaid]
+        per_business[business_id] = round(float(np.average(days, weights=weights)), 1)
+        all_days.append(days)
+        all_weights.append(weights)
+
+    overall = None
+    if all_days:
+        overall = round(float(np.average(np.concatenate(all_days), weights=np.concatenate(all_weights))), 1)
+    return {'overall': overall, 'by_business': per_business}
+
+
+def outstanding_trend(columns):
+    """Outstanding balance across all businesses at the end of each month"""
+    if not len(columns):
+        return []
+    months = _epoch_months(columns)
+    first_month = int(months.min())
+    span = int(months.max()) - first_month + 1
+    net = np.bincount(months - first_month, weights=_signed_amounts(columns), minlength=span)
+    outstanding = np.cumsum(np.rint(net).astype(np.int64))
+    return [
+        {'month': label, 'outstanding': int(value) / 100}
+        for label, value in zip(_month_labels(first_month, span), outstanding)
+    ]
+
+
+def compute_insights(columns, business_names=None):
+    """Compute the full insights payload from ledger columns"""
+    business_names = business_names or {}
+    is_credit = columns.type_code == TYPE_CREDIT
+    total_credit = int(columns.amount_paise[is_credit].sum())
+    total_payment = int(columns.amount_paise[~is_credit].sum())
+    repayment = repayment_days(columns)
+
+    businesses = []
+    if len(columns):
+        signed = _signed_amounts(columns)
+        balances = np.bincount(columns.business_index, weights=signed, minlength=len(columns.business_ids))
+        for business_idx, business_id in enumerate(columns.business_ids):
+            businesses.append({
+                'business_id': business_id,
+                'business_name': business_names.get(business_id, 'Unknown Business'),
+                'outstanding': int(round(balances[business_idx])) / 100,
+                'avg_days_to_repay': repayment['by_business'].get(business_id)
+            })
+
+    return {
+        'transaction_count': len(columns),
+        'total_credit': total_credit / 100,
+        'total_payment': total_payment / 100,
+        'outstanding': (total_credit - total_payment) / 100,
+        'avg_days_to_repay': repayment['overall'],
+        'businesses': businesses,
+        'monthly': monthly_business_totals(columns, business_names),
+        'trend': outstanding_trend(columns)
+    }
+
+
+# Computed insights by (customer_id, ledger version). Any write to the ledger, from
+# any worker or from the business app, is a new version, so nothing is invalidated.
+_insights_cache = MemoryFragmentCache(max_entries=INSIGHTS_CACHE_MAX_ENTRIES)
+
+
+def get_customer_insights(customer_id, ledger_version=None):
+    """
+    Insights for a customer, cached under their ledger version (appwrite_utils.get_ledger_version).
+    Without a version (the check was slow or failed) they are computed and not cached.
+    """
+    key = (customer_id, ledger_version)
+    if ledger_version is not None:
+        cached = _insights_cache.get(key)
+        if cached is not None:
+            return cached
+
+    columns = load_ledger_columns(iter_customer_transactions(customer_id, projection='ledger_columns', strict=True))
+    # Every business name is an independent read: fetch them all at once
+    business_ids = [business_id for business_id in columns.business_ids if business_id]
+    businesses = read_many([('get', BUSINESSES_COLLECTION, business_id) for business_id in business_ids])
+    business_names = {
+        business_id: business.get('name', 'Unknown Business') if business else 'Unknown Business'
+        for business_id, business in zip(business_ids, businesses)
+    }
+    insights = compute_insights(columns, business_names)
+
+    if ledger_version is not None:
+        _insights_cache.set(key, insights, ttl=INSIGHTS_CACHE_TTL)
+    return insights
@@ -0,0 +1,169 @@
+"""
+Last-known-good ledger snapshots for KathaPe Customer App
+Every successful load of a customer's dashboard balances or of one business
+ledger is saved as a snapshot. When Appwrite is down, or slower than
+SNAPSHOT_LATENCY_BUDGET, the page is served from the snapshot instead and
+says how old it is; the live load keeps running in the background (one per
+snapshot at a time) and refreshes the snapshot once it succeeds. A page therefore never waits much
+longer than the budget as long as a snapshot exists.
+
+Snapshots older than SNAPSHOT_MAX_AGE are never served. They live in the
+same two-tier store as template fragments: an in-process LRU, plus JSON files
+shared between workers when SNAPSHOT_BACKEND=file.
+"""
+import os
+import json
+import time
+import hashlib
+from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError, TimeoutError as FuturesTimeout
+
+import pytz
+from flask import current_app, has_app_context
+
+from appwrite_resilience import AppwriteUnavailable
+from fragment_cache import MemoryFragmentCache, FileFragmentCache, FragmentCache
+
+SNAPSHOT_BACKEND = os.getenv('SNAPSHOT_BACKEND', 'memory').lower()
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'instance/ledger_snapshots')
+SNAPSHOT_MAX_ENTRIES = int(os.getenv('SNAPSHOT_MAX_ENTRIES', 2048))
+# Oldest data a page may show in place of live balances
+SNAPSHOT_MAX_AGE = int(os.getenv('SNAPSHOT_MAX_AGE', 24 * 3600))
+# Seconds a page waits for live data before falling back to its snapshot
+SNAPSHOT_LATENCY_BUDGET = float(os.getenv('SNAPSHOT_LATENCY_BUDGET', 2.5))
+# Live loads running past the budget keep a thread each until they finish
+SNAPSHOT_WORKERS = int(os.getenv('SNAPSHOT_WORKERS', 8))
+# Threads for ledger version checks, kept apart so stuck loads never delay ETags
+SNAPSHOT_VALIDATOR_WORKERS = int(os.getenv('SNAPSHOT_VALIDATOR_WORKERS', 2))
+
+IST = pytz.timezone('Asia/Kolkata')
+
+
+class FileSnapshotStore(FileFragmentCache):
+    """Snapshots as JSON files, one per key, shared by every worker on the host"""
+
+    def __init__(self, directory=SNAPSHOT_DIR, max_entries=SNAPSHOT_MAX_ENTRIES):
+        super().__init__(directory, max_entries, suffix='.json')
+
+    def get_entry(self, key):
+        entry = super().get_entry(key)
+        if entry is None:
+            return None
+        try:
+            return json.loads(entry[0]), entry[1]
+        except ValueError:
+            return None
+
+    def set(self, key, value, ttl=SNAPSHOT_MAX_AGE):
+        try:
+            super().set(key, json.dumps(value), ttl)
+        except (TypeError, ValueError) as e:
+            print(f"Error writing ledger snapshot: {e}")
+
+
+def create_snapshot_store(backend=None):
+    backend = (backend or SNAPSHOT_BACKEND).lower()
+    shared = FileSnapshotStore() if backend == 'file' else None
+    return FragmentCache(memory=MemoryFragmentCache(SNAPSHOT_MAX_ENTRIES), shared=shared)
+
+
+snapshot_store = create_snapshot_store()
+
+_executor = ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS, thread_name_prefix='ledger-snapshot')
+_validator_executor = ThreadPoolExecutor(max_workers=SNAPSHOT_VALIDATOR_WORKERS, thread_name_prefix='ledger-version')
+
+# Live loads queued or running, by snapshot key: a page joins the one in flight instead of adding another
+_refreshes = {}
+_refreshes_lock = threading.Lock()
+
+
+def snapshot_key(name, parts):
+    raw = '\x1f'.join([name] + [str(part) for part in parts])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def save_snapshot(key, data):
+    snapshot_store.set(key, {'saved_at': time.time(), 'data': data}, SNAPSHOT_MAX_AGE)
+
+
+def get_snapshot(key):
+    """Saved snapshot for key, or None if there is none younger than SNAPSHOT_MAX_AGE"""
+    snapshot = snapshot_store.get(key)
+    if not snapshot or time.time() - snapshot.get('saved_at', 0) > SNAPSHOT_MAX_AGE:
+        return None
+    return snapshot
+
+
+def _load_and_save(key, loader):
+    data = loader()
+    save_snapshot(key, data)
+    return data
+
+
+def _in_app_context(function):
+    """
+    function run inside a fresh app context of the current app, so its Appwrite
+    reads get an identity map of their own (the request's may be gone by the time it runs)
+    """
+    if not has_app_context():
+        return function
+    app = current_app._get_current_object()
+
+    def run(*args):
+        with app.app_context():
+            return function(*args)
+    return run
+
+
+def _start_refresh(key, loader):
+    with _refreshes_lock:
+        future = _refreshes.get(key)
+        if future is not None:
+            return future
+        future = _refreshes[key] = _executor.submit(_load_and_save, key, _in_app_context(loader))
+
+    def done(finished):
+        with _refreshes_lock:
+            if _refreshes.get(key) is finished:
+                del _refreshes[key]
+    # Outside the lock: runs at once if the load has already finished
+    future.add_done_callback(done)
+    return future
+
+
+def load_with_snapshot(name, parts, loader, budget=SNAPSHOT_LATENCY_BUDGET):
+    """
+    Run loader() for live data and remember the result. Returns (data, as_of):
+    as_of is None for live data, or the IST datetime of the snapshot served
+    because Appwrite was unavailable or the load took longer than budget.
+    Without a snapshot to fall back on, loader() runs inline and its errors propagate.
+    """
+    key = snapshot_key(name, parts)
+    snapshot = get_snapshot(key)
+    if snapshot is None:
+        return _load_and_save(key, loader), None
+
+    future = _start_refresh(key, loader)
+    try:
+        return future.result(timeout=budget), None
+    except FuturesTimeout:
+        # A load already running carries on and refreshes the snapshot when it finishes;
+        # one still queued behind other slow loads is dropped, so a backlog can't build up
+        future.cancel()
+        print(f"Serving {name} snapshot: live data took longer than {budget}s")
+    except CancelledError:
+        print(f"Serving {name} snapshot: live load was dropped from the queue")
+    except AppwriteUnavailable as e:
+        print(f"Serving {name} snapshot: {e}")
+    return snapshot['data'], datetime.fromtimestamp(snapshot['saved_at'], IST)
+
+
+def within_latency_budget(function, *args, budget=SNAPSHOT_LATENCY_BUDGET, default=None):
+    """function(*args), or default if it hasn't returned within budget seconds"""
+    future = _validator_executor.submit(_in_app_context(function), *args)
+    try:
+        return future.result(timeout=budget)
+    except FuturesTimeout:
+        future.cancel()
+        return default
@@ -0,0 +1,188 @@
+"""
+Incremental ledger sync for the KathaPe mobile app
+/api/sync returns only the transactions and credit rows changed since a
+server-issued cursor, plus tombstones for rows deleted in the meantime, so a
+client holding a local copy of the ledger downloads kilobytes per open
+instead of the full history
+"""
+import json
+import base64
+from datetime import datetime, timedelta, timezone
+
+from appwrite.query import Query
+
+from appwrite_utils import (
+    appwrite_db_instance, purge_expired_tombstones_in_background,
+    TRANSACTIONS_COLLECTION, CUSTOMER_CREDITS_COLLECTION, DELETED_DOCUMENTS_COLLECTION,
+    TOMBSTONE_RETENTION_DAYS,
+)
+
+# Most documents returned per stream in one response; the client follows has_more
+SYNC_BATCH_SIZE = 500
+SYNC_PAGE_SIZE = 100
+# Rows committed just before a cursor was issued can carry a slightly older
+# $updatedAt; re-sending this window makes sure they are never skipped.
+# Clients upsert by id, so the overlap is harmless.
+SYNC_OVERLAP_SECONDS = 5
+
+SYNC_CURSOR_VERSION = 1
+
+# Client-facing names for the collections a tombstone can refer to
+TOMBSTONE_COLLECTIONS = {
+    TRANSACTIONS_COLLECTION: 'transactions',
+    CUSTOMER_CREDITS_COLLECTION: 'credits',
+}
+
+
+def _serialize_transaction(tx):
+    return {
+        'id': tx['$id'],
+        'business_id': tx.get('business_id'),
+        'amount': float(tx['amount']) if tx.get('amount') else 0,
+        'type': tx.get('transaction_type'),
+        'notes': tx.get('notes', ''),
+        'receipt_image_url': tx.get('receipt_image_url'),
+        'date': tx.get('created_at', tx.get('$createdAt')),
+        'updated_at': tx.get('$updatedAt')
+    }
+
+
+def _serialize_credit(credit):
+    return {
+        'id': credit['$id'],
+        'business_id': credit.get('business_id'),
+        'current_balance': float(credit.get('current_balance', 0) or 0),
+        'updated_at': credit.get('$updatedAt')
+    }
+
+
+def _serialize_tombstone(tombstone):
+    return {
+        'collection': TOMBSTONE_COLLECTIONS.get(tombstone.get('collection_id'), tombstone.get('collection_id')),
+        'id': tombstone.get('document_id'),
+        'business_id': tombstone.get('business_id'),
+        'deleted_at': tombstone.get('deleted_at')
+    }
+
+
+# (response key, collection, serializer), in the order streams are read
+SYNC_STREAMS = [
+    ('transactions', TRANSACTIONS_COLLECTION, _serialize_transaction),
+    ('credits', CUSTOMER_CREDITS_COLLECTION, _serialize_credit),
+    ('deleted', DELETED_DOCUMENTS_COLLECTION, _serialize_tombstone),
+]
+
+
+def _utc_now():
+    return datetime.now(timezone.utc)
+
+
+def _isoformat(moment):
+    return moment.astimezone(timezone.utc).isoformat(timespec='milliseconds')
+
+
+def encode_sync_cursor(state):
+    """Opaque cursor for the client: urlsafe base64 of the per-stream watermarks"""
+    payload = json.dumps({'v': SYNC_CURSOR_VERSION, 'streams': state}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_sync_cursor(cursor):
+    """Inverse of encode_sync_cursor; raises ValueError for anything it did not issue"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        streams = payload['streams']
+        if payload.get('v') != SYNC_CURSOR_VERSION or not isinstance(streams, dict):
+            raise ValueError
+        for key, _, _ in SYNC_STREAMS:
+            stream = streams.get(key) or {}
+            if stream.get('since'):
+                datetime.fromisoformat(stream['since'])
+            streams[key] = {'since': stream.get('since'), 'after': stream.get('after'), 'max': stream.get('max')}
+        return streams
+    except (ValueError, KeyError, TypeError, AttributeError, UnicodeError, json.JSONDecodeError):
+        raise ValueError('Invalid sync cursor')
+
+
+def _read_stream(collection_id, customer_id, stream, limit, now=None):
+    """
+    Read up to limit documents changed since stream['since'], resuming after
+    stream['after'] when a previous response was cut short.
+    Returns (documents, next stream state, has_more).
+    """
+    now = now or _utc_now()
+    base_queries = [Query.equal('customer_id', customer_id)]
+    if stream['since']:
+        since = datetime.fromisoformat(stream['since']) - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+        base_queries.append(Query.greater_than_equal('$updatedAt', _isoformat(since)))
+    base_queries.append(Query.order_asc('$updatedAt'))
+
+    documents = []
+    after = stream['after']
+    newest = stream['max']
+    has_more = True
+    while len(documents) < limit:
+        page_size = min(SYNC_PAGE_SIZE, limit - len(documents))
+        queries = base_queries + [Query.limit(page_size)]
+        if after:
+            queries.append(Query.cursor_after(after))
+        page = appwrite_db_instance.list_documents(collection_id, queries)
+        documents.extend(page)
+        if page:
+            after = page[-1]['$id']
+            newest = max(newest or '', page[-1].get('$updatedAt') or '') or None
+        if len(page) < page_size:
+            has_more = False
+            break
+
+    if has_more:
+        # Keep the same window and continue after the last document next time
+        return documents, {'since': stream['since'], 'after': after, 'max': newest}, True
+    # Window exhausted: everything up to now has been seen, so the next sync starts
+    # from the newest change or from now less the overlap, whichever is later.
+    # Advancing quiet streams keeps a regularly syncing client inside the tombstone retention window.
+    since = now - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+    if newest:
+        since = max(since, datetime.fromisoformat(newest))
+    return documents, {'since': _isoformat(since), 'after': None, 'max': None}, False
+
+
+def sync_changes(customer_id, cursor=None, limit=SYNC_BATCH_SIZE):
+    """
+    Changes to the customer's ledger since cursor (everything when cursor is None).
+    Raises ValueError for a malformed cursor.
+    """
+    # Expired tombstones are deleted on a background thread, never on this request
+    purge_expired_tombstones_in_background()
+
+    now = _utc_now()
+    full = cursor is None
+    reset = False
+    if cursor is not None:
+        streams = decode_sync_cursor(cursor)
+        tombstones_since = streams['deleted']['since']
+        retention_cutoff = now - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+        if not tombstones_since or datetime.fromisoformat(tombstones_since) < retention_cutoff:
+            # Deletions older than the retention window are gone; start over
+            full = reset = True
+
+    if full:
+        streams = {key: {'since': None, 'after': None, 'max': None} for key, _, _ in SYNC_STREAMS}
+        # A fresh snapshot has nothing to delete; only deletions from now on matter
+        streams['deleted'] = {'since': _isoformat(now), 'after': None, 'max': None}
+
+    result = {'full': full, 'reset': reset, 'has_more': False}
+    next_streams = {}
+    for key, collection_id, serialize in SYNC_STREAMS:
+        if full and key == 'deleted':
+            result[key] = []
+            next_streams[key] = streams[key]
+            continue
+        documents, next_streams[key], more = _read_stream(collection_id, customer_id, streams[key], limit, now)
+        result[key] = [serialize(doc) for doc in documents]
+        result['has_more'] = result['has_more'] or more
+
+    result['cursor'] = encode_sync_cursor(next_streams)
+    result['server_time'] = _isoformat(now)
+    return result
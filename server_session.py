@@ -0,0 +1,241 @@
+"""
+Optional server-side sessions for KathaPe Customer App
+The browser only holds an opaque random token; session data lives in an
+in-memory or local sqlite store with TTL eviction and rotation. Logging out
+deletes the session server-side, so a copied token stops working.
+
+Enable with SESSION_BACKEND=memory (single process, e.g. waitress) or
+SESSION_BACKEND=sqlite (shared by all workers on one host). Any other value
+keeps Flask's default signed-cookie sessions.
+"""
+import os
+import time
+import secrets
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from flask import session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'cookie').lower()
+SESSION_SQLITE_PATH = os.getenv('SESSION_SQLITE_PATH', 'instance/sessions.db')
+# Lifetime of non-permanent sessions (seconds); permanent ones use PERMANENT_SESSION_LIFETIME
+SESSION_IDLE_TTL = int(os.getenv('SESSION_IDLE_TTL', 24 * 60 * 60))
+# Run an eviction pass at most this often (seconds)
+SESSION_EVICT_INTERVAL = int(os.getenv('SESSION_EVICT_INTERVAL', 600))
+
+_serializer = TaggedJSONSerializer()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict backed by a server-side store, tracked by an opaque token"""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = sid is None
+        self.modified = False
+        self.accessed = False
+        self.rotate = False
+
+
+class MemorySessionStore:
+    """Process-local session store; sessions do not survive restarts or span workers"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_evict = time.time()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+        if not entry:
+            return None
+        data, expires_at = entry
+        if expires_at <= time.time():
+            self.delete(sid)
+            return None
+        return _serializer.loads(data), expires_at
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._sessions[sid] = (_serializer.dumps(data), expires_at)
+        self._maybe_evict()
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def evict_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, entry in self._sessions.items() if entry[1] <= now]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+    def _maybe_evict(self):
+        if time.time() - self._last_evict >= SESSION_EVICT_INTERVAL:
+            self._last_evict = time.time()
+            self.evict_expired()
+
+
+class SqliteSessionStore:
+    """Session store in a local sqlite file, shared by every worker on the host"""
+
+    def __init__(self, path=SESSION_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._last_evict = time.time()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'sid TEXT PRIMARY KEY, data TEXT NOT NULL, '
+                'expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at)')
+
+    def _connect(self):
+        # sqlite connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid):
+        row = self._connect().execute(
+            'SELECT data, expires_at FROM sessions WHERE sid = ? AND expires_at > ?',
+            (sid, time.time())
+        ).fetchone()
+        if not row:
+            return None
+        return _serializer.loads(row[0]), row[1]
+
+    def save(self, sid, data, expires_at):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)',
+                (sid, _serializer.dumps(data), expires_at)
+            )
+        self._maybe_evict()
+
+    def delete(self, sid):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def evict_expired(self):
+        with self._connect() as conn:
+            return conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def _maybe_evict(self):
+        if time.time() - self._last_evict >= SESSION_EVICT_INTERVAL:
+            self._last_evict = time.time()
+            self.evict_expired()
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface that keeps only an opaque token in the cookie"""
+
+    session_class = ServerSession
+
+    def __init__(self, store):
+        self.store = store
+
+    def _lifetime(self, app, session_obj):
+        if session_obj.permanent:
+            return app.permanent_session_lifetime.total_seconds()
+        return SESSION_IDLE_TTL
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            loaded = self.store.load(sid)
+            if loaded:
+                data, expires_at = loaded
+                return self.session_class(data, sid=sid, expires_at=expires_at)
+        return self.session_class()
+
+    def save_session(self, app, session_obj, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session_obj.accessed:
+            response.vary.add('Cookie')
+
+        # Emptied session (logout): drop it server-side and clear the cookie
+        if not session_obj:
+            if session_obj.sid:
+                self.store.delete(session_obj.sid)
+            if session_obj.modified and not session_obj.new:
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        now = time.time()
+        lifetime = self._lifetime(app, session_obj)
+        # Skip the store write for untouched sessions until half their lifetime has elapsed
+        if (not session_obj.modified and not session_obj.rotate and session_obj.expires_at
+                and session_obj.expires_at - now > lifetime / 2):
+            return
+
+        sid = session_obj.sid
+        if session_obj.rotate or not sid:
+            if sid:
+                self.store.delete(sid)
+            sid = secrets.token_urlsafe(32)
+
+        expires_at = now + lifetime
+        self.store.save(sid, dict(session_obj), expires_at)
+        session_obj.sid = sid
+        session_obj.expires_at = expires_at
+        session_obj.rotate = False
+
+        response.set_cookie(
+            name,
+            sid,
+            expires=datetime.fromtimestamp(expires_at, timezone.utc) if session_obj.permanent else None,
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite,
+        )
+
+
+def rotate_session():
+    """Issue a fresh session token for the current session (call after login)"""
+    if isinstance(session._get_current_object(), ServerSession):
+        session.rotate = True
+        session.modified = True
+
+
+def configure_server_session(app, backend=None):
+    """Install the server-side session interface selected by SESSION_BACKEND"""
+    backend = (backend or SESSION_BACKEND).lower()
+    if backend == 'memory':
+        app.session_interface = ServerSessionInterface(MemorySessionStore())
+    elif backend == 'sqlite':
+        app.session_interface = ServerSessionInterface(SqliteSessionStore())
+    else:
+        return None
+    print(f"✓ Server-side sessions enabled ({backend})")
+    return app.session_interface
@@ -0,0 +1,246 @@
+"""
+Streaming ledger statement export for KathaPe Customer App
+Rows are read through a paginated Appwrite cursor and written out as CSV or
+XLSX chunks, so memory stays flat regardless of how long the history is
+"""
+import io
+import re
+import csv
+import zipfile
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+import pytz
+from appwrite.query import Query
+
+from appwrite_utils import appwrite_db_instance, iter_customer_transactions, format_transaction_date, BUSINESSES_COLLECTION
+
+# Number of rows written between flushes to the client
+EXPORT_FLUSH_ROWS = 200
+
+STATEMENT_COLUMNS = ['Date', 'Business', 'Type', 'Credit', 'Payment', 'Notes', 'Balance']
+
+IST = pytz.timezone('Asia/Kolkata')
+
+# Characters XML 1.0 does not allow inside a worksheet
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# A CSV text cell starting with one of these is run as a formula by Excel and Sheets
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def parse_statement_date(value):
+    """Parse a YYYY-MM-DD query parameter, returning None if missing or malformed"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _ist_day_start(day):
+    """ISO timestamp for midnight IST at the start of the given date"""
+    return IST.localize(datetime(day.year, day.month, day.day)).isoformat()
+
+
+def _signed_amount(tx):
+    """Credit increases what the customer owes, payment reduces it"""
+    try:
+        amount = float(tx.get('amount') or 0)
+    except (TypeError, ValueError):
+        amount = 0.0
+    return amount if tx.get('transaction_type') == 'credit' else -amount
+
+
+def statement_rows(customer_id, business_id=None, start_date=None, end_date=None):
+    """
+    Yield statement rows oldest first with a running balance.
+    When a start date is given, the opening balance is streamed from earlier
+    transactions first and emitted as its own row. A page that can't be read
+    raises rather than ending the statement early with a wrong balance.
+    """
+    business_names = {}
+
+    def business_name(bid):
+        if bid not in business_names:
+            business = appwrite_db_instance.get_document(BUSINESSES_COLLECTION, bid, projection='name') if bid else None
+            business_names[bid] = business.get('name', 'Unknown Business') if business else 'Unknown Business'
+        return business_names[bid]
+
+    balance = 0.0
+    range_queries = []
+    if start_date:
+        start_iso = _ist_day_start(start_date)
+        for tx in iter_customer_transactions(customer_id, business_id,
+                                             [Query.less_than('$createdAt', start_iso)], projection='balance',
+                                             strict=True):
+            balance += _signed_amount(tx)
+        range_queries.append(Query.greater_than_equal('$createdAt', start_iso))
+        yield [start_date.strftime('%B %d, %Y'), '', 'Opening balance', '', '', '', round(balance, 2)]
+    if end_date:
+        range_queries.append(Query.less_than('$createdAt', _ist_day_start(end_date + timedelta(days=1))))
+
+    for tx in iter_customer_transactions(customer_id, business_id, range_queries, projection='statement',
+                                         strict=True):
+        signed = _signed_amount(tx)
+        balance += signed
+        is_credit = tx.get('transaction_type') == 'credit'
+        yield [
+            format_transaction_date(tx.get('created_at') or tx.get('$createdAt', '')),
+            business_name(tx.get('business_id')),
+            'Credit' if is_credit else 'Payment',
+            round(signed, 2) if is_credit else '',
+            '' if is_credit else round(-signed, 2),
+            tx.get('notes') or '',
+            round(balance, 2)
+        ]
+
+
+def _csv_cell(value):
+    """Quote text that a spreadsheet would evaluate, e.g. a note typed as =HYPERLINK(...)"""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_csv(rows):
+    """Encode statement rows as CSV, yielding a chunk every EXPORT_FLUSH_ROWS rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the file as UTF-8 (₹ and Indic names)
+    buffer.write('\ufeff')
+    writer.writerow(STATEMENT_COLUMNS)
+    yield buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+
+    pending = 0
+    for row in rows:
+        writer.writerow([_csv_cell(value) for value in row])
+        pending += 1
+        if pending >= EXPORT_FLUSH_ROWS:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object that zipfile streams into"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Statement" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _xlsx_row(values):
+    """Render one worksheet row using inline strings, so no shared-string table is needed"""
+    cells = []
+    for value in values:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c t="n"><v>{value}</v></c>')
+        elif value == '' or value is None:
+            cells.append('<c/>')
+        else:
+            text = escape(_ILLEGAL_XML_CHARS.sub('', str(value)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+
+def stream_xlsx(rows):
+    """
+    Encode statement rows as a minimal XLSX workbook.
+    zipfile writes data descriptors when the target can't seek, so the
+    archive is produced front to back and drained as it grows.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _XLSX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _XLSX_ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _XLSX_WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', _XLSX_WORKBOOK_RELS)
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + _xlsx_row(STATEMENT_COLUMNS)
+            ).encode('utf-8'))
+            yield sink.drain()
+
+            pending = 0
+            for row in rows:
+                sheet.write(_xlsx_row(row).encode('utf-8'))
+                pending += 1
+                if pending >= EXPORT_FLUSH_ROWS:
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+                    pending = 0
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+
+# Export formats: name -> (encoder, mimetype, file extension)
+STATEMENT_FORMATS = {
+    'csv': (stream_csv, 'text/csv', 'csv'),
+    'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
@@ -0,0 +1,341 @@
+// Versioned service worker URL, rendered by base.html onto this script tag
+const SERVICE_WORKER_URL = document.currentScript.dataset.swUrl;
+
+// Theme toggle functionality
+function toggleTheme() {
+    const html = document.documentElement;
+    const currentTheme = html.getAttribute('data-theme');
+    const newTheme = currentTheme === 'light' ? 'dark' : 'light';
+    
+    html.setAttribute('data-theme', newTheme);
+    
+    // Toggle icons
+    const moonIcon = document.querySelector('.theme-toggle .fa-moon');
+    const sunIcon = document.querySelector('.theme-toggle .fa-sun');
+    
+    if (newTheme === 'dark') {
+        moonIcon.style.display = 'none';
+        sunIcon.style.display = 'block';
+        document.body.classList.add('dark-mode');
+    } else {
+        moonIcon.style.display = 'block';
+        sunIcon.style.display = 'none';
+        document.body.classList.remove('dark-mode');
+    }
+    
+    // Save preference to local storage
+    localStorage.setItem('theme', newTheme);
+}
+
+// Apply saved theme on page load
+document.addEventListener('DOMContentLoaded', function() {
+    const savedTheme = localStorage.getItem('theme');
+    if (savedTheme) {
+        document.documentElement.setAttribute('data-theme', savedTheme);
+        
+        // Set correct icon
+        const moonIcon = document.querySelector('.theme-toggle .fa-moon');
+        const sunIcon = document.querySelector('.theme-toggle .fa-sun');
+        
+        if (savedTheme === 'dark') {
+            moonIcon.style.display = 'none';
+            sunIcon.style.display = 'block';
+            document.body.classList.add('dark-mode');
+        }
+    }
+    
+    // Register service worker
+    if ('serviceWorker' in navigator) {
+        window.addEventListener('load', function() {
+            navigator.serviceWorker.register(SERVICE_WORKER_URL)
+                .then(function(registration) {
+                    console.log('ServiceWorker registration successful');
+                }, function(err) {
+                    console.log('ServiceWorker registration failed: ', err);
+                });
+            
+            // The worker used to live at /static/sw.js, scoped to /static/ only; drop that registration
+            navigator.serviceWorker.getRegistrations().then(function(registrations) {
+                registrations.forEach(function(registration) {
+                    if (new URL(registration.scope).pathname === '/static/') {
+                        registration.unregister();
+                    }
+                });
+            });
+        });
+        
+        // The worker answers ledger API calls from IndexedDB and re-fetches in the background;
+        // re-announce fresh data as a DOM event so pages can re-render without polling
+        navigator.serviceWorker.addEventListener('message', function(event) {
+            if (event.data && event.data.type === 'ledger-updated') {
+                document.dispatchEvent(new CustomEvent('khatape:ledger-updated', { detail: event.data }));
+            }
+            if (event.data && event.data.type === 'transactions-synced') {
+                document.dispatchEvent(new CustomEvent('khatape:transactions-synced', { detail: event.data }));
+            }
+            if (event.data && event.data.type === 'transaction-rejected') {
+                document.dispatchEvent(new CustomEvent('khatape:transaction-rejected', { detail: event.data }));
+            }
+        });
+        
+        // Transactions saved while offline are replayed by Background Sync where the browser has it;
+        // elsewhere, nudge the worker whenever this page is (back) online
+        const replayOutbox = function() {
+            if (navigator.onLine && navigator.serviceWorker.controller) {
+                navigator.serviceWorker.controller.postMessage({ type: 'replay-outbox' });
+            }
+        };
+        window.addEventListener('online', replayOutbox);
+        replayOutbox();
+    }
+});
+
+// PWA Install functionality
+let deferredPrompt;
+const installButton = document.getElementById('installButton');
+
+// Show install button initially for testing
+console.log('Install button element:', installButton);
+if (installButton) {
+    installButton.style.display = 'flex';
+    console.log('Install button is now visible');
+}
+
+// Force PWA install criteria detection for localhost
+let canInstall = false;
+
+// Listen for the beforeinstallprompt event
+window.addEventListener('beforeinstallprompt', (e) => {
+    console.log('✅ beforeinstallprompt event fired - PWA can be installed!');
+    e.preventDefault();
+    deferredPrompt = e;
+    canInstall = true;
+    
+    if (installButton) {
+        installButton.style.display = 'flex';
+        installButton.style.background = 'linear-gradient(135deg, #007bff, #0056b3)';
+        installButton.querySelector('.install-button-text').innerHTML = 'Install<br>Now!';
+        console.log('✅ Native install prompt is available');
+    }
+});
+
+// For localhost testing - simulate install readiness after service worker loads
+if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.register(SERVICE_WORKER_URL).then((registration) => {
+        console.log('✅ Service Worker registered successfully');
+        
+        // Wait a bit then check if we can trigger install
+        setTimeout(() => {
+            if (!deferredPrompt && installButton) {
+                console.log('🔧 Attempting to trigger install readiness for localhost');
+                
+                // Simulate engagement metrics for PWA install criteria
+                const simulateEngagement = () => {
+                    // Create fake user interactions to meet PWA criteria
+                    const clickEvent = new MouseEvent('click', { bubbles: true });
+                    const touchEvent = new TouchEvent('touchstart', { bubbles: true });
+                    
+                    document.dispatchEvent(clickEvent);
+                    setTimeout(() => {
+                        // Try to trigger the install prompt manually
+                        if (!deferredPrompt) {
+                            console.log('⚡ Forcing install availability for localhost testing');
+                            canInstall = true;
+                            
+                            if (installButton) {
+                                installButton.style.background = 'linear-gradient(135deg, #28a745, #20c997)';
+                                installButton.querySelector('.install-button-text').innerHTML = 'Add to<br>Home';
+                            }
+                        }
+                    }, 500);
+                };
+                
+                simulateEngagement();
+            }
+        }, 2000);
+    }).catch((err) => {
+        console.log('❌ Service Worker registration failed:', err);
+    });
+}
+
+// Check if app is already installed
+if (window.matchMedia && window.matchMedia('(display-mode: standalone)').matches) {
+    console.log('ℹ️ App is running in standalone mode (already installed)');
+    if (installButton) {
+        installButton.style.display = 'none';
+    }
+}
+
+function installApp() {
+    console.log('Install button clicked');
+    
+    // Check if we have the native install prompt
+    if (deferredPrompt) {
+        console.log('Using native PWA install prompt');
+        deferredPrompt.prompt();
+        deferredPrompt.userChoice.then((choiceResult) => {
+            if (choiceResult.outcome === 'accepted') {
+                console.log('User accepted the install prompt');
+                if (installButton) {
+                    installButton.style.display = 'none';
+                }
+                alert('✅ KhataPe has been added to your home screen!');
+            } else {
+                console.log('User dismissed the install prompt');
+            }
+            deferredPrompt = null;
+        });
+        return;
+    }
+    
+    // Try to trigger install using other methods
+    console.log('Attempting alternative install methods');
+    
+    // Check if running in standalone mode (already installed)
+    if (window.matchMedia && window.matchMedia('(display-mode: standalone)').matches) {
+        alert('✅ App is already installed on your device!');
+        if (installButton) {
+            installButton.style.display = 'none';
+        }
+        return;
+    }
+    
+    // Check for iOS and try to trigger native behavior
+    const isIOS = /iPad|iPhone|iPod/.test(navigator.userAgent) && !window.MSStream;
+    const isAndroid = /Android/.test(navigator.userAgent);
+    const isChrome = /Chrome/.test(navigator.userAgent) && /Google Inc/.test(navigator.vendor);
+    const isSafari = /Safari/.test(navigator.userAgent) && /Apple Computer/.test(navigator.vendor) && !isChrome;
+    
+    if (isIOS && isSafari) {
+        // For iOS Safari, we need to show instructions as there's no programmatic way
+        alert('📱 To install KhataPe:\n\n1. Tap the Share button (⬆️) below\n2. Select "Add to Home Screen"\n3. Tap "Add"\n\n✨ The app will appear on your home screen!');
+        return;
+    }
+    
+    if (isAndroid && isChrome) {
+        // For Android Chrome, try to trigger the install banner
+        console.log('Android Chrome detected, checking for install criteria');
+        
+        // Check if service worker is ready
+        if ('serviceWorker' in navigator) {
+            navigator.serviceWorker.ready.then(() => {
+                console.log('Service worker is ready');
+                
+                // Try to trigger install event manually
+                const installEvent = new Event('beforeinstallprompt');
+                window.dispatchEvent(installEvent);
+                
+                // Fallback: Show Chrome-specific instructions
+                setTimeout(() => {
+                    if (!deferredPrompt) {
+                        alert('🔧 To install KhataPe on Android:\n\n1. Open Chrome menu (⋮)\n2. Tap "Add to Home screen"\n3. Tap "Add"\n\n✨ App will be added to your home screen!');
+                    }
+                }, 1000);
+            });
+        } else {
+            alert('🔧 To install: Open in Chrome → Menu (⋮) → "Add to Home screen"');
+        }
+        return;
+    }
+    
+    // For desktop browsers
+    if (isChrome && !isAndroid && !isIOS) {
+        alert('� To install KhataPe on desktop:\n\n1. Look for the install icon (⬇️) in the address bar\n2. OR click Chrome menu (⋮) → "Install KhataPe"\n3. Click "Install"\n\n✨ App will open in its own window!');
+        return;
+    }
+    
+    // Generic fallback
+    alert('🌐 To add KhataPe to your home screen:\n\n• Chrome: Menu → "Add to Home screen"\n• Safari: Share → "Add to Home Screen"\n• Edge: Menu → "Apps" → "Install this site"\n\n✨ Access KhataPe like a native app!');
+}
+
+// Hide the install button if the app is already installed
+window.addEventListener('appinstalled', () => {
+    if (installButton) {
+        installButton.style.display = 'none';
+    }
+    console.log('PWA was installed');
+});
+
+// Mobile navigation functionality with improved touch support
+const navToggle = document.getElementById('navToggle');
+const navLinks = document.getElementById('navLinks');
+
+if (navToggle && navLinks) {
+    // Improved menu toggle function
+    const toggleMenu = (e) => {
+        e.preventDefault();
+        e.stopPropagation();
+        
+        const isActive = navLinks.classList.contains('active');
+        
+        if (isActive) {
+            navLinks.classList.remove('active');
+            navToggle.setAttribute('aria-expanded', 'false');
+            console.log('Menu closed');
+        } else {
+            navLinks.classList.add('active');
+            navToggle.setAttribute('aria-expanded', 'true');
+            console.log('Menu opened');
+        }
+    };
+    
+    // Add multiple event listeners for better mobile support
+    navToggle.addEventListener('click', toggleMenu, { passive: false });
+    navToggle.addEventListener('touchend', toggleMenu, { passive: false });
+    
+    // Prevent double-firing on devices that support both touch and mouse
+    let touchHandled = false;
+    navToggle.addEventListener('touchstart', (e) => {
+        touchHandled = true;
+        setTimeout(() => { touchHandled = false; }, 300);
+    }, { passive: true });
+    
+    navToggle.addEventListener('mousedown', (e) => {
+        if (touchHandled) {
+            e.preventDefault();
+            return;
+        }
+    });
+    
+    // Close mobile menu when clicking/touching outside
+    const closeMenu = (e) => {
+        if (navLinks.classList.contains('active') && 
+            !navLinks.contains(e.target) && 
+            e.target !== navToggle && 
+            !navToggle.contains(e.target)) {
+            navLinks.classList.remove('active');
+            navToggle.setAttribute('aria-expanded', 'false');
+            console.log('Menu closed by outside click');
+        }
+    };
+    
+    document.addEventListener('click', closeMenu);
+    document.addEventListener('touchend', closeMenu);
+    
+    // Close menu when clicking on nav links (for mobile)
+    navLinks.addEventListener('click', (e) => {
+        if (e.target.tagName === 'A') {
+            navLinks.classList.remove('active');
+            navToggle.setAttribute('aria-expanded', 'false');
+            console.log('Menu closed by nav link click');
+        }
+    });
+    
+    // Set initial aria attributes
+    navToggle.setAttribute('aria-expanded', 'false');
+    navToggle.setAttribute('aria-controls', 'navLinks');
+}
+
+// Auto-hide flash messages after 3 seconds
+document.addEventListener('DOMContentLoaded', () => {
+    const flashMessages = document.querySelectorAll('.flash-message');
+    flashMessages.forEach(message => {
+        setTimeout(() => {
+            message.style.transition = 'opacity 0.5s ease-out';
+            message.style.opacity = '0';
+            setTimeout(() => {
+                message.remove();
+            }, 500); // Remove after fade out
+        }, 3000); // Start fading after 3 seconds
+    });
+});
@@ -0,0 +1,208 @@
+// Form target and CSRF token, rendered by scan_qr.html onto this script tag
+const SCAN_CONFIG = document.currentScript.dataset;
+
+    document.addEventListener('DOMContentLoaded', function() {
+        const scanMessage = document.querySelector('.scan-message');
+        const flipButton = document.getElementById('flip-camera');
+        const qrReader = document.getElementById('qr-reader');
+        const permissionOverlay = document.getElementById('camera-permission-overlay');
+        const retryButton = document.getElementById('retry-camera');
+        
+        let currentCamera = 'environment'; // Start with back camera
+        let html5QrCode;
+        let scanning = false;
+        let cameraInitialized = false;
+        
+        // Configuration for scanner
+        const config = { 
+            fps: 10, 
+            qrbox: {width: 250, height: 250},
+            aspectRatio: 1,
+            showTorchButtonIfSupported: true,
+            formatsToSupport: [Html5QrcodeSupportedFormats.QR_CODE]
+        };
+        
+        // Initialize and start the scanner
+        function initScanner() {
+            // Create a new instance
+            html5QrCode = new Html5Qrcode("qr-reader");
+            
+            // Check for camera permissions first
+            navigator.mediaDevices.getUserMedia({ video: true })
+                .then(function(stream) {
+                    // Permission granted
+                    stream.getTracks().forEach(track => track.stop());
+                    permissionOverlay.style.display = 'none';
+                    startScanner();
+                })
+                .catch(function(err) {
+                    // Permission denied or error
+                    console.error("Camera permission error:", err);
+                    permissionOverlay.style.display = 'flex';
+                    scanMessage.textContent = 'Camera access required';
+                });
+        }
+        
+        // Function to start the scanner
+        function startScanner() {
+            if (scanning) return;
+            
+            scanning = true;
+            scanMessage.textContent = 'Starting camera...';
+            
+            // Make sure the QR reader is visible
+            qrReader.style.display = 'block';
+            
+            const constraints = {
+                facingMode: currentCamera,
+                width: { ideal: 1280 },
+                height: { ideal: 720 }
+            };
+            
+            html5QrCode.start(
+                constraints,
+                config,
+                onQRCodeSuccess,
+                onQRCodeError
+            ).then(() => {
+                cameraInitialized = true;
+                scanMessage.textContent = 'Scanning for QR code...';
+                permissionOverlay.style.display = 'none';
+            }).catch(err => {
+                scanning = false;
+                console.error("QR Scanner error:", err);
+                scanMessage.textContent = 'Camera access error';
+                permissionOverlay.style.display = 'flex';
+                
+                // Try with a more basic configuration if first attempt failed
+                if (!cameraInitialized) {
+                    setTimeout(() => {
+                        tryFallbackCamera();
+                    }, 1000);
+                }
+            });
+        }
+        
+        function tryFallbackCamera() {
+            scanMessage.textContent = 'Trying alternate camera settings...';
+            
+            // Try with more basic settings
+            html5QrCode.start(
+                { facingMode: 'environment' },
+                { fps: 5, qrbox: 250 },
+                onQRCodeSuccess,
+                onQRCodeError
+            ).then(() => {
+                cameraInitialized = true;
+                scanMessage.textContent = 'Scanning for QR code...';
+                permissionOverlay.style.display = 'none';
+                currentCamera = 'environment'; // Update current camera
+            }).catch(err2 => {
+                // If even the fallback fails, try user facing camera
+                tryUserCamera();
+            });
+        }
+        
+        function tryUserCamera() {
+            scanMessage.textContent = 'Trying front camera...';
+            
+            html5QrCode.start(
+                { facingMode: 'user' },
+                { fps: 5, qrbox: 250 },
+                onQRCodeSuccess,
+                onQRCodeError
+            ).then(() => {
+                cameraInitialized = true;
+                scanMessage.textContent = 'Scanning for QR code...';
+                permissionOverlay.style.display = 'none';
+                currentCamera = 'user'; // Update current camera
+            }).catch(err3 => {
+                scanMessage.textContent = 'Could not access camera';
+                permissionOverlay.style.display = 'flex';
+                console.error("All camera attempts failed:", err3);
+            });
+        }
+        
+        // Function to stop the scanner
+        function stopScanner() {
+            if (!scanning) return;
+            
+            html5QrCode.stop().then(() => {
+                scanning = false;
+            }).catch(err => {
+                console.error("Error stopping scanner:", err);
+            });
+        }
+        
+        // Success callback when QR code is scanned
+        function onQRCodeSuccess(decodedText, decodedResult) {
+            // Stop scanning
+            stopScanner();
+            
+            scanMessage.textContent = 'QR Code detected! Connecting...';
+            
+            // Process the QR code data
+            // Format is expected to be "business:ACCESS_PIN"
+            if (decodedText.startsWith('business:')) {
+                const accessPin = decodedText.split(':')[1];
+                
+                // Submit the PIN programmatically
+                const form = document.createElement('form');
+                form.method = 'POST';
+                form.action = SCAN_CONFIG.selectBusinessUrl;
+                
+                const input = document.createElement('input');
+                input.type = 'hidden';
+                input.name = 'access_pin';
+                input.value = accessPin;
+                
+                const csrfToken = document.createElement('input');
+                csrfToken.type = 'hidden';
+                csrfToken.name = 'csrf_token';
+                csrfToken.value = SCAN_CONFIG.csrfToken || '';
+                
+                form.appendChild(input);
+                if (csrfToken.value) {
+                    form.appendChild(csrfToken);
+                }
+                document.body.appendChild(form);
+                form.submit();
+            } else {
+                scanMessage.textContent = 'Invalid QR Code. Please try again.';
+                // Restart scanner after a brief delay
+                setTimeout(() => startScanner(), 2000);
+            }
+        }
+        
+        // Error callback
+        function onQRCodeError(error) {
+            // Just continue scanning, no need to handle error
+            // This function is called continuously when no QR code is present
+        }
+        
+        // Flip camera button
+        flipButton.addEventListener('click', function() {
+            if (!scanning) return;
+            
+            stopScanner();
+            currentCamera = currentCamera === 'environment' ? 'user' : 'environment';
+            scanMessage.textContent = 'Switching camera...';
+            setTimeout(() => startScanner(), 500);
+        });
+        
+        // Retry camera button
+        retryButton.addEventListener('click', function() {
+            permissionOverlay.style.display = 'none';
+            initScanner();
+        });
+        
+        // Initialize scanner when page loads
+        initScanner();
+        
+        // Clean up when leaving the page
+        window.addEventListener('beforeunload', function() {
+            if (scanning) {
+                stopScanner();
+            }
+        });
+    });
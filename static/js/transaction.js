@@ -0,0 +1,387 @@
+// Business this page records transactions for, rendered by transaction.html onto this script tag
+const BUSINESS_ID = document.currentScript.dataset.businessId;
+
+let currentTransactionId = null;
+
+function openPhonePeQR() {
+    const amount = document.getElementById('amount').value;
+    const notes = document.getElementById('notes').value;
+    
+    if (!amount || amount <= 0) {
+        alert('Please enter a valid amount');
+        return;
+    }
+    
+    // Show modal
+    document.getElementById('phonepeModal').style.display = 'block';
+    document.getElementById('phonepeLoading').style.display = 'block';
+    document.getElementById('phonepeSuccess').style.display = 'none';
+    document.getElementById('phonepePending').style.display = 'none';
+    
+    // Make AJAX request to initiate PhonePe payment
+    fetch(`/phonepe_qr_payment/${BUSINESS_ID}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/x-www-form-urlencoded',
+        },
+        body: `amount=${amount}&notes=${encodeURIComponent(notes)}`
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            currentTransactionId = data.transaction_id;
+            
+            // Update payment details in modal
+            document.getElementById('paymentAmount').textContent = data.amount;
+            document.getElementById('businessName').textContent = data.business_name;
+            document.getElementById('pendingAmount').textContent = data.amount;
+            document.getElementById('pendingBusinessName').textContent = data.business_name;
+            
+            // Try to open PhonePe
+            try {
+                window.location.href = data.phonepe_url;
+            } catch (error) {
+                console.log('Could not open PhonePe app:', error);
+            }
+            
+            // Show success screen after 2 seconds
+            setTimeout(() => {
+                document.getElementById('phonepeLoading').style.display = 'none';
+                document.getElementById('phonepeSuccess').style.display = 'block';
+            }, 2000);
+            
+        } else {
+            alert('Error: ' + data.error);
+            closePhonePeModal();
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('Failed to initiate PhonePe payment');
+        closePhonePeModal();
+    });
+}
+
+function closePhonePeModal() {
+    document.getElementById('phonepeModal').style.display = 'none';
+    currentTransactionId = null;
+}
+
+function markPaymentDone() {
+    if (!currentTransactionId) {
+        alert('No pending transaction found');
+        return;
+    }
+    
+    fetch(`/complete_phonepe_payment/${currentTransactionId}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            if (data.status === 'confirmed') {
+                // Payment automatically confirmed, show success and redirect
+                alert(data.message);
+                closePhonePeModal();
+                if (data.redirect_url) {
+                    window.location.href = data.redirect_url;
+                } else {
+                    window.location.reload();
+                }
+            } else {
+                // Show pending confirmation screen (fallback)
+                document.getElementById('phonepeSuccess').style.display = 'none';
+                document.getElementById('phonepePending').style.display = 'block';
+            }
+        } else {
+            alert('Error: ' + data.error);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('Failed to mark payment as done');
+    });
+}
+
+function checkPaymentStatus() {
+    if (!currentTransactionId) {
+        alert('No pending transaction found');
+        return;
+    }
+    
+    fetch(`/check_payment_status/${currentTransactionId}`)
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            if (data.status === 'approved') {
+                alert(data.message);
+                closePhonePeModal();
+                window.location.reload(); // Refresh to show updated balance
+            } else {
+                alert(data.message);
+            }
+        } else {
+            alert('Error: ' + data.error);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('Failed to check payment status');
+    });
+}
+
+function goBackToBusiness() {
+    closePhonePeModal();
+    window.location.href = `/business/${BUSINESS_ID}`;
+}
+
+// Bill photo preview functions
+function takePicture() {
+    const input = document.getElementById('bill_photo');
+    
+    // For mobile devices, trigger the camera directly
+    if (/Android|iPhone|iPad|iPod|BlackBerry|IEMobile|Opera Mini/i.test(navigator.userAgent)) {
+        input.click();
+        return;
+    }
+    
+    // For desktop, use camera API if available
+    if (navigator.mediaDevices && navigator.mediaDevices.getUserMedia) {
+        // Create camera modal
+        const modal = document.createElement('div');
+        modal.style.cssText = `
+            position: fixed; top: 0; left: 0; width: 100%; height: 100%;
+            background: rgba(0,0,0,0.9); z-index: 9999; display: flex;
+            flex-direction: column; align-items: center; justify-content: center;
+        `;
+        
+        const video = document.createElement('video');
+        video.style.cssText = 'width: 90%; max-width: 500px; height: auto;';
+        video.autoplay = true;
+        
+        const canvas = document.createElement('canvas');
+        canvas.style.display = 'none';
+        
+        const captureBtn = document.createElement('button');
+        captureBtn.innerHTML = '<i class="fas fa-camera"></i> Capture Photo';
+        captureBtn.style.cssText = `
+            margin: 20px; padding: 15px 30px; background: #28a745; color: white;
+            border: none; border-radius: 8px; font-size: 16px; cursor: pointer;
+        `;
+        
+        const closeBtn = document.createElement('button');
+        closeBtn.innerHTML = '<i class="fas fa-times"></i> Cancel';
+        closeBtn.style.cssText = `
+            margin: 20px; padding: 15px 30px; background: #dc3545; color: white;
+            border: none; border-radius: 8px; font-size: 16px; cursor: pointer;
+        `;
+        
+        modal.appendChild(video);
+        modal.appendChild(captureBtn);
+        modal.appendChild(closeBtn);
+        modal.appendChild(canvas);
+        document.body.appendChild(modal);
+        
+        // Start camera
+        navigator.mediaDevices.getUserMedia({ 
+            video: { 
+                facingMode: 'environment' // Use back camera on mobile
+            } 
+        })
+        .then(stream => {
+            video.srcObject = stream;
+            
+            captureBtn.onclick = () => {
+                canvas.width = video.videoWidth;
+                canvas.height = video.videoHeight;
+                canvas.getContext('2d').drawImage(video, 0, 0);
+                
+                canvas.toBlob(blob => {
+                    const file = new File([blob], 'camera-photo.jpg', { type: 'image/jpeg' });
+                    const dataTransfer = new DataTransfer();
+                    dataTransfer.items.add(file);
+                    input.files = dataTransfer.files;
+                    
+                    previewBillPhoto(input);
+                    
+                    // Clean up
+                    stream.getTracks().forEach(track => track.stop());
+                    document.body.removeChild(modal);
+                }, 'image/jpeg', 0.8);
+            };
+            
+            closeBtn.onclick = () => {
+                stream.getTracks().forEach(track => track.stop());
+                document.body.removeChild(modal);
+            };
+        })
+        .catch(err => {
+            console.error('Camera error:', err);
+            document.body.removeChild(modal);
+            alert('Unable to access camera. Please use file upload instead.');
+        });
+    } else {
+        // Fallback to file input
+        input.click();
+    }
+}
+
+function previewBillPhoto(input) {
+    const preview = document.getElementById('billPhotoPreview');
+    const previewImage = document.getElementById('previewImage');
+    const hint = input.parentElement.querySelector('.file-upload-hint');
+    
+    if (input.files && input.files[0]) {
+        const file = input.files[0];
+        
+        // Check file size (16MB limit)
+        if (file.size > 16 * 1024 * 1024) {
+            alert('File size must be less than 16MB');
+            input.value = '';
+            return;
+        }
+        
+        // Check file type
+        const allowedTypes = ['image/png', 'image/jpg', 'image/jpeg', 'image/gif'];
+        if (!allowedTypes.includes(file.type)) {
+            alert('Please upload only PNG, JPG, JPEG, or GIF files');
+            input.value = '';
+            return;
+        }
+        
+        const reader = new FileReader();
+        reader.onload = function(e) {
+            previewImage.src = e.target.result;
+            preview.style.display = 'block';
+            hint.style.display = 'none';
+        };
+        reader.readAsDataURL(file);
+    }
+}
+
+function removeBillPhoto() {
+    const input = document.getElementById('bill_photo');
+    const preview = document.getElementById('billPhotoPreview');
+    const hint = input.parentElement.querySelector('.file-upload-hint');
+    
+    input.value = '';
+    preview.style.display = 'none';
+    hint.style.display = 'flex';
+}
+
+// Close modal when clicking outside of it
+window.onclick = function(event) {
+    const modal = document.getElementById('phonepeModal');
+    if (event.target == modal) {
+        closePhonePeModal();
+    }
+}
+
+// One key per page load: a double submit or an offline replay of this form is recorded only once
+(function() {
+    const keyField = document.getElementById('idempotency_key');
+    if (keyField && !keyField.value) {
+        keyField.value = (window.crypto && crypto.randomUUID)
+            ? crypto.randomUUID()
+            : Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+    }
+})();
+
+// Upload the bill photo with server-signed parameters, then submit the form without the file.
+// Any failure submits the form as-is so the server uploads the photo instead.
+function uploadBillDirect(form, billPhoto) {
+    fetch('/api/bill_upload', { method: 'POST', credentials: 'same-origin' })
+    .then(response => response.json())
+    .then(params => {
+        if (!params.success) {
+            throw new Error(params.error || 'Could not get upload signature');
+        }
+        const body = new FormData();
+        body.append('file', billPhoto.files[0]);
+        ['api_key', 'timestamp', 'signature', 'public_id', 'tags', 'transformation'].forEach(name => {
+            body.append(name, params[name]);
+        });
+        return fetch(params.upload_url, { method: 'POST', body: body });
+    })
+    .then(response => response.json())
+    .then(upload => {
+        if (!upload.public_id || !upload.signature) {
+            throw new Error((upload.error && upload.error.message) || 'Upload failed');
+        }
+        document.getElementById('bill_public_id').value = upload.public_id;
+        document.getElementById('bill_version').value = upload.version;
+        document.getElementById('bill_signature').value = upload.signature;
+        billPhoto.value = '';
+        form.submit();
+    })
+    .catch(error => {
+        console.error('Direct bill upload failed, uploading through the server:', error);
+        form.submit();
+    });
+}
+
+// Form submission with loading state
+document.querySelector('.transaction-form').addEventListener('submit', function(e) {
+    const submitBtn = document.getElementById('submitBtn');
+    const btnText = submitBtn.querySelector('.btn-text');
+    const btnLoading = submitBtn.querySelector('.btn-loading');
+    const loadingText = document.getElementById('loadingText');
+    const billPhoto = document.getElementById('bill_photo');
+    
+    // Show loading state
+    btnText.style.display = 'none';
+    btnLoading.style.display = 'flex';
+    submitBtn.disabled = true;
+    
+    // Update loading text based on whether photo is selected
+    if (billPhoto.files && billPhoto.files.length > 0) {
+        const fileSize = (billPhoto.files[0].size / 1024 / 1024).toFixed(1);
+        loadingText.textContent = `Uploading image (${fileSize}MB)...`;
+        
+        // Send the photo straight to Cloudinary and submit only its public_id;
+        // offline, the service worker queues the plain form instead
+        if (navigator.onLine && window.fetch && window.FormData) {
+            e.preventDefault();
+            uploadBillDirect(this, billPhoto);
+        }
+        
+        // Show progress updates
+        let dots = 0;
+        const progressInterval = setInterval(() => {
+            dots = (dots + 1) % 4;
+            loadingText.textContent = `Uploading image (${fileSize}MB)${'.'.repeat(dots)}`;
+        }, 500);
+        
+        // Store interval to clear later (form will submit and page will reload)
+        window.uploadProgressInterval = progressInterval;
+    } else {
+        loadingText.textContent = 'Processing transaction...';
+    }
+});
+
+// Photo preview functionality
+document.getElementById('bill_photo').addEventListener('change', function(e) {
+    const file = e.target.files[0];
+    if (file) {
+        // Check file size and show warning if large
+        const fileSize = (file.size / 1024 / 1024).toFixed(1);
+        if (file.size > 2 * 1024 * 1024) {  // 2MB
+            alert(`Large file selected (${fileSize}MB). Upload may take longer. Consider compressing the image for faster upload.`);
+        }
+        
+        const reader = new FileReader();
+        reader.onload = function(e) {
+            document.getElementById('preview-image').src = e.target.result;
+            document.getElementById('photo-preview').style.display = 'block';
+        };
+        reader.readAsDataURL(file);
+    }
+});
+
+document.getElementById('remove-photo').addEventListener('click', function() {
+    document.getElementById('bill_photo').value = '';
+    document.getElementById('photo-preview').style.display = 'none';
+});
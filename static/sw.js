@@ -1,49 +1,641 @@
-const CACHE_NAME = 'khatape-v1';
+// Served from /sw.js so its scope covers pages and /api/*.
+// Cache names follow the asset manifest version the page registered us with (sw.js?v=<version>),
+// so each deploy gets a fresh cache and the old one is dropped on activate.
+const CACHE_PREFIX = 'khatape-';
+const ASSET_VERSION = new URL(self.location).searchParams.get('v') || 'dev';
+const CACHE_NAME = CACHE_PREFIX + ASSET_VERSION;
+const STATIC_PREFIX = '/static/';
 const urlsToCache = [
-  '/',
-  '/static/css/style.css',
-  '/static/css/dark-theme.css',
-  '/static/images/icon-192x192.svg',
-  '/static/images/icon-512x512.svg',
   'https://fonts.googleapis.com/css2?family=Nunito:wght@300;400;500;600;700&display=swap',
   'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.2.0/css/all.min.css'
 ];
 
+// Ledger API responses live in IndexedDB and are served stale-while-revalidate.
+// Bump LEDGER_SCHEMA_VERSION whenever the shape of these API payloads changes:
+// records written by an older version are evicted on activate.
+const LEDGER_DB_NAME = 'khatape-ledger';
+const LEDGER_STORE = 'responses';
+const LEDGER_SCHEMA_VERSION = 1;
+const LEDGER_MAX_AGE_MS = 14 * 24 * 60 * 60 * 1000;
+const LEDGER_MAX_ENTRIES = 200;
+const LEDGER_API_PATTERN = /^\/api\/(businesses|transactions\/[^/]+)$/;
+
+// Transaction submits that fail for lack of network are kept in an IndexedDB outbox
+// (bill photo included) and replayed by Background Sync, or when a page reports it is online.
+// Each carries an idempotency key, so a replay the server already saw is not recorded twice.
+const TRANSACTION_POST_PATTERN = /^\/transaction\/(credit|payment)\/([^/]+)$/;
+const OUTBOX_STORE = 'outbox';
+const META_STORE = 'meta';
+const OUTBOX_SYNC_TAG = 'khatape-transaction-outbox';
+// Wait this long before replaying again after a 5xx/429 that carried no Retry-After
+const OUTBOX_RETRY_DEFAULT_MS = 30 * 1000;
+
+// Hashed static URLs (style.<hash>.css) never change content, so they are served cache-first
+let hashedAssets = new Set();
+
+function loadAssetManifest() {
+  return fetch(STATIC_PREFIX + 'asset-manifest.json', { cache: 'no-store' })
+    .then(function(response) {
+      return response.ok ? response.json() : { assets: {} };
+    })
+    .then(function(manifest) {
+      const urls = Object.values(manifest.assets || {}).map(function(path) {
+        return STATIC_PREFIX + path;
+      });
+      hashedAssets = new Set(urls);
+      return urls;
+    })
+    .catch(function() {
+      return [];
+    });
+}
+
+// ---- IndexedDB helpers ----
+
+function openLedgerDb() {
+  return new Promise(function(resolve, reject) {
+    const request = indexedDB.open(LEDGER_DB_NAME, 3);
+    request.onupgradeneeded = function() {
+      const db = request.result;
+      if (!db.objectStoreNames.contains(LEDGER_STORE)) {
+        db.createObjectStore(LEDGER_STORE, { keyPath: 'url' }).createIndex('storedAt', 'storedAt');
+      }
+      if (!db.objectStoreNames.contains(OUTBOX_STORE)) {
+        db.createObjectStore(OUTBOX_STORE, { keyPath: 'id' }).createIndex('queuedAt', 'queuedAt');
+      }
+      if (!db.objectStoreNames.contains(META_STORE)) {
+        db.createObjectStore(META_STORE, { keyPath: 'key' });
+      }
+    };
+    request.onsuccess = function() { resolve(request.result); };
+    request.onerror = function() { reject(request.error); };
+  });
+}
+
+function ledgerTransaction(mode, work, storeName) {
+  storeName = storeName || LEDGER_STORE;
+  return openLedgerDb().then(function(db) {
+    return new Promise(function(resolve, reject) {
+      const tx = db.transaction(storeName, mode);
+      const result = work(tx.objectStore(storeName));
+      tx.oncomplete = function() { db.close(); resolve(result && result.result); };
+      tx.onerror = function() { db.close(); reject(tx.error); };
+    });
+  });
+}
+
+function getLedgerRecord(url) {
+  return Promise.all([
+    ledgerTransaction('readonly', function(store) {
+      return store.get(url);
+    }),
+    getLedgerOwner()
+  ]).then(function(results) {
+    const record = results[0];
+    if (!record || record.schema !== LEDGER_SCHEMA_VERSION || record.owner !== results[1]) {
+      return null;
+    }
+    return record;
+  }).catch(function() {
+    return null;
+  });
+}
+
+function putLedgerRecord(record) {
+  return ledgerTransaction('readwrite', function(store) {
+    store.put(record);
+  }).catch(function(err) {
+    console.log('Ledger cache write failed:', err);
+  });
+}
+
+function clearLedgerRecords() {
+  return ledgerTransaction('readwrite', function(store) {
+    store.clear();
+  }).catch(function() {});
+}
+
+// Same-origin pages kept as offline fallbacks (everything but /static/)
+function clearCachedPages() {
+  return caches.open(CACHE_NAME).then(function(cache) {
+    return cache.keys().then(function(requests) {
+      return Promise.all(requests.filter(function(cached) {
+        const cachedUrl = new URL(cached.url);
+        return cachedUrl.origin === self.location.origin && !cachedUrl.pathname.startsWith(STATIC_PREFIX);
+      }).map(function(cached) {
+        return cache.delete(cached);
+      }));
+    });
+  });
+}
+
+// ---- Ledger owner ----
+// Ledger records, cached pages and queued transactions belong to whoever signed in.
+// The owner is a hash of the phone number used at /login or /register: when a
+// different customer signs in on this device, the previous customer's ledger and
+// pages are dropped and their queued transactions are held until they sign in again.
+
+let ledgerOwner;
+
+function getLedgerOwner() {
+  if (ledgerOwner !== undefined) {
+    return Promise.resolve(ledgerOwner);
+  }
+  return ledgerTransaction('readonly', function(store) {
+    return store.get('owner');
+  }, META_STORE).then(function(entry) {
+    ledgerOwner = entry ? entry.value : null;
+    return ledgerOwner;
+  }).catch(function() {
+    return null;
+  });
+}
+
+function ownerForPhone(phone) {
+  const digits = String(phone || '').replace(/\D/g, '').slice(-10);
+  return self.crypto.subtle.digest('SHA-256', new TextEncoder().encode(digits)).then(function(hash) {
+    return Array.from(new Uint8Array(hash)).map(function(byte) {
+      return byte.toString(16).padStart(2, '0');
+    }).join('');
+  });
+}
+
+function setLedgerOwner(owner) {
+  return getLedgerOwner().then(function(previous) {
+    if (previous === owner) {
+      return;
+    }
+    ledgerOwner = owner;
+    return Promise.all([clearLedgerRecords(), clearCachedPages().catch(function() {})]).then(function() {
+      return ledgerTransaction('readwrite', function(store) {
+        store.put({ key: 'owner', value: owner });
+      }, META_STORE);
+    });
+  });
+}
+
+// /login and /register redirect on success and re-render the form on failure
+function handleSignIn(request) {
+  const form = request.clone();
+  return fetch(request).then(function(response) {
+    if (response.type !== 'opaqueredirect' && !response.redirected) {
+      return response;
+    }
+    return form.formData()
+      .then(function(data) {
+        return ownerForPhone(data.get('phone'));
+      })
+      .then(setLedgerOwner)
+      .catch(function() {
+        // Owner unknown: losing the cache is better than showing it to someone else
+        ledgerOwner = null;
+        return Promise.all([clearLedgerRecords(), clearCachedPages().catch(function() {})]);
+      })
+      .then(function() {
+        // A session that expired with transactions queued can send them now
+        replayOutbox().catch(function() {});
+        return response;
+      });
+  });
+}
+
+// Drop records from older schema versions, records past LEDGER_MAX_AGE_MS,
+// and the oldest records beyond LEDGER_MAX_ENTRIES
+function evictLedgerRecords() {
+  const cutoff = Date.now() - LEDGER_MAX_AGE_MS;
+  return ledgerTransaction('readwrite', function(store) {
+    const keep = [];
+    store.index('storedAt').openCursor().onsuccess = function(event) {
+      const cursor = event.target.result;
+      if (!cursor) {
+        // Cursor walks oldest first, so the surplus is at the front
+        keep.slice(0, Math.max(0, keep.length - LEDGER_MAX_ENTRIES)).forEach(function(url) {
+          store.delete(url);
+        });
+        return;
+      }
+      const record = cursor.value;
+      if (record.schema !== LEDGER_SCHEMA_VERSION || record.storedAt < cutoff) {
+        cursor.delete();
+      } else {
+        keep.push(record.url);
+      }
+      cursor.continue();
+    };
+  }).catch(function() {});
+}
+
+// ---- Ledger API: stale-while-revalidate ----
+
+function ledgerResponse(record, state) {
+  return new Response(JSON.stringify(record.body), {
+    status: 200,
+    headers: {
+      'Content-Type': 'application/json',
+      'X-Ledger-Cache': state,
+      'X-Ledger-Stored-At': new Date(record.storedAt).toISOString()
+    }
+  });
+}
+
+function notifyClients(message) {
+  return self.clients.matchAll({ type: 'window' }).then(function(clients) {
+    clients.forEach(function(client) {
+      client.postMessage(message);
+    });
+  });
+}
+
+// Fetch the API URL (conditionally when we hold an ETag) and store a successful payload
+function revalidateLedger(url, record) {
+  const headers = {};
+  if (record && record.etag) {
+    headers['If-None-Match'] = record.etag;
+  }
+  return fetch(url, { credentials: 'same-origin', headers: headers, cache: 'no-store' })
+    .then(function(response) {
+      if (response.status === 304 && record) {
+        record.storedAt = Date.now();
+        return putLedgerRecord(record).then(function() { return { record: record, changed: false }; });
+      }
+      if (!response.ok || response.redirected) {
+        // Logged out or server error: keep what we have, don't cache the error
+        return { response: response, changed: false };
+      }
+      return Promise.all([response.json(), getLedgerOwner()]).then(function(results) {
+        const body = results[0];
+        if (!body || body.success === false) {
+          return { response: new Response(JSON.stringify(body), { status: 200, headers: { 'Content-Type': 'application/json' } }), changed: false };
+        }
+        const fresh = {
+          url: url,
+          body: body,
+          etag: response.headers.get('ETag'),
+          storedAt: Date.now(),
+          schema: LEDGER_SCHEMA_VERSION,
+          owner: results[1]
+        };
+        return putLedgerRecord(fresh).then(function() {
+          return { record: fresh, changed: !record || JSON.stringify(record.body) !== JSON.stringify(body) };
+        });
+      });
+    });
+}
+
+function handleLedgerRequest(event, url) {
+  const key = url.pathname + url.search;
+  return getLedgerRecord(key).then(function(record) {
+    if (record) {
+      // Answer from IndexedDB now; refresh in the background and tell open pages if it changed
+      event.waitUntil(
+        revalidateLedger(key, record)
+          .then(function(result) {
+            if (result.changed) {
+              return notifyClients({ type: 'ledger-updated', url: key, body: result.record.body });
+            }
+          })
+          .catch(function() {})
+      );
+      return ledgerResponse(record, 'stale');
+    }
+
+    return revalidateLedger(key, null)
+      .then(function(result) {
+        return result.response || ledgerResponse(result.record, 'fresh');
+      })
+      .catch(function() {
+        return new Response(JSON.stringify({ success: false, error: 'offline' }), {
+          status: 503,
+          headers: { 'Content-Type': 'application/json' }
+        });
+      });
+  });
+}
+
+// ---- Offline transaction outbox ----
+
+function queueTransaction(url, formData) {
+  const entries = [];
+  formData.forEach(function(value, name) {
+    if (typeof value === 'string') {
+      entries.push({ name: name, value: value });
+    } else if (value.size > 0) {
+      // IndexedDB stores the photo Blob itself, so nothing is lost before replay
+      entries.push({ name: name, blob: value, filename: value.name });
+    }
+  });
+
+  let id = formData.get('idempotency_key');
+  if (!id) {
+    id = self.crypto.randomUUID();
+    entries.push({ name: 'idempotency_key', value: id });
+  }
+
+  return getLedgerOwner().then(function(owner) {
+    return ledgerTransaction('readwrite', function(store) {
+      store.put({ id: id, url: url, entries: entries, queuedAt: Date.now(), owner: owner });
+    }, OUTBOX_STORE);
+  }).then(function() {
+    if (self.registration.sync) {
+      return self.registration.sync.register(OUTBOX_SYNC_TAG).catch(function() {});
+    }
+  }).then(function() {
+    return notifyClients({ type: 'transaction-queued', id: id });
+  });
+}
+
+function queuedTransactionResponse(url) {
+  const match = TRANSACTION_POST_PATTERN.exec(new URL(url).pathname);
+  const backUrl = match ? '/business/' + match[2] : '/dashboard';
+  const html = '<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8">' +
+    '<meta name="viewport" content="width=device-width, initial-scale=1.0">' +
+    '<title>Saved offline - KhataPe</title>' +
+    '<style>body{font-family:Nunito,sans-serif;background:#f5f8fa;color:#333;display:flex;' +
+    'align-items:center;justify-content:center;min-height:100vh;margin:0;padding:20px;text-align:center}' +
+    '.card{background:#fff;border-radius:14px;box-shadow:0 4px 20px rgba(0,0,0,.08);padding:32px;max-width:420px}' +
+    'a{display:inline-block;margin-top:16px;padding:10px 20px;border-radius:10px;background:#5c67de;color:#fff;text-decoration:none}</style>' +
+    '</head><body><div class="card"><h2>Saved offline</h2>' +
+    '<p>You are offline, so this transaction has been saved on your phone. ' +
+    'It will be sent automatically as soon as you are back online.</p>' +
+    '<a href="' + backUrl + '">Back to business</a></div></body></html>';
+  return new Response(html, { status: 202, headers: { 'Content-Type': 'text/html; charset=utf-8' } });
+}
+
+function handleTransactionPost(request) {
+  const queued = request.clone();
+  return fetch(request).catch(function() {
+    return queued.formData()
+      .then(function(formData) {
+        return queueTransaction(queued.url, formData);
+      })
+      .then(function() {
+        return queuedTransactionResponse(queued.url);
+      });
+  });
+}
+
+let outboxReplay = null;
+let outboxRetryAt = 0;
+
+// How the server answered a replayed submit:
+// 'sent'     recorded (or already recorded): it redirected to the business ledger
+// 'login'    the session expired
+// 'retry'    the server is unhealthy or shedding load (5xx, 429): try again later
+// 'rejected' anything else, e.g. the form re-rendered with an error; replaying won't change it
+function outboxReplayOutcome(response) {
+  const path = new URL(response.url).pathname;
+  if (path === '/login') {
+    return 'login';
+  }
+  if (response.status === 429 || response.status >= 500) {
+    return 'retry';
+  }
+  if (response.ok && response.redirected && path.indexOf('/business/') === 0) {
+    return 'sent';
+  }
+  return 'rejected';
+}
+
+// Milliseconds the server asked us to wait (Retry-After: seconds or an HTTP date)
+function retryAfterMs(response, now) {
+  const value = response.headers.get('Retry-After');
+  if (value && /^\d+$/.test(value.trim())) {
+    return parseInt(value, 10) * 1000;
+  }
+  const date = value ? Date.parse(value) : NaN;
+  return isNaN(date) ? OUTBOX_RETRY_DEFAULT_MS : Math.max(0, date - (now || Date.now()));
+}
+
+function markOutboxRecord(record, fields) {
+  return ledgerTransaction('readwrite', function(store) {
+    store.put(Object.assign({}, record, fields));
+  }, OUTBOX_STORE);
+}
+
+// Send queued transactions oldest first. A record is only deleted once the server has recorded it.
+// Rejects on a network failure or an unhealthy server so Background Sync retries later.
+function replayOutbox() {
+  if (outboxReplay) {
+    return outboxReplay;
+  }
+  if (Date.now() < outboxRetryAt) {
+    return Promise.reject(new Error('Outbox replay deferred by Retry-After'));
+  }
+  let deferred = false;
+  outboxReplay = Promise.all([
+    ledgerTransaction('readonly', function(store) {
+      return store.index('queuedAt').getAll();
+    }, OUTBOX_STORE),
+    getLedgerOwner()
+  ]).then(function(results) {
+    // Another customer's submits wait until they sign in on this device again
+    const records = (results[0] || []).filter(function(record) {
+      return !record.owner || record.owner === results[1];
+    });
+    let sent = 0;
+    return records.reduce(function(chain, record) {
+      return chain.then(function(stop) {
+        if (stop || record.rejected) {
+          return stop;
+        }
+        const body = new FormData();
+        record.entries.forEach(function(entry) {
+          if (entry.blob) {
+            body.append(entry.name, entry.blob, entry.filename);
+          } else {
+            body.append(entry.name, entry.value);
+          }
+        });
+        return fetch(record.url, {
+          method: 'POST',
+          body: body,
+          credentials: 'same-origin',
+          headers: { 'Idempotency-Key': record.id }
+        }).then(function(response) {
+          const outcome = outboxReplayOutcome(response);
+          if (outcome === 'login') {
+            // Session expired: keep the queue until the customer logs back in
+            return true;
+          }
+          if (outcome === 'retry') {
+            // Keep this and every later record; the server said when to come back
+            outboxRetryAt = Date.now() + retryAfterMs(response);
+            deferred = true;
+            return true;
+          }
+          if (outcome === 'rejected') {
+            // Kept for the customer to see, but not replayed again
+            return markOutboxRecord(record, { rejected: true, rejectedStatus: response.status }).then(function() {
+              return notifyClients({ type: 'transaction-rejected', id: record.id });
+            }).then(function() { return false; });
+          }
+          sent += 1;
+          return ledgerTransaction('readwrite', function(store) {
+            store.delete(record.id);
+          }, OUTBOX_STORE).then(function() { return false; });
+        });
+      });
+    }, Promise.resolve(false)).then(function() {
+      if (sent) {
+        return notifyClients({ type: 'transactions-synced', count: sent });
+      }
+    }).then(function() {
+      if (deferred) {
+        throw new Error('Outbox replay deferred: server unavailable');
+      }
+    });
+  }).finally(function() {
+    outboxReplay = null;
+  });
+  return outboxReplay;
+}
+
+// Drop the signed-in customer's queued submits; other customers' stay held for them
+function clearOutbox() {
+  return getLedgerOwner().then(function(owner) {
+    return ledgerTransaction('readwrite', function(store) {
+      store.openCursor().onsuccess = function(event) {
+        const cursor = event.target.result;
+        if (!cursor) {
+          return;
+        }
+        if (!cursor.value.owner || cursor.value.owner === owner) {
+          cursor.delete();
+        }
+        cursor.continue();
+      };
+    }, OUTBOX_STORE);
+  }).catch(function() {});
+}
+
+// ---- Pages and static files ----
+
+function handlePageRequest(request) {
+  // Network first so balances are current; the last copy of each page is the offline fallback
+  return fetch(request)
+    .then(function(response) {
+      if (response.ok && !response.redirected) {
+        const copy = response.clone();
+        caches.open(CACHE_NAME).then(function(cache) {
+          cache.put(request, copy);
+        });
+      }
+      return response;
+    })
+    .catch(function() {
+      return caches.match(request).then(function(cached) {
+        return cached || Response.error();
+      });
+    });
+}
+
+function handleStaticRequest(request, isHashedAsset) {
+  return caches.match(request)
+    .then(function(response) {
+      // Cache hit - return response
+      if (response) {
+        return response;
+      }
+      return fetch(request).then(function(networkResponse) {
+        if (isHashedAsset && networkResponse.ok) {
+          const copy = networkResponse.clone();
+          caches.open(CACHE_NAME).then(function(cache) {
+            cache.put(request, copy);
+          });
+        }
+        return networkResponse;
+      });
+    });
+}
+
 self.addEventListener('install', function(event) {
   // Perform install steps
   event.waitUntil(
-    caches.open(CACHE_NAME)
-      .then(function(cache) {
-        console.log('Opened cache');
-        return cache.addAll(urlsToCache);
+    Promise.all([caches.open(CACHE_NAME), loadAssetManifest()])
+      .then(function(results) {
+        const cache = results[0];
+        const assetUrls = results[1].filter(function(url) {
+          return /\.(css|js|svg|png|ico)$/.test(url);
+        });
+        console.log('Opened cache', CACHE_NAME);
+        return cache.addAll(urlsToCache.concat(assetUrls));
       })
   );
 });
 
 self.addEventListener('fetch', function(event) {
-  event.respondWith(
-    caches.match(event.request)
-      .then(function(response) {
-        // Cache hit - return response
-        if (response) {
-          return response;
-        }
-        return fetch(event.request);
-      }
-    )
-  );
+  const request = event.request;
+  const url = new URL(request.url);
+  const sameOrigin = url.origin === self.location.origin;
+
+  if (request.method === 'POST' && sameOrigin && TRANSACTION_POST_PATTERN.test(url.pathname)) {
+    event.respondWith(handleTransactionPost(request));
+    return;
+  }
+  if (request.method === 'POST' && sameOrigin && (url.pathname === '/login' || url.pathname === '/register')) {
+    event.respondWith(handleSignIn(request));
+    return;
+  }
+  if (request.method !== 'GET') {
+    return;
+  }
+
+  if (sameOrigin && url.pathname === '/logout') {
+    // Flush queued transactions while the session is still valid, then log out.
+    // Ledger data and the outbox are per customer: never leave them for the next person on this device.
+    event.respondWith(
+      replayOutbox().catch(function() {}).then(function() {
+        return fetch(request);
+      }).then(function(response) {
+        return clearOutbox().then(function() { return response; });
+      })
+    );
+    event.waitUntil(Promise.all([clearLedgerRecords(), clearCachedPages()]));
+    return;
+  }
+
+  if (sameOrigin && LEDGER_API_PATTERN.test(url.pathname)) {
+    event.respondWith(handleLedgerRequest(event, url));
+    return;
+  }
+
+  if (request.mode === 'navigate') {
+    event.respondWith(handlePageRequest(request));
+    return;
+  }
+
+  event.respondWith(handleStaticRequest(request, sameOrigin && hashedAssets.has(url.pathname)));
+});
+
+self.addEventListener('sync', function(event) {
+  if (event.tag === OUTBOX_SYNC_TAG) {
+    event.waitUntil(replayOutbox());
+  }
+});
+
+// Browsers without Background Sync: pages ask for a replay when they come back online
+self.addEventListener('message', function(event) {
+  if (event.data && event.data.type === 'replay-outbox') {
+    event.waitUntil(replayOutbox().catch(function() {}));
+  }
 });
 
 self.addEventListener('activate', function(event) {
   event.waitUntil(
-    caches.keys().then(function(cacheNames) {
-      return Promise.all(
-        cacheNames.map(function(cacheName) {
-          if (cacheName !== CACHE_NAME) {
-            return caches.delete(cacheName);
-          }
-        })
-      );
+    Promise.all([
+      loadAssetManifest(),
+      evictLedgerRecords(),
+      caches.keys().then(function(cacheNames) {
+        return Promise.all(
+          cacheNames.map(function(cacheName) {
+            if (cacheName !== CACHE_NAME) {
+              return caches.delete(cacheName);
+            }
+          })
+        );
+      })
+    ]).then(function() {
+      return self.clients.claim();
     })
   );
 });
@@ -0,0 +1,133 @@
+"""
+Content-hashed static assets for KathaPe Customer App
+Every file under static/ gets a fingerprinted URL (css/style.css ->
+css/style.<hash>.css). url_for('static', ...) emits the hashed URL, and the
+app serves hashed paths with a far-future immutable Cache-Control, so a
+deploy only invalidates the files whose contents actually changed.
+
+The manifest is written at build time (python static_assets.py) and
+computed at startup when the build step has not run.
+"""
+import os
+import sys
+import json
+import hashlib
+
+ASSET_MANIFEST_NAME = 'asset-manifest.json'
+ASSET_HASH_LENGTH = 10
+# Set ASSET_HASHING=0 while editing static files locally to get plain URLs
+ASSET_HASHING = os.getenv('ASSET_HASHING', '1') != '0'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Files whose URL must never change: the service worker script, the PWA manifest and the manifest itself
+UNHASHED_ASSETS = {'sw.js', 'manifest.json', 'favicon.ico', ASSET_MANIFEST_NAME}
+# Directories holding user content rather than build assets
+UNHASHED_DIRECTORIES = ('uploads/',)
+# Build artefacts of compression.py, served in place of their source file
+SKIPPED_SUFFIXES = ('.gz', '.br')
+
+
+def hashed_filename(filename, digest):
+    """css/style.css + abc123 -> css/style.abc123.css"""
+    directory, name = os.path.split(filename)
+    stem, ext = os.path.splitext(name)
+    return os.path.join(directory, f"{stem}.{digest}{ext}").replace(os.sep, '/')
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:ASSET_HASH_LENGTH]
+
+
+def build_asset_manifest(static_folder):
+    """Fingerprint every static file; returns {'version': ..., 'assets': {original: hashed}}"""
+    assets = {}
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            if (filename in UNHASHED_ASSETS or filename.endswith(SKIPPED_SUFFIXES)
+                    or filename.startswith(UNHASHED_DIRECTORIES)):
+                continue
+            assets[filename] = hashed_filename(filename, _file_digest(path))
+
+    version = hashlib.sha256(json.dumps(assets, sort_keys=True).encode('utf-8')).hexdigest()[:ASSET_HASH_LENGTH]
+    return {'version': version, 'assets': dict(sorted(assets.items()))}
+
+
+def write_asset_manifest(static_folder):
+    """Build step: write static/asset-manifest.json"""
+    manifest = build_asset_manifest(static_folder)
+    with open(os.path.join(static_folder, ASSET_MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_asset_manifest(static_folder):
+    """Read the build-time manifest, falling back to hashing the folder now"""
+    path = os.path.join(static_folder, ASSET_MANIFEST_NAME)
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get('assets'), dict):
+            return manifest
+    except (OSError, ValueError) as e:
+        if os.path.exists(path):
+            print(f"Error reading asset manifest, rebuilding: {e}")
+    return build_asset_manifest(static_folder)
+
+
+def install_asset_pipeline(app, enabled=ASSET_HASHING):
+    """
+    Make url_for('static', filename=...) emit hashed URLs and serve those URLs
+    with immutable caching. Install after install_precompressed_static so hashed
+    requests still get the .br/.gz siblings of their source file.
+    """
+    manifest = load_asset_manifest(app.static_folder) if enabled else {'version': '', 'assets': {}}
+    assets = manifest['assets']
+    originals = {hashed: original for original, hashed in assets.items()}
+    app.extensions['asset_manifest'] = manifest
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == 'static':
+            filename = values.get('filename')
+            if filename in assets:
+                values['filename'] = assets[filename]
+
+    @app.context_processor
+    def inject_asset_version():
+        return {'asset_version': manifest['version']}
+
+    original_static = app.view_functions['static']
+
+    def static(filename):
+        if filename == ASSET_MANIFEST_NAME:
+            # Always answer from memory so the service worker sees exactly what this process serves
+            response = app.response_class(json.dumps(manifest), mimetype='application/json')
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+
+        original = originals.get(filename)
+        if original is None:
+            return original_static(filename=filename)
+
+        response = original_static(filename=original)
+        if response.status_code in (200, 304):
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    app.view_functions['static'] = static
+    if enabled:
+        print(f"✓ Static asset manifest loaded ({len(assets)} files, version {manifest['version']})")
+    return manifest
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    print(f"Fingerprinting static files in {folder}...")
+    result = write_asset_manifest(folder)
+    print(f"✓ Wrote {ASSET_MANIFEST_NAME} ({len(result['assets'])} files, version {result['version']})")
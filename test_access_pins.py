@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Test failed access-PIN throttling (access_pins) offline: failures are counted
+on the server per customer and address, so logging in again with a fresh
+session cookie doesn't reset them.
+"""
+import os
+for name in ('APPWRITE_ENDPOINT', 'APPWRITE_PROJECT_ID', 'APPWRITE_API_KEY', 'APPWRITE_DATABASE_ID'):
+    os.environ.setdefault(name, 'http://localhost:9/v1' if name == 'APPWRITE_ENDPOINT' else 'test')
+os.environ.setdefault('BUSINESS_PIN_INDEX', '0')
+os.environ.setdefault('ADMISSION_MAX_CONCURRENCY', '1000')
+
+import access_pins
+from access_pins import BUSINESS_PIN_MAX_FAILURES
+from appwrite_utils import appwrite_db_instance
+
+CUSTOMER_ID = '11111111-1111-1111-1111-111111111111'
+OTHER_CUSTOMER_ID = '33333333-3333-3333-3333-333333333333'
+
+
+class NoBusinessesDatabase:
+    """Appwrite without a single business: every PIN is wrong"""
+
+    def list_documents(self, database_id, collection_id, queries=None):
+        return {'total': 0, 'documents': []}
+
+
+def _fresh_client(customer_app, customer_id, remote_addr='203.0.113.7'):
+    client = customer_app.test_client()
+    client.environ_base['REMOTE_ADDR'] = remote_addr
+    with client.session_transaction() as session:
+        session['user_id'] = 'u1'
+        session['user_type'] = 'customer'
+        session['customer_id'] = customer_id
+    return client
+
+
+def _try_pin(client, pin):
+    return client.post('/select_business', data={'access_pin': pin}).status_code
+
+
+def test_dropping_the_cookie_does_not_reset_failures():
+    from app import customer_app
+
+    original_db = appwrite_db_instance.db
+    appwrite_db_instance.db = NoBusinessesDatabase()
+    access_pins._pin_failures.clear()
+    try:
+        for attempt in range(BUSINESS_PIN_MAX_FAILURES):
+            # A new cookie for every guess, as a script discarding Set-Cookie would send
+            assert _try_pin(_fresh_client(customer_app, CUSTOMER_ID), f"9{attempt:03d}") == 200
+        assert _try_pin(_fresh_client(customer_app, CUSTOMER_ID), '9999') == 429
+
+        # Other customers, and this customer on another connection, are unaffected
+        assert _try_pin(_fresh_client(customer_app, OTHER_CUSTOMER_ID), '9999') == 200
+        assert _try_pin(_fresh_client(customer_app, CUSTOMER_ID, '198.51.100.2'), '9999') == 200
+    finally:
+        access_pins._pin_failures.clear()
+        appwrite_db_instance.db = original_db
+
+
+def test_failures_expire_after_the_window():
+    access_pins._pin_failures.clear()
+    original_window = access_pins.BUSINESS_PIN_FAILURE_WINDOW
+    try:
+        for _ in range(BUSINESS_PIN_MAX_FAILURES):
+            access_pins.record_pin_failure(CUSTOMER_ID, '203.0.113.7')
+        assert access_pins.pin_attempts_exceeded(CUSTOMER_ID, '203.0.113.7')
+        access_pins.BUSINESS_PIN_FAILURE_WINDOW = -1
+        assert not access_pins.pin_attempts_exceeded(CUSTOMER_ID, '203.0.113.7')
+    finally:
+        access_pins.BUSINESS_PIN_FAILURE_WINDOW = original_window
+        access_pins._pin_failures.clear()
+
+
+if __name__ == "__main__":
+    for test in (test_dropping_the_cookie_does_not_reset_failures, test_failures_expire_after_the_window):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test admission control slot accounting (admission_control) offline: slots
+are taken and given back once per request, low priority work is shed,
+critical requests get the reserved slot, and no request waits forever.
+"""
+import threading
+import time
+
+from admission_control import AdmissionController, AdmissionControlMiddleware
+
+
+def _controller(**options):
+    settings = dict(max_concurrency=2, reserved_slots=1, max_queue_seconds=0.1,
+                    critical_max_queue_seconds=0.3, latency_target=3)
+    settings.update(options)
+    return AdmissionController(**settings)
+
+
+def test_slots_are_counted_and_released():
+    controller = _controller()
+    assert controller.acquire('read', 'normal')
+    assert controller.stats()['in_flight_by_class'] == {'read': 1}
+    # The last slot is reserved: only critical requests may take it
+    assert not controller.acquire('read', 'low')
+    assert not controller.acquire('read', 'normal')
+    assert controller.acquire('write', 'critical')
+    assert controller.stats()['in_flight'] == 2
+    controller.release('read', 0.01)
+    controller.release('write', 0.01)
+    stats = controller.stats()
+    assert stats['in_flight'] == 0 and stats['waiting'] == 0 and stats['shed'] == 2, stats
+
+
+def test_waiting_request_gets_a_freed_slot():
+    controller = _controller(max_queue_seconds=2)
+    assert controller.acquire('read', 'normal')
+    threading.Timer(0.05, controller.release, args=('read', 0.05)).start()
+    started = time.monotonic()
+    assert controller.acquire('read', 'normal')
+    assert time.monotonic() - started < 1
+
+
+def test_slow_route_class_is_shed():
+    controller = _controller(max_concurrency=4, latency_target=0.5)
+    assert controller.acquire('read', 'low')
+    controller.release('read', 2.0)
+    assert not controller.acquire('read', 'low'), "low priority work should be shed while its class is slow"
+    assert controller.acquire('write', 'low')
+
+
+def test_critical_wait_is_bounded():
+    controller = _controller()
+    assert controller.acquire('write', 'critical') and controller.acquire('write', 'critical')
+    started = time.monotonic()
+    assert not controller.acquire('auth', 'critical'), "a critical request waited for a slot that never freed"
+    waited = time.monotonic() - started
+    assert 0.25 <= waited < 2, waited
+    # Time already spent queued upstream counts against the deadline
+    started = time.monotonic()
+    assert not controller.acquire('auth', 'critical', queued=10)
+    assert time.monotonic() - started < 0.1
+    assert controller.stats()['waiting'] == 0
+
+
+def test_middleware_answers_503_and_releases_after_body():
+    controller = _controller(max_concurrency=1, reserved_slots=0)
+    statuses = []
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    def reject(environ, retry_after):
+        def answer(environ, start_response):
+            start_response('503 Service Unavailable', [('Retry-After', str(retry_after))])
+            return [b'busy']
+        return answer
+
+    middleware = AdmissionControlMiddleware(app, reject, controller)
+
+    def start_response(status, headers):
+        statuses.append((status, dict(headers)))
+
+    environ = {'PATH_INFO': '/transaction/payment/b1', 'REQUEST_METHOD': 'POST'}
+    body = middleware(dict(environ), start_response)
+    assert controller.stats()['in_flight'] == 1
+    # The slot stays taken until the body is closed, so a second POST is shed with Retry-After
+    middleware(dict(environ), start_response)
+    assert statuses[-1][0].startswith('503') and int(statuses[-1][1]['Retry-After']) >= 1, statuses
+    body.close()
+    assert controller.stats()['in_flight'] == 0
+    middleware(dict(environ), start_response).close()
+    assert statuses[-1][0] == '200 OK'
+
+
+if __name__ == "__main__":
+    for test in (test_slots_are_counted_and_released, test_waiting_request_gets_a_freed_slot,
+                 test_slow_route_class_is_shed, test_critical_wait_is_bounded,
+                 test_middleware_answers_503_and_releases_after_body):
+        test()
+        print(f"✅ {test.__name__}")
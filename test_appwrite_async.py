@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Test appwrite_async.read_many offline: reads from any number of request
+threads run on one background event loop through one long-lived HTTP
+client, instead of a new client and event loop per call.
+"""
+import os
+for name in ('APPWRITE_ENDPOINT', 'APPWRITE_PROJECT_ID', 'APPWRITE_API_KEY', 'APPWRITE_DATABASE_ID'):
+    os.environ.setdefault(name, 'http://localhost:9/v1' if name == 'APPWRITE_ENDPOINT' else 'test')
+
+import threading
+
+import httpx
+
+import appwrite_async
+from appwrite_async import AsyncAppwriteDB, read_many
+
+
+class CountingTransport(httpx.AsyncBaseTransport):
+    """Answers every document GET, remembering which thread served it"""
+
+    def __init__(self):
+        self.threads = set()
+        self.requests = 0
+
+    async def handle_async_request(self, request):
+        self.threads.add(threading.current_thread().name)
+        self.requests += 1
+        document_id = request.url.path.rsplit('/', 1)[-1]
+        return httpx.Response(200, json={'$id': document_id})
+
+
+def test_read_many_reuses_one_client_and_loop():
+    if not appwrite_async.ASYNC_APPWRITE_ENABLED:
+        print("⚠️ httpx not installed, skipping async Appwrite test")
+        return
+    transport = CountingTransport()
+    loop = appwrite_async._background_loop()
+    database = AsyncAppwriteDB()
+    database._client = httpx.AsyncClient(base_url='http://appwrite.test/databases/test', transport=transport)
+    appwrite_async._async_db = database
+
+    results = {}
+
+    def request(index):
+        results[index] = read_many([('get', 'businesses', f"b{index}"), ('get', 'customers', f"c{index}")])
+
+    threads = [threading.Thread(target=request, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert results == {index: [{'$id': f"b{index}"}, {'$id': f"c{index}"}] for index in range(8)}, results
+    assert transport.requests == 16
+    assert transport.threads == {'appwrite-async'}, transport.threads
+    # Still the same loop and client, and the client was not closed after use
+    assert appwrite_async._background_loop() is loop
+    assert appwrite_async._async_db is database and not database._client.is_closed
+
+
+if __name__ == "__main__":
+    test_read_many_reuses_one_client_and_loop()
+    print("✅ test_read_many_reuses_one_client_and_loop")
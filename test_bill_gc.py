@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test that the bill image GC never deletes against a partial reference scan,
+and that statement exports fail instead of truncating. Runs offline against
+an in-memory stand-in for the Appwrite Databases service.
+"""
+import os
+for name in ('APPWRITE_ENDPOINT', 'APPWRITE_PROJECT_ID', 'APPWRITE_API_KEY', 'APPWRITE_DATABASE_ID'):
+    os.environ.setdefault(name, 'http://localhost:9/v1' if name == 'APPWRITE_ENDPOINT' else 'test')
+os.environ.setdefault('BILL_GC_CALL_INTERVAL', '0')
+
+import json
+
+import cloudinary.api
+from appwrite.exception import AppwriteException
+
+import bill_gc
+import statement_export
+from appwrite_utils import appwrite_db_instance
+
+CUSTOMER_ID = '11111111-1111-1111-1111-111111111111'
+
+
+class PagedTransactions:
+    """Two pages of transactions; the second page is refused like a stale cursor"""
+
+    def __init__(self, fail_second_page=True):
+        self.fail_second_page = fail_second_page
+        self.documents = [{
+            '$id': f"t{index:03d}", '$createdAt': f"2026-01-01T00:00:{index % 60:02d}+00:00",
+            'customer_id': CUSTOMER_ID, 'transaction_type': 'credit', 'amount': 1,
+            'receipt_image_url': f"bill_receipts/bill_{index}",
+        } for index in range(150)]
+
+    def list_documents(self, database_id, collection_id, queries=None):
+        parsed = [json.loads(query) for query in queries or []]
+        if any(query['method'] == 'cursorAfter' for query in parsed):
+            if self.fail_second_page:
+                raise AppwriteException('Document with the requested ID could not be found.', 400)
+            return {'total': 150, 'documents': self.documents[100:]}
+        return {'total': 150, 'documents': self.documents[:100]}
+
+    def get_document(self, database_id, collection_id, document_id, queries=None):
+        raise AppwriteException('Document with the requested ID could not be found.', 404)
+
+
+def _with_fakes(database, test):
+    original_db = appwrite_db_instance.db
+    original_resources, original_delete = cloudinary.api.resources, cloudinary.api.delete_resources
+    deleted = []
+    appwrite_db_instance.db = database
+    # Every image in the folder is old enough to collect
+    cloudinary.api.resources = lambda **options: {'resources': [
+        {'public_id': f"bill_receipts/bill_{index}", 'created_at': '2020-01-01T00:00:00Z'} for index in range(200)
+    ]}
+    cloudinary.api.delete_resources = lambda public_ids, **options: (
+        deleted.extend(public_ids) or {'deleted': {public_id: 'deleted' for public_id in public_ids}}
+    )
+    try:
+        return test(deleted)
+    finally:
+        appwrite_db_instance.db = original_db
+        cloudinary.api.resources, cloudinary.api.delete_resources = original_resources, original_delete
+
+
+def test_gc_aborts_on_partial_reference_scan():
+    def run(deleted):
+        summary = bill_gc.collect_orphaned_bill_images(dry_run=False)
+        assert deleted == [], f"deleted {len(deleted)} images after a failed scan"
+        assert summary['complete'] is False
+        assert summary['deleted'] == 0
+    _with_fakes(PagedTransactions(fail_second_page=True), run)
+
+
+def test_gc_deletes_only_unreferenced_after_full_scan():
+    def run(deleted):
+        summary = bill_gc.collect_orphaned_bill_images(dry_run=False)
+        assert sorted(deleted) == sorted(f"bill_receipts/bill_{index}" for index in range(150, 200))
+        assert summary['complete'] is True
+    _with_fakes(PagedTransactions(fail_second_page=False), run)
+
+
+def test_statement_export_raises_instead_of_truncating():
+    def run(deleted):
+        rows = statement_export.statement_rows(CUSTOMER_ID)
+        try:
+            count = sum(1 for _ in rows)
+        except AppwriteException:
+            return
+        raise AssertionError(f"statement ended after {count} rows without an error")
+    _with_fakes(PagedTransactions(fail_second_page=True), run)
+
+
+if __name__ == "__main__":
+    for test in (test_gc_aborts_on_partial_reference_scan,
+                 test_gc_deletes_only_unreferenced_after_full_scan,
+                 test_statement_export_raises_instead_of_truncating):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Test the Appwrite circuit breaker (appwrite_resilience) offline: it opens
+after repeated failures, a half-open trial that fails in any way never
+leaves it stuck, and API routes answer an outage with 503 + Retry-After.
+"""
+import os
+for name in ('APPWRITE_ENDPOINT', 'APPWRITE_PROJECT_ID', 'APPWRITE_API_KEY', 'APPWRITE_DATABASE_ID'):
+    os.environ.setdefault(name, 'http://localhost:9/v1' if name == 'APPWRITE_ENDPOINT' else 'test')
+os.environ.setdefault('BUSINESS_PIN_INDEX', '0')
+os.environ.setdefault('ADMISSION_MAX_CONCURRENCY', '1000')
+
+import time
+
+from appwrite.exception import AppwriteException
+
+from appwrite_resilience import CircuitBreaker, CircuitOpenError, AppwriteUnavailable, call
+
+
+class TrialAborted(BaseException):
+    """Stands in for anything that unwinds a call without an Exception (e.g. a worker timeout)"""
+
+
+def _breaker():
+    return CircuitBreaker(window=4, min_calls=2, failure_ratio=0.5, open_seconds=0.05)
+
+
+def _fail(error):
+    def function(*args, **kwargs):
+        raise error
+    return function
+
+
+def _open(breaker):
+    for _ in range(2):
+        try:
+            call(_fail(AppwriteException('Server Error', 503)), breaker=breaker, attempts=1)
+        except AppwriteUnavailable:
+            pass
+    assert breaker.state == 'open'
+
+
+def test_breaker_opens_and_fails_fast():
+    breaker = _breaker()
+    _open(breaker)
+    calls = []
+    try:
+        call(lambda: calls.append(1), breaker=breaker)
+    except CircuitOpenError as e:
+        assert e.retry_after >= 1
+    assert calls == [], "an open breaker must not call Appwrite"
+
+
+def test_failed_trials_never_leave_breaker_stuck():
+    breaker = _breaker()
+    _open(breaker)
+    for error in (KeyError('content-type'), RuntimeError('unexpected'), TrialAborted()):
+        time.sleep(0.06)
+        assert breaker.state == 'half-open'
+        try:
+            call(_fail(error), breaker=breaker, attempts=1)
+        except (AppwriteUnavailable, RuntimeError, TrialAborted):
+            pass
+        if isinstance(error, TrialAborted):
+            # No outcome was recorded, but the next caller may still probe
+            assert breaker.state == 'half-open'
+        else:
+            assert breaker.state == 'open', f"{error!r} was not counted as a failure"
+    time.sleep(0.06)
+    assert call(lambda: 'ok', breaker=breaker) == 'ok'
+    assert breaker.state == 'closed'
+
+
+def test_response_errors_become_unavailable():
+    breaker = _breaker()
+    try:
+        call(_fail(KeyError('content-type')), breaker=breaker, attempts=1)
+    except AppwriteUnavailable:
+        pass
+    else:
+        raise AssertionError('a response the SDK could not parse should read as an outage')
+    # A refused request is still the SDK's own error and counts as Appwrite answering
+    try:
+        call(_fail(AppwriteException('Document not found', 404)), breaker=breaker, attempts=1)
+    except AppwriteException as e:
+        assert not isinstance(e, AppwriteUnavailable) and e.code == 404
+
+
+def test_api_routes_answer_outage_with_503():
+    from app import customer_app
+    from appwrite_utils import appwrite_db_instance
+    from appwrite_resilience import appwrite_breaker
+
+    class DownDatabase:
+        def __getattr__(self, name):
+            return _fail(AppwriteException('Bad Gateway', 502))
+
+    original_db = appwrite_db_instance.db
+    appwrite_db_instance.db = DownDatabase()
+    try:
+        with customer_app.test_client() as client:
+            with client.session_transaction() as session:
+                session['user_id'] = 'u1'
+                session['user_type'] = 'customer'
+                session['customer_id'] = '11111111-1111-1111-1111-111111111111'
+            for path in ('/api/businesses', '/api/transactions/22222222-2222-2222-2222-222222222222'):
+                appwrite_breaker.reset()
+                response = client.get(path)
+                assert response.status_code == 503, (path, response.status_code)
+                assert response.headers.get('Retry-After'), path
+    finally:
+        appwrite_db_instance.db = original_db
+        appwrite_breaker.reset()
+
+
+def test_outage_is_not_reported_as_bad_input():
+    from app import customer_app
+    from appwrite_utils import appwrite_db_instance
+    from appwrite_resilience import appwrite_breaker
+
+    class DownDatabase:
+        def __getattr__(self, name):
+            return _fail(AppwriteException('Bad Gateway', 502))
+
+    original_db = appwrite_db_instance.db
+    appwrite_db_instance.db = DownDatabase()
+    try:
+        with customer_app.test_client() as client:
+            # Not "invalid phone or password" / "already registered" / an empty list
+            appwrite_breaker.reset()
+            response = client.post('/login', data={'phone': '9876543210', 'password': 'secret'})
+            assert response.status_code == 503 and response.headers.get('Retry-After'), response.status_code
+            appwrite_breaker.reset()
+            response = client.post('/register', data={'phone': '9876543210', 'password': 'secret', 'name': 'A'})
+            assert response.status_code == 503, response.status_code
+            with client.session_transaction() as session:
+                session['user_id'] = 'u1'
+                session['user_type'] = 'customer'
+                session['customer_id'] = '11111111-1111-1111-1111-111111111111'
+            appwrite_breaker.reset()
+            response = client.get('/pending_payments')
+            assert response.status_code == 503, response.status_code
+            appwrite_breaker.reset()
+            response = client.post('/transaction/payment/22222222-2222-2222-2222-222222222222',
+                                   data={'amount': '10'})
+            assert response.status_code == 503, response.status_code
+    finally:
+        appwrite_db_instance.db = original_db
+        appwrite_breaker.reset()
+
+
+if __name__ == "__main__":
+    for test in (test_breaker_opens_and_fails_fast, test_failed_trials_never_leave_breaker_stuck,
+                 test_response_errors_become_unavailable, test_api_routes_answer_outage_with_503,
+                 test_outage_is_not_reported_as_bad_input):
+        test()
+        print(f"✅ {test.__name__}")
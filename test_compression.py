@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test response compression (compression.CompressionMiddleware) offline: sized
+and streamed bodies are encoded with their own ETag, and revalidating with
+that ETag gets a 304 carrying the same validator.
+"""
+import gzip
+
+from flask import Flask, Response, request
+from werkzeug.test import Client
+
+from compression import CompressionMiddleware
+
+PAGE = 'ledger row\n' * 200
+
+
+def _client():
+    app = Flask(__name__)
+
+    @app.route('/page')
+    def page():
+        if request.if_none_match.contains('v1'):
+            response = Response(status=304)
+        else:
+            response = Response(PAGE, mimetype='text/html')
+        response.set_etag('v1')
+        return response
+
+    @app.route('/stream')
+    def stream():
+        return Response((line for line in PAGE.splitlines(keepends=True)), mimetype='text/html')
+
+    @app.route('/tiny')
+    def tiny():
+        response = Response('ok', mimetype='text/html')
+        response.set_etag('v1')
+        return response
+
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+    return Client(app)
+
+
+def test_sized_body_gets_encoded_etag():
+    response = _client().get('/page', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] == '"v1-gzip"'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    body = response.get_data()
+    assert int(response.headers['Content-Length']) == len(body)
+    assert gzip.decompress(body).decode() == PAGE
+
+
+def test_streamed_body_is_compressed_in_chunks():
+    response = _client().get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    assert gzip.decompress(response.get_data()).decode() == PAGE
+
+
+def test_not_modified_keeps_encoded_etag():
+    client = _client()
+    response = client.get('/page', headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"v1-gzip"'})
+    assert response.status_code == 304
+    # The client's cached validator is "v1-gzip"; a bare "v1" would make it drop the cached body
+    assert response.headers['ETag'] == '"v1-gzip"'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_cached_encoding_must_match_the_request():
+    client = _client()
+    # Cached uncompressed (too small to encode), revalidated with gzip on offer
+    assert client.get('/tiny', headers={'Accept-Encoding': 'gzip'}).headers['ETag'] == '"v1"'
+    response = client.get('/page', headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"v1"'})
+    assert response.status_code == 304 and response.headers['ETag'] == '"v1"'
+    # A gzip validator from a client that no longer accepts gzip gets the full body
+    response = client.get('/page', headers={'Accept-Encoding': 'identity', 'If-None-Match': '"v1-gzip"'})
+    assert response.status_code == 200 and response.headers['ETag'] == '"v1"'
+    assert response.get_data(as_text=True) == PAGE
+
+
+if __name__ == "__main__":
+    for test in (test_sized_body_gets_encoded_etag, test_streamed_body_is_compressed_in_chunks,
+                 test_not_modified_keeps_encoded_etag, test_cached_encoding_must_match_the_request):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Test the request-scoped identity map (identity_map) offline through
+AppwriteDB: reads repeat from memory within a request, writes keep
+equality-filtered lists up to date and drop the rest, a failed write forgets
+what it touched, and nothing is cached outside a request.
+"""
+import os
+for name in ('APPWRITE_ENDPOINT', 'APPWRITE_PROJECT_ID', 'APPWRITE_API_KEY', 'APPWRITE_DATABASE_ID'):
+    os.environ.setdefault(name, 'http://localhost:9/v1' if name == 'APPWRITE_ENDPOINT' else 'test')
+
+import json
+
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+from flask import Flask
+
+from appwrite_utils import appwrite_db_instance, CUSTOMER_CREDITS_COLLECTION, TRANSACTIONS_COLLECTION
+from identity_map import current_identity_map
+
+app = Flask(__name__)
+
+
+class CountingDatabase:
+    """Documents per collection; counts every call that reaches 'Appwrite'"""
+
+    def __init__(self):
+        self.documents = {CUSTOMER_CREDITS_COLLECTION: {}, TRANSACTIONS_COLLECTION: {}}
+        self.calls = []
+        self.fail_writes = False
+
+    def put(self, collection_id, document_id, **data):
+        self.documents[collection_id][document_id] = dict(data, **{'$id': document_id})
+
+    def list_documents(self, database_id, collection_id, queries=None):
+        self.calls.append(('list', collection_id))
+        documents = list(self.documents[collection_id].values())
+        for query in map(json.loads, queries or []):
+            if query['method'] == 'equal':
+                documents = [doc for doc in documents if doc.get(query['attribute']) in query['values']]
+            elif query['method'] == 'limit':
+                documents = documents[:query['values'][0]]
+        return {'total': len(documents), 'documents': [dict(doc) for doc in documents]}
+
+    def get_document(self, database_id, collection_id, document_id, queries=None):
+        self.calls.append(('get', collection_id))
+        return dict(self.documents[collection_id][document_id])
+
+    def _write(self, collection_id):
+        self.calls.append(('write', collection_id))
+        if self.fail_writes:
+            raise AppwriteException('Document was changed by another request', 409)
+
+    def create_document(self, database_id, collection_id, document_id, data):
+        self._write(collection_id)
+        self.put(collection_id, document_id, **data)
+        return dict(self.documents[collection_id][document_id])
+
+    def update_document(self, database_id, collection_id, document_id, data):
+        self._write(collection_id)
+        self.documents[collection_id][document_id].update(data)
+        return dict(self.documents[collection_id][document_id])
+
+    def delete_document(self, database_id, collection_id, document_id):
+        self._write(collection_id)
+        del self.documents[collection_id][document_id]
+        return {}
+
+
+def _with_database(test):
+    database = CountingDatabase()
+    database.put(CUSTOMER_CREDITS_COLLECTION, 'cc1', customer_id='c1', business_id='b1', current_balance=100)
+    database.put(CUSTOMER_CREDITS_COLLECTION, 'cc2', customer_id='c1', business_id='b2', current_balance=50)
+    database.put(CUSTOMER_CREDITS_COLLECTION, 'cc3', customer_id='c2', business_id='b1', current_balance=10)
+    database.put(TRANSACTIONS_COLLECTION, 't1', customer_id='c1', business_id='b1', amount=100)
+    original_db = appwrite_db_instance.db
+    appwrite_db_instance.db = database
+    try:
+        return test(database)
+    finally:
+        appwrite_db_instance.db = original_db
+
+
+def _credits(customer_id, projection=None):
+    return appwrite_db_instance.list_documents(
+        CUSTOMER_CREDITS_COLLECTION, [Query.equal('customer_id', customer_id)], projection=projection)
+
+
+def _ids(documents):
+    return sorted(document['$id'] for document in documents)
+
+
+def test_no_map_outside_a_request():
+    def run(database):
+        assert current_identity_map() is None
+        _credits('c1')
+        _credits('c1')
+        assert len(database.calls) == 2, database.calls
+    _with_database(run)
+
+
+def test_one_map_per_request():
+    def run(database):
+        with app.app_context():
+            assert current_identity_map() is current_identity_map()
+            first = _credits('c1')
+            first[0]['current_balance'] = -1
+            # Answered from memory, and a caller's edits never leak into the map
+            assert _credits('c1') == sorted(database.documents[CUSTOMER_CREDITS_COLLECTION].values(),
+                                            key=lambda doc: doc['$id'])[:2]
+            assert len(database.calls) == 1
+            request_map = current_identity_map()
+        with app.app_context():
+            assert current_identity_map() is not request_map
+            _credits('c1')
+            assert len(database.calls) == 2
+    _with_database(run)
+
+
+def test_write_through_for_equality_filtered_lists():
+    def run(database):
+        with app.app_context():
+            assert _ids(_credits('c1')) == ['cc1', 'cc2']
+            assert _ids(_credits('c1', projection='balance')) == ['cc1', 'cc2']
+            assert _ids(_credits('c2')) == ['cc3']
+            reads = len(database.calls)
+
+            appwrite_db_instance.create_document(
+                CUSTOMER_CREDITS_COLLECTION, 'cc4', {'customer_id': 'c1', 'business_id': 'b3', 'current_balance': 0})
+            appwrite_db_instance.update_document(CUSTOMER_CREDITS_COLLECTION, 'cc1', {'current_balance': 60})
+            # Moves from c2's list to c1's
+            appwrite_db_instance.update_document(CUSTOMER_CREDITS_COLLECTION, 'cc3', {'customer_id': 'c1'})
+            appwrite_db_instance.delete_document(CUSTOMER_CREDITS_COLLECTION, 'cc2')
+            writes = len(database.calls)
+
+            assert _ids(_credits('c1')) == ['cc1', 'cc3', 'cc4']
+            assert _ids(_credits('c1', projection='balance')) == ['cc1', 'cc3', 'cc4']
+            assert _credits('c2') == []
+            balances = {doc['$id']: doc['current_balance'] for doc in _credits('c1')}
+            assert balances == {'cc1': 60, 'cc3': 10, 'cc4': 0}
+            assert appwrite_db_instance.get_document(CUSTOMER_CREDITS_COLLECTION, 'cc1')['current_balance'] == 60
+            assert appwrite_db_instance.get_document(CUSTOMER_CREDITS_COLLECTION, 'cc2') is None
+            assert len(database.calls) == writes == reads + 4, database.calls
+    _with_database(run)
+
+
+def test_other_lists_are_dropped_after_a_write():
+    def run(database):
+        with app.app_context():
+            limited = [Query.equal('customer_id', 'c1'), Query.limit(1)]
+            ordered = [Query.equal('customer_id', 'c1'), Query.order_desc('current_balance')]
+            for queries in (limited, ordered):
+                appwrite_db_instance.list_documents(CUSTOMER_CREDITS_COLLECTION, queries)
+            transactions = appwrite_db_instance.list_documents(TRANSACTIONS_COLLECTION, [Query.limit(1)])
+            reads = len(database.calls)
+
+            appwrite_db_instance.update_document(CUSTOMER_CREDITS_COLLECTION, 'cc2', {'current_balance': 500})
+            # Can't tell where the document falls in an ordered or limited list: both are read again
+            for queries in (limited, ordered):
+                appwrite_db_instance.list_documents(CUSTOMER_CREDITS_COLLECTION, queries)
+            assert len(database.calls) == reads + 3
+            # Lists of other collections are untouched
+            assert appwrite_db_instance.list_documents(TRANSACTIONS_COLLECTION, [Query.limit(1)]) == transactions
+            assert len(database.calls) == reads + 3
+    _with_database(run)
+
+
+def test_failed_write_forgets_what_it_touched():
+    def run(database):
+        with app.app_context():
+            _credits('c1')
+            appwrite_db_instance.get_document(CUSTOMER_CREDITS_COLLECTION, 'cc1')
+            reads = len(database.calls)
+
+            database.fail_writes = True
+            assert appwrite_db_instance.update_document(CUSTOMER_CREDITS_COLLECTION, 'cc1', {'current_balance': 0}) is None
+            # Someone else changed it; the request must see their version, not what it had cached
+            database.documents[CUSTOMER_CREDITS_COLLECTION]['cc1']['current_balance'] = 75
+            assert appwrite_db_instance.get_document(CUSTOMER_CREDITS_COLLECTION, 'cc1')['current_balance'] == 75
+            assert {doc['$id']: doc['current_balance'] for doc in _credits('c1')}['cc1'] == 75
+            assert len(database.calls) == reads + 3
+    _with_database(run)
+
+
+if __name__ == "__main__":
+    for test in (test_no_map_outside_a_request, test_one_map_per_request,
+                 test_write_through_for_equality_filtered_lists, test_other_lists_are_dropped_after_a_write,
+                 test_failed_write_forgets_what_it_touched):
+        test()
+        print(f"✅ {test.__name__}")
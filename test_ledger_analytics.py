@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Test spending insights (ledger_analytics) against a small ledger worked out
+by hand, and that cached insights follow the customer's ledger version.
+"""
+import os
+for name in ('APPWRITE_ENDPOINT', 'APPWRITE_PROJECT_ID', 'APPWRITE_API_KEY', 'APPWRITE_DATABASE_ID'):
+    os.environ.setdefault(name, 'http://localhost:9/v1' if name == 'APPWRITE_ENDPOINT' else 'test')
+
+import ledger_analytics
+from ledger_analytics import load_ledger_columns, compute_insights
+
+
+def _tx(business_id, transaction_type, amount, day):
+    return {'business_id': business_id, 'transaction_type': transaction_type, 'amount': amount,
+            'created_at': f"2026-{day}T10:00:00+05:30"}
+
+
+# Out of order on purpose; load_ledger_columns sorts by day
+LEDGER = [
+    _tx('A', 'payment', 90, '02-04'),
+    _tx('A', 'credit', 100, '01-01'),
+    _tx('B', 'credit', 200, '01-10'),
+    _tx('A', 'credit', 50, '01-05'),
+    _tx('A', 'payment', 60, '01-11'),
+    _tx('B', 'payment', 200, '01-20'),
+    _tx('B', 'credit', 30, '02-15'),
+    {'business_id': 'A', 'transaction_type': 'refund', 'amount': 5, 'created_at': '2026-01-02'},
+]
+NAMES = {'A': 'Asha Stores', 'B': 'Bharat Medicals'}
+
+
+def test_hand_computed_ledger():
+    insights = compute_insights(load_ledger_columns(LEDGER), NAMES)
+    assert insights['transaction_count'] == 7
+    assert (insights['total_credit'], insights['total_payment'], insights['outstanding']) == (380.0, 350.0, 30.0)
+
+    # A: payments reach 100 (and 150) on Feb 4, so credits of Jan 1 and Jan 5 took 34 and 30 days:
+    # (100*34 + 50*30) / 150 = 32.7. B: 200 taken Jan 10, repaid Jan 20; the Feb 15 credit is still open.
+    by_business = {row['business_id']: row for row in insights['businesses']}
+    assert by_business['A']['avg_days_to_repay'] == 32.7
+    assert by_business['B']['avg_days_to_repay'] == 10.0
+    # (100*34 + 50*30 + 200*10) / 350
+    assert insights['avg_days_to_repay'] == 19.7
+    assert (by_business['A']['outstanding'], by_business['B']['outstanding']) == (0.0, 30.0)
+
+    assert insights['monthly'] == [
+        {'business_id': 'A', 'business_name': 'Asha Stores', 'month': '2026-01', 'credit': 150.0, 'payment': 60.0},
+        {'business_id': 'B', 'business_name': 'Bharat Medicals', 'month': '2026-01', 'credit': 200.0, 'payment': 200.0},
+        {'business_id': 'A', 'business_name': 'Asha Stores', 'month': '2026-02', 'credit': 0.0, 'payment': 90.0},
+        {'business_id': 'B', 'business_name': 'Bharat Medicals', 'month': '2026-02', 'credit': 30.0, 'payment': 0.0},
+    ]
+    # Jan: +150 -60 +200 -200 = 90; Feb: -90 +30
+    assert insights['trend'] == [{'month': '2026-01', 'outstanding': 90.0}, {'month': '2026-02', 'outstanding': 30.0}]
+
+
+def test_partial_repayment_is_not_counted():
+    # 60 of the 100 is paid back: the credit isn't repaid yet, so there is no average
+    insights = compute_insights(load_ledger_columns([_tx('A', 'credit', 100, '03-01'), _tx('A', 'payment', 60, '03-09')]))
+    assert insights['avg_days_to_repay'] is None
+    assert insights['businesses'][0]['outstanding'] == 40.0
+
+
+def test_insights_follow_ledger_version():
+    loads = []
+    original_iter, original_read_many = ledger_analytics.iter_customer_transactions, ledger_analytics.read_many
+    ledger_analytics.iter_customer_transactions = lambda customer_id, **options: loads.append(customer_id) or iter(LEDGER)
+    ledger_analytics.read_many = lambda reads: [{'name': NAMES[read[2]]} for read in reads]
+    try:
+        first = ledger_analytics.get_customer_insights('c1', 'credit@1|tx@1')
+        assert ledger_analytics.get_customer_insights('c1', 'credit@1|tx@1') == first
+        assert len(loads) == 1
+        # A transaction recorded anywhere (another worker, the business app) changes the version
+        ledger_analytics.get_customer_insights('c1', 'credit@1|tx@2')
+        assert len(loads) == 2
+        # No version to key on: always computed
+        ledger_analytics.get_customer_insights('c1')
+        ledger_analytics.get_customer_insights('c1')
+        assert len(loads) == 4
+    finally:
+        ledger_analytics.iter_customer_transactions, ledger_analytics.read_many = original_iter, original_read_many
+
+
+if __name__ == "__main__":
+    for test in (test_hand_computed_ledger, test_partial_repayment_is_not_counted, test_insights_follow_ledger_version):
+        test()
+        print(f"✅ {test.__name__}")
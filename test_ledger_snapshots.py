@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Test ledger snapshot fallbacks (ledger_snapshots) offline: slow live loads
+never pile up behind one another, ledger version checks don't wait behind
+them, and loaders read through an identity map of their own.
+"""
+import os
+for name in ('APPWRITE_ENDPOINT', 'APPWRITE_PROJECT_ID', 'APPWRITE_API_KEY', 'APPWRITE_DATABASE_ID'):
+    os.environ.setdefault(name, 'http://localhost:9/v1' if name == 'APPWRITE_ENDPOINT' else 'test')
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+import ledger_snapshots
+from ledger_snapshots import load_with_snapshot, within_latency_budget, save_snapshot, snapshot_key
+from identity_map import current_identity_map
+
+
+class BlockingLoader:
+    """A live load that hangs until released, counting how often it ran"""
+
+    def __init__(self, value='live'):
+        self.value = value
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait(5)
+        return self.value
+
+
+def _with_executor(max_workers, test):
+    original = ledger_snapshots._executor
+    ledger_snapshots._executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        return test()
+    finally:
+        ledger_snapshots._executor.shutdown(wait=False, cancel_futures=True)
+        ledger_snapshots._executor = original
+
+
+def _snapshot(name, parts, data='snapshot'):
+    save_snapshot(snapshot_key(name, parts), data)
+
+
+def test_slow_loads_join_the_one_in_flight():
+    def run():
+        _snapshot('businesses', ['c1'])
+        loader = BlockingLoader()
+        for _ in range(5):
+            data, as_of = load_with_snapshot('businesses', ['c1'], loader, budget=0.05)
+            assert data == 'snapshot' and as_of is not None
+        assert loader.calls == 1, f"{loader.calls} live loads queued for one page"
+        loader.release.set()
+        time.sleep(0.1)
+        # The load that was left running refreshed the snapshot
+        assert load_with_snapshot('businesses', ['c1'], lambda: 'live again', budget=1) == ('live again', None)
+    _with_executor(4, run)
+
+
+def test_queued_load_is_cancelled_when_budget_expires():
+    def run():
+        _snapshot('business', ['c1', 'b1'])
+        _snapshot('business', ['c1', 'b2'])
+        stuck, queued = BlockingLoader(), BlockingLoader()
+        load_with_snapshot('business', ['c1', 'b1'], stuck, budget=0.05)
+        # The only worker is busy, so this load is still queued when the budget runs out
+        data, as_of = load_with_snapshot('business', ['c1', 'b2'], queued, budget=0.05)
+        assert data == 'snapshot' and as_of is not None
+        stuck.release.set()
+        queued.release.set()
+        time.sleep(0.2)
+        assert stuck.calls == 1 and queued.calls == 0, (stuck.calls, queued.calls)
+        assert ledger_snapshots._refreshes == {}
+    _with_executor(1, run)
+
+
+def test_version_check_does_not_wait_behind_loads():
+    def run():
+        loaders = [BlockingLoader() for _ in range(2)]
+        for index, loader in enumerate(loaders):
+            _snapshot('business', ['c2', index])
+            load_with_snapshot('business', ['c2', index], loader, budget=0.01)
+        started = time.monotonic()
+        assert within_latency_budget(lambda customer_id: f"v-{customer_id}", 'c2', budget=1) == 'v-c2'
+        assert time.monotonic() - started < 0.5
+        for loader in loaders:
+            loader.release.set()
+    _with_executor(2, run)
+
+
+def test_loaders_run_with_an_identity_map():
+    app = Flask(__name__)
+    seen = []
+
+    def loader():
+        seen.append(current_identity_map() is not None)
+        return 'live'
+
+    with app.test_request_context('/dashboard'):
+        _snapshot('businesses', ['c3'])
+        assert load_with_snapshot('businesses', ['c3'], loader, budget=1) == ('live', None)
+        assert within_latency_budget(lambda: current_identity_map() is not None, budget=1)
+    assert seen == [True]
+
+
+if __name__ == "__main__":
+    for test in (test_slow_loads_join_the_one_in_flight, test_queued_load_is_cancelled_when_budget_expires,
+                 test_version_check_does_not_wait_behind_loads, test_loaders_run_with_an_identity_map):
+        test()
+        print(f"✅ {test.__name__}")
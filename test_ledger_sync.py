@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test /api/sync cursors (ledger_sync.sync_changes) offline: watermarks of
+quiet streams advance, so a client syncing daily is never forced into a
+full reset by the tombstone retention window, and expired tombstones are
+purged off the request thread.
+"""
+import os
+for name in ('APPWRITE_ENDPOINT', 'APPWRITE_PROJECT_ID', 'APPWRITE_API_KEY', 'APPWRITE_DATABASE_ID'):
+    os.environ.setdefault(name, 'http://localhost:9/v1' if name == 'APPWRITE_ENDPOINT' else 'test')
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import appwrite_utils
+import ledger_sync
+from appwrite_utils import appwrite_db_instance, TRANSACTIONS_COLLECTION, TOMBSTONE_RETENTION_DAYS
+
+CUSTOMER_ID = '11111111-1111-1111-1111-111111111111'
+START = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class LedgerDatabase:
+    """Just enough of Databases.list_documents for the sync queries; $updatedAt is set by the test"""
+
+    def __init__(self):
+        self.collections = {}
+        self.deletes_started = threading.Event()
+        self.release_deletes = threading.Event()
+
+    def put(self, collection_id, document):
+        self.collections.setdefault(collection_id, {})[document['$id']] = document
+
+    def list_documents(self, database_id, collection_id, queries=None):
+        documents = list(self.collections.get(collection_id, {}).values())
+        limit, cursor = 25, None
+        for query in map(json.loads, queries or []):
+            method, attribute, values = query['method'], query.get('attribute'), query.get('values', [])
+            if method == 'equal':
+                documents = [doc for doc in documents if doc.get(attribute) in values]
+            elif method == 'greaterThanEqual':
+                documents = [doc for doc in documents
+                             if datetime.fromisoformat(doc[attribute]) >= datetime.fromisoformat(values[0])]
+            elif method == 'lessThan':
+                documents = [doc for doc in documents if doc.get(attribute, '') < values[0]]
+            elif method == 'orderAsc':
+                documents.sort(key=lambda doc: (datetime.fromisoformat(doc[attribute]), doc['$id']))
+            elif method == 'limit':
+                limit = values[0]
+            elif method == 'cursorAfter':
+                cursor = values[0]
+        if cursor:
+            documents = documents[[doc['$id'] for doc in documents].index(cursor) + 1:]
+        return {'total': len(documents), 'documents': documents[:limit]}
+
+    def delete_document(self, database_id, collection_id, document_id):
+        self.deletes_started.set()
+        self.release_deletes.wait(5)
+        self.collections.get(collection_id, {}).pop(document_id, None)
+        return {}
+
+
+def _transaction(document_id, updated_at):
+    return {'$id': document_id, '$updatedAt': updated_at.isoformat(), 'customer_id': CUSTOMER_ID,
+            'business_id': 'b1', 'amount': 10, 'transaction_type': 'credit'}
+
+
+def _with_database(test):
+    database = LedgerDatabase()
+    original_db, original_now = appwrite_db_instance.db, ledger_sync._utc_now
+    appwrite_db_instance.db = database
+    try:
+        return test(database)
+    finally:
+        appwrite_db_instance.db = original_db
+        ledger_sync._utc_now = original_now
+        database.release_deletes.set()
+
+
+def test_daily_sync_never_resets():
+    def run(database):
+        database.put(TRANSACTIONS_COLLECTION, _transaction('t1', START - timedelta(hours=1)))
+        ledger_sync._utc_now = lambda: START
+        first = ledger_sync.sync_changes(CUSTOMER_ID)
+        assert first['full'] and [tx['id'] for tx in first['transactions']] == ['t1']
+
+        cursor = first['cursor']
+        for day in range(1, TOMBSTONE_RETENTION_DAYS + 5):
+            ledger_sync._utc_now = lambda day=day: START + timedelta(days=day)
+            changes = ledger_sync.sync_changes(CUSTOMER_ID, cursor)
+            assert not changes['reset'], f"reset on day {day}"
+            assert changes['transactions'] == [], f"re-sent old transactions on day {day}"
+            cursor = changes['cursor']
+    _with_database(run)
+
+
+def test_change_inside_overlap_is_not_skipped():
+    def run(database):
+        ledger_sync._utc_now = lambda: START
+        cursor = ledger_sync.sync_changes(CUSTOMER_ID)['cursor']
+        # Committed just before the cursor was issued, but only visible afterwards
+        database.put(TRANSACTIONS_COLLECTION, _transaction('late', START - timedelta(seconds=2)))
+        ledger_sync._utc_now = lambda: START + timedelta(minutes=1)
+        changes = ledger_sync.sync_changes(CUSTOMER_ID, cursor)
+        assert [tx['id'] for tx in changes['transactions']] == ['late'], changes
+    _with_database(run)
+
+
+def test_tombstone_purge_runs_off_the_request():
+    def run(database):
+        database.put(appwrite_utils.DELETED_DOCUMENTS_COLLECTION, {
+            '$id': 'old', '$updatedAt': START.isoformat(), 'customer_id': CUSTOMER_ID, 'deleted_at': '2000-01-01T00:00:00'
+        })
+        appwrite_utils._last_tombstone_purge = time.monotonic() - appwrite_utils.TOMBSTONE_PURGE_INTERVAL - 1
+        ledger_sync._utc_now = lambda: START
+        started = time.monotonic()
+        ledger_sync.sync_changes(CUSTOMER_ID)
+        # delete_document blocks until released, so an inline purge would hold the sync for 5s
+        assert time.monotonic() - started < 1, "sync waited for the tombstone purge"
+        assert database.deletes_started.wait(5), "expired tombstone was never purged"
+    _with_database(run)
+
+
+if __name__ == "__main__":
+    for test in (test_daily_sync_never_resets, test_change_inside_overlap_is_not_skipped,
+                 test_tombstone_purge_runs_off_the_request):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test the service worker's offline outbox replay (static/sw.js) under Node:
+a queued transaction is only deleted once the server has recorded it, and
+is kept (honouring Retry-After) while the server is unhealthy.
+"""
+import json
+import os
+import shutil
+import subprocess
+
+SW_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'sw.js')
+
+# Loads sw.js into a sandbox with an in-memory outbox and a scripted fetch,
+# runs replayOutbox() once per scenario and prints what is left in the outbox.
+HARNESS = r"""
+const fs = require('fs');
+const vm = require('vm');
+const scenarios = JSON.parse(process.argv[2]);
+
+async function run(scenario) {
+  const context = vm.createContext({
+    self: { location: 'https://khatape.test/sw.js', addEventListener() {}, registration: {},
+            clients: { matchAll: async () => [] } },
+    URL, FormData, Promise, console, Date, Object, Error, isNaN, parseInt
+  });
+  vm.runInContext(fs.readFileSync(process.argv[1], 'utf8'), context);
+  const outbox = {
+    a: { id: 'a', url: 'https://khatape.test/transaction/payment/b1', entries: [], queuedAt: 1 },
+    b: { id: 'b', url: 'https://khatape.test/transaction/credit/b1', entries: [], queuedAt: 2 }
+  };
+  const messages = [];
+  let fetches = 0;
+  context.ledgerTransaction = async function(mode, work) {
+    const result = work({
+      index: () => ({ getAll: () => ({ result: Object.values(outbox).sort((x, y) => x.queuedAt - y.queuedAt) }) }),
+      put: (record) => { outbox[record.id] = record; },
+      delete: (id) => { delete outbox[id]; }
+    });
+    return result && result.result;
+  };
+  context.notifyClients = async (message) => { messages.push(message.type); };
+  context.fetch = async function() {
+    const answer = scenario.responses[Math.min(fetches++, scenario.responses.length - 1)];
+    return {
+      url: 'https://khatape.test' + answer.path, status: answer.status,
+      ok: answer.status >= 200 && answer.status < 300, redirected: !!answer.redirected,
+      headers: { get: (name) => (answer.headers || {})[name] || null }
+    };
+  };
+  let rejected = false;
+  try { await context.replayOutbox(); } catch (e) { rejected = true; }
+  const deferredMs = vm.runInContext('outboxRetryAt', context) - Date.now();
+  let rejectedAgain = false;
+  try { await context.replayOutbox(); } catch (e) { rejectedAgain = true; }
+  return { left: Object.keys(outbox).sort(), rejected, rejectedAgain, fetches, messages,
+           deferredSeconds: Math.round(deferredMs / 1000),
+           flagged: Object.values(outbox).filter((record) => record.rejected).map((record) => record.id) };
+}
+
+(async () => {
+  const results = {};
+  for (const [name, scenario] of Object.entries(scenarios)) {
+    results[name] = await run(scenario);
+  }
+  console.log(JSON.stringify(results));
+})();
+"""
+
+SCENARIOS = {
+    'recorded': {'responses': [{'path': '/business/b1', 'status': 200, 'redirected': True}]},
+    'unavailable': {'responses': [{'path': '/transaction/payment/b1', 'status': 503, 'headers': {'Retry-After': '120'}}]},
+    'shed': {'responses': [{'path': '/transaction/payment/b1', 'status': 429}]},
+    'ledger_page_down': {'responses': [{'path': '/business/b1', 'status': 503, 'redirected': True}]},
+    'server_error': {'responses': [{'path': '/transaction/payment/b1', 'status': 500}]},
+    'login': {'responses': [{'path': '/login', 'status': 200, 'redirected': True}]},
+    'form_error': {'responses': [{'path': '/transaction/payment/b1', 'status': 200},
+                                 {'path': '/business/b1', 'status': 200, 'redirected': True}]},
+}
+
+
+def replay_results():
+    output = subprocess.run(['node', '-e', HARNESS, SW_PATH, json.dumps(SCENARIOS)],
+                            capture_output=True, text=True, check=True, timeout=60).stdout
+    return json.loads(output)
+
+
+def test_outbox_replay():
+    if not shutil.which('node'):
+        print("⚠️ Node.js not installed, skipping service worker outbox test")
+        return
+    results = replay_results()
+
+    recorded = results['recorded']
+    assert recorded['left'] == [] and not recorded['rejected'], recorded
+    assert 'transactions-synced' in recorded['messages'], recorded
+
+    unavailable = results['unavailable']
+    assert unavailable['left'] == ['a', 'b'], unavailable
+    assert unavailable['rejected'] and unavailable['fetches'] == 1, unavailable
+    # The second replay inside the Retry-After window sends nothing
+    assert unavailable['rejectedAgain'] and 115 <= unavailable['deferredSeconds'] <= 120, unavailable
+
+    shed = results['shed']
+    assert shed['left'] == ['a', 'b'] and shed['rejected'] and shed['deferredSeconds'] > 0, shed
+
+    for name in ('ledger_page_down', 'server_error'):
+        assert results[name]['left'] == ['a', 'b'] and results[name]['rejected'], results[name]
+
+    login = results['login']
+    assert login['left'] == ['a', 'b'] and not login['rejected'], login
+
+    # A submit the server refused stays queued (flagged) but doesn't hold up the rest
+    form_error = results['form_error']
+    assert form_error['left'] == ['a'] and form_error['flagged'] == ['a'], form_error
+    assert 'transaction-rejected' in form_error['messages'], form_error
+
+
+if __name__ == "__main__":
+    test_outbox_replay()
+    print("✅ test_outbox_replay")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test /pending_payments offline: expired requests are hidden from the list
+straight away, and the global sweep that marks them expired runs on a
+background thread instead of inside the customer's request.
+"""
+import os
+for name in ('APPWRITE_ENDPOINT', 'APPWRITE_PROJECT_ID', 'APPWRITE_API_KEY', 'APPWRITE_DATABASE_ID'):
+    os.environ.setdefault(name, 'http://localhost:9/v1' if name == 'APPWRITE_ENDPOINT' else 'test')
+os.environ.setdefault('BUSINESS_PIN_INDEX', '0')
+os.environ.setdefault('ADMISSION_MAX_CONCURRENCY', '1000')
+
+import json
+import threading
+import time
+
+import appwrite_utils
+from appwrite_utils import appwrite_db_instance, PENDING_STATUS
+
+CUSTOMER_ID = '11111111-1111-1111-1111-111111111111'
+
+
+class PendingPaymentsDatabase:
+    """Pending payments for many customers; every update is slow until released"""
+
+    def __init__(self):
+        self.documents = {}
+        self.updated = []
+        self.release_updates = threading.Event()
+
+    def put(self, document_id, customer_id, expires_at):
+        self.documents[document_id] = {
+            '$id': document_id, 'customer_id': customer_id, 'business_id': 'b1',
+            'business_name': f"Shop {document_id}",
+            'amount': 10, 'notes': '', 'status': PENDING_STATUS,
+            'created_at': '2026-01-01T10:00:00+05:30', 'expires_at': expires_at,
+        }
+
+    def list_documents(self, database_id, collection_id, queries=None):
+        documents = list(self.documents.values())
+        for query in map(json.loads, queries or []):
+            method, attribute, values = query['method'], query.get('attribute'), query.get('values', [])
+            if method == 'equal':
+                documents = [doc for doc in documents if doc.get(attribute) in values]
+            elif method == 'greaterThan':
+                documents = [doc for doc in documents if doc[attribute] > values[0]]
+            elif method == 'lessThanEqual':
+                documents = [doc for doc in documents if doc[attribute] <= values[0]]
+            elif method == 'cursorAfter':
+                documents = []
+        return {'total': len(documents), 'documents': documents}
+
+    def update_document(self, database_id, collection_id, document_id, data):
+        self.release_updates.wait(5)
+        self.documents[document_id].update(data)
+        self.updated.append(document_id)
+        return self.documents[document_id]
+
+
+def test_sweep_runs_off_the_request():
+    from app import customer_app
+
+    database = PendingPaymentsDatabase()
+    database.put('live', CUSTOMER_ID, '2999-01-01T00:00:00+05:30')
+    database.put('mine-expired', CUSTOMER_ID, '2000-01-01T00:00:00+05:30')
+    for index in range(20):
+        database.put(f"other-{index}", f"customer-{index}", '2000-01-01T00:00:00+05:30')
+
+    original_db = appwrite_db_instance.db
+    appwrite_db_instance.db = database
+    appwrite_utils._last_pending_sweep = time.monotonic() - appwrite_utils.PENDING_PAYMENT_SWEEP_INTERVAL - 1
+    try:
+        with customer_app.test_client() as client:
+            with client.session_transaction() as session:
+                session['user_id'] = 'u1'
+                session['user_type'] = 'customer'
+                session['customer_id'] = CUSTOMER_ID
+            started = time.monotonic()
+            response = client.get('/pending_payments')
+            # Every update blocks until released, so an inline sweep would hold the page for seconds
+            assert time.monotonic() - started < 1, "the page waited for the sweep"
+            assert response.status_code == 200
+            page = response.get_data(as_text=True)
+            assert 'Shop live' in page and 'Shop mine-expired' not in page
+
+            database.release_updates.set()
+            deadline = time.monotonic() + 5
+            while len(database.updated) < 21 and time.monotonic() < deadline:
+                time.sleep(0.02)
+            assert sorted(database.updated) == sorted(['mine-expired'] + [f"other-{index}" for index in range(20)])
+            assert database.documents['live']['status'] == PENDING_STATUS
+    finally:
+        database.release_updates.set()
+        appwrite_db_instance.db = original_db
+
+
+if __name__ == "__main__":
+    test_sweep_runs_off_the_request()
+    print("✅ test_sweep_runs_off_the_request")
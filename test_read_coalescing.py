@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test read coalescing (appwrite_resilience.read_flights) offline: identical
+concurrent reads share one Appwrite call, but a read issued after a write
+never joins a read that started before it, so the balance recomputed after
+recording a transaction always includes that transaction.
+"""
+import os
+for name in ('APPWRITE_ENDPOINT', 'APPWRITE_PROJECT_ID', 'APPWRITE_API_KEY', 'APPWRITE_DATABASE_ID'):
+    os.environ.setdefault(name, 'http://localhost:9/v1' if name == 'APPWRITE_ENDPOINT' else 'test')
+
+import json
+import threading
+
+from appwrite_utils import (
+    appwrite_db_instance, create_transaction, get_customer_transactions, TRANSACTIONS_COLLECTION,
+)
+from appwrite_resilience import read_flights
+
+CUSTOMER_ID = '11111111-1111-1111-1111-111111111111'
+BUSINESS_ID = '22222222-2222-2222-2222-222222222222'
+
+
+class SlowListDatabase:
+    """Transactions whose first list call is held until the test releases it"""
+
+    def __init__(self):
+        self.documents = {'t1': {'$id': 't1', 'customer_id': CUSTOMER_ID, 'business_id': BUSINESS_ID,
+                                 'transaction_type': 'credit', 'amount': 100}}
+        self.list_calls = 0
+        self.first_list_started = threading.Event()
+        self.release_first_list = threading.Event()
+
+    def list_documents(self, database_id, collection_id, queries=None):
+        self.list_calls += 1
+        # Snapshot before blocking: this is what Appwrite had when the read arrived
+        filters = [json.loads(query) for query in queries or []]
+        documents = [dict(doc) for doc in self.documents.values()
+                     if all(doc.get(f['attribute']) in f['values'] for f in filters if f['method'] == 'equal')]
+        if self.list_calls == 1:
+            self.first_list_started.set()
+            self.release_first_list.wait(5)
+        return {'total': len(documents), 'documents': documents}
+
+    def create_document(self, database_id, collection_id, document_id, data):
+        document = dict(data, **{'$id': document_id})
+        self.documents[document_id] = document
+        return document
+
+
+def _with_database(test):
+    database = SlowListDatabase()
+    original_db = appwrite_db_instance.db
+    appwrite_db_instance.db = database
+    try:
+        return test(database)
+    finally:
+        database.release_first_list.set()
+        appwrite_db_instance.db = original_db
+
+
+def _balance(transactions):
+    return sum(float(tx['amount']) * (1 if tx['transaction_type'] == 'credit' else -1) for tx in transactions)
+
+
+def test_concurrent_identical_reads_share_one_call():
+    def run(database):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            get_customer_transactions(CUSTOMER_ID, BUSINESS_ID, projection='balance'))) for _ in range(4)]
+        threads[0].start()
+        assert database.first_list_started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        database.release_first_list.set()
+        for thread in threads:
+            thread.join(5)
+        assert database.list_calls == 1, database.list_calls
+        assert [_balance(result) for result in results] == [100.0] * 4
+    _with_database(run)
+
+
+def test_read_after_write_does_not_join_older_flight():
+    def run(database):
+        # Another request's balance read is in flight, holding the pre-write list
+        other = []
+        reader = threading.Thread(target=lambda: other.append(
+            get_customer_transactions(CUSTOMER_ID, BUSINESS_ID, projection='balance')))
+        reader.start()
+        assert database.first_list_started.wait(5)
+
+        assert create_transaction({'customer_id': CUSTOMER_ID, 'business_id': BUSINESS_ID,
+                                   'transaction_type': 'payment', 'amount': 40}, transaction_id='t2')
+        # The recompute in customer_transaction: must see t2 without waiting for the older read
+        recomputed = []
+        recompute = threading.Thread(target=lambda: recomputed.append(
+            get_customer_transactions(CUSTOMER_ID, BUSINESS_ID, projection='balance')))
+        recompute.start()
+        recompute.join(2)
+        assert not recompute.is_alive(), "the post-write read joined the flight started before the write"
+        assert _balance(recomputed[0]) == 60.0, recomputed
+
+        database.release_first_list.set()
+        reader.join(5)
+        assert _balance(other[0]) == 100.0
+        assert read_flights._flights == {}, "a finished flight was left behind"
+    _with_database(run)
+
+
+if __name__ == "__main__":
+    for test in (test_concurrent_identical_reads_share_one_call, test_read_after_write_does_not_join_older_flight):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Test that CSV statement exports can't carry spreadsheet formulas: text a
+business or customer typed (notes, business names) is written so Excel
+and Sheets show it as text, while amounts stay numbers.
+"""
+import os
+for name in ('APPWRITE_ENDPOINT', 'APPWRITE_PROJECT_ID', 'APPWRITE_API_KEY', 'APPWRITE_DATABASE_ID'):
+    os.environ.setdefault(name, 'http://localhost:9/v1' if name == 'APPWRITE_ENDPOINT' else 'test')
+
+import csv
+import io
+
+from statement_export import stream_csv
+
+
+def _read_csv(rows):
+    text = b''.join(stream_csv(iter(rows))).decode('utf-8-sig')
+    return list(csv.reader(io.StringIO(text)))[1:]
+
+
+def test_csv_cells_are_not_formulas():
+    notes = ['=HYPERLINK("http://evil.test","Click")', '+1+cmd|/C calc!A0', '-2+3', '@SUM(A1:A2)',
+             '\t=1+1', '\r=1+1']
+    rows = [['March 01, 2026', 'Shop', 'Credit', 10.0, '', note, 10.0] for note in notes]
+    for row, note in zip(_read_csv(rows), notes):
+        assert row[5] == "'" + note, row
+
+
+def test_csv_numbers_and_plain_text_unchanged():
+    rows = [['March 01, 2026', '=Evil Traders', 'Payment', '', 25.5, 'paid in cash', -14.5]]
+    [row] = _read_csv(rows)
+    assert row == ['March 01, 2026', "'=Evil Traders", 'Payment', '', '25.5', 'paid in cash', '-14.5'], row
+
+
+if __name__ == "__main__":
+    for test in (test_csv_cells_are_not_formulas, test_csv_numbers_and_plain_text_unchanged):
+        test()
+        print(f"✅ {test.__name__}")
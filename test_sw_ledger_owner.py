@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test that the service worker (static/sw.js) never serves one customer's
+cached ledger to another: signing in as someone else drops the cached
+ledger and holds the previous customer's queued transactions.
+"""
+import json
+import os
+import shutil
+import subprocess
+
+SW_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'sw.js')
+
+# Loads sw.js into a sandbox with in-memory IndexedDB stores, then signs in as
+# customer A, caches a ledger response, queues a submit, and signs in as B and back as A.
+HARNESS = r"""
+const fs = require('fs');
+const vm = require('vm');
+
+const context = vm.createContext({
+  self: { location: 'https://khatape.test/sw.js', addEventListener() {}, registration: {},
+          clients: { matchAll: async () => [] }, crypto: globalThis.crypto },
+  caches: { open: async () => ({ keys: async () => [], delete: async () => true }) },
+  URL, Response, FormData, TextEncoder, Uint8Array, Array, String, Promise, console, Date, Object, Error, isNaN, parseInt, JSON
+});
+vm.runInContext(fs.readFileSync(process.argv[1], 'utf8'), context);
+
+const keyPaths = { responses: 'url', outbox: 'id', meta: 'key' };
+const stores = { responses: {}, outbox: {}, meta: {} };
+context.ledgerTransaction = async function(mode, work, storeName) {
+  const name = storeName || 'responses';
+  const data = stores[name];
+  const result = work({
+    get: (key) => ({ result: data[key] }),
+    put: (record) => { data[record[keyPaths[name]]] = record; },
+    delete: (key) => { delete data[key]; },
+    clear: () => { for (const key of Object.keys(data)) delete data[key]; },
+    index: () => ({ getAll: () => ({ result: Object.values(data).sort((x, y) => x.queuedAt - y.queuedAt) }) })
+  });
+  return result && result.result;
+};
+
+const posted = [];
+context.fetch = async function(request) {
+  if (typeof request !== 'string' && request.signIn) {
+    return { type: 'opaqueredirect', redirected: false, url: '' };
+  }
+  if (typeof request !== 'string') {
+    posted.push(request);
+    return { url: 'https://khatape.test/business/b1', status: 200, ok: true, redirected: true,
+             headers: { get: () => null } };
+  }
+  if (String(request).indexOf('/transaction/') !== -1) {
+    posted.push(request);
+    return { url: 'https://khatape.test/business/b1', status: 200, ok: true, redirected: true,
+             headers: { get: () => null } };
+  }
+  return new Response(JSON.stringify({ success: true, businesses: [{ name: 'A shop' }] }),
+                      { status: 200, headers: { 'Content-Type': 'application/json', 'ETag': '"a"' } });
+};
+
+function signInRequest(phone) {
+  const request = { signIn: true, clone: () => ({ formData: async () => new Map([['phone', phone]]) }) };
+  return request;
+}
+
+(async () => {
+  const results = {};
+  await context.handleSignIn(signInRequest('+91 98765 43210'));
+  await context.revalidateLedger('/api/businesses', null);
+  results.cachedForA = !!(await context.getLedgerRecord('/api/businesses'));
+  stores.outbox.q1 = { id: 'q1', url: 'https://khatape.test/transaction/payment/b1', entries: [], queuedAt: 1,
+                       owner: await context.getLedgerOwner() };
+
+  await context.handleSignIn(signInRequest('9123456789'));
+  results.cachedForB = !!(await context.getLedgerRecord('/api/businesses'));
+  results.responsesLeftForB = Object.keys(stores.responses).length;
+  await new Promise((resolve) => setTimeout(resolve, 10));
+  results.postedForB = posted.length;
+  results.heldForA = Object.keys(stores.outbox);
+
+  await context.handleSignIn(signInRequest('9876543210'));
+  await new Promise((resolve) => setTimeout(resolve, 10));
+  results.postedForA = posted.length;
+  results.outboxAfterA = Object.keys(stores.outbox);
+  console.log(JSON.stringify(results));
+})();
+"""
+
+
+def test_ledger_cache_is_per_customer():
+    if not shutil.which('node'):
+        print("⚠️ Node.js not installed, skipping service worker ledger owner test")
+        return
+    output = subprocess.run(['node', '-e', HARNESS, SW_PATH], capture_output=True, text=True,
+                            check=True, timeout=60).stdout
+    results = json.loads(output)
+    assert results['cachedForA'], results
+    assert not results['cachedForB'] and results['responsesLeftForB'] == 0, results
+    # A's queued payment is neither sent under B's session nor thrown away
+    assert results['postedForB'] == 0 and results['heldForA'] == ['q1'], results
+    # The same phone, formatted differently, is the same owner; A's submit goes out once A is back
+    assert results['postedForA'] == 1 and results['outboxAfterA'] == [], results
+
+
+if __name__ == "__main__":
+    test_ledger_cache_is_per_customer()
+    print("✅ test_ledger_cache_is_per_customer")
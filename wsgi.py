@@ -19,4 +19,4 @@ if __name__ == "__main__":
     from waitress import serve
     print("Starting KathaPe Customer App with Waitress...")
     print("Server will be available at: http://localhost:8080")
-    serve(application, host='0.0.0.0', port=8080, threads=4)
+    serve(application, host='0.0.0.0', port=8080, threads=8)